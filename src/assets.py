@@ -0,0 +1,25 @@
+import pyglet.image
+
+from src.constants import PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK
+
+# Images for pieces. They are kept apart from src.constants so that the rules of the game can be used without pyglet
+image_dict = {}
+
+# Load in the images
+def initialize():
+    image_dict[(WHITE, PAWN)] = pyglet.image.load('../assets/white_pawn.png')
+    image_dict[(WHITE, KNIGHT)] = pyglet.image.load('../assets/white_knight.png')
+    image_dict[(WHITE, BISHOP)] = pyglet.image.load('../assets/white_bishop.png')
+    image_dict[(WHITE, ROOK)] = pyglet.image.load('../assets/white_rook.png')
+    image_dict[(WHITE, QUEEN)] = pyglet.image.load('../assets/white_queen.png')
+    image_dict[(WHITE, KING)] = pyglet.image.load('../assets/white_king.png')
+    image_dict[(BLACK, PAWN)] = pyglet.image.load('../assets/black_pawn.png')
+    image_dict[(BLACK, KNIGHT)] = pyglet.image.load('../assets/black_knight.png')
+    image_dict[(BLACK, BISHOP)] = pyglet.image.load('../assets/black_bishop.png')
+    image_dict[(BLACK, ROOK)] = pyglet.image.load('../assets/black_rook.png')
+    image_dict[(BLACK, QUEEN)] = pyglet.image.load('../assets/black_queen.png')
+    image_dict[(BLACK, KING)] = pyglet.image.load('../assets/black_king.png')
+
+def get_image(piece):
+    key = (piece.color, piece.id)
+    return image_dict[key]
@@ -0,0 +1,48 @@
+import src.constants
+
+# Squares are numbered rank * 8 + file, the same as the ChessBoard mailbox. Directions and offsets are
+# (rank step, file step)
+ORTHOGONAL_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+DIAGONAL_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+KNIGHT_OFFSETS = [(2, 1), (2, -1), (-2, 1), (-2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2)]
+KING_OFFSETS = ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS
+
+# The (rank, file) tuple of every square, so that generated moves share these tuples instead of building new ones
+SQUARE_COORDINATES = [(square // 8, square % 8) for square in range(64)]
+
+
+# This function returns the squares reached from a square by each offset, leaving out the ones off the board
+def offsets_to_squares(square, offsets):
+    rank, file = SQUARE_COORDINATES[square]
+    return tuple((rank + rank_step) * 8 + file + file_step for (rank_step, file_step) in offsets
+                 if 0 <= rank + rank_step < 8 and 0 <= file + file_step < 8)
+
+
+# This function returns the squares from a square to the edge of the board in one direction, nearest first
+def ray_to_squares(square, rank_step, file_step):
+    ray = []
+    rank, file = SQUARE_COORDINATES[square]
+    rank, file = rank + rank_step, file + file_step
+    while 0 <= rank < 8 and 0 <= file < 8:
+        ray.append(rank * 8 + file)
+        rank, file = rank + rank_step, file + file_step
+    return tuple(ray)
+
+
+# This function returns the rays leaving a square in each of the directions, dropping the empty rays at the edges
+def rays_from_square(square, directions):
+    rays = [ray_to_squares(square, rank_step, file_step) for (rank_step, file_step) in directions]
+    return tuple(ray for ray in rays if ray)
+
+
+# Precomputed tables for every square on the board, already clipped to the board. Pieces walk these instead of
+# building their moves and filtering out the squares that fall off the board
+KNIGHT_TARGETS = [offsets_to_squares(square, KNIGHT_OFFSETS) for square in range(64)]
+KING_TARGETS = [offsets_to_squares(square, KING_OFFSETS) for square in range(64)]
+PAWN_ATTACKS = {
+    src.constants.WHITE: [offsets_to_squares(square, [(1, 1), (1, -1)]) for square in range(64)],
+    src.constants.BLACK: [offsets_to_squares(square, [(-1, 1), (-1, -1)]) for square in range(64)]
+}
+ORTHOGONAL_RAYS = [rays_from_square(square, ORTHOGONAL_DIRECTIONS) for square in range(64)]
+DIAGONAL_RAYS = [rays_from_square(square, DIAGONAL_DIRECTIONS) for square in range(64)]
+QUEEN_RAYS = [ORTHOGONAL_RAYS[square] + DIAGONAL_RAYS[square] for square in range(64)]
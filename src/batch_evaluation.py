@@ -0,0 +1,213 @@
+import argparse
+import random
+import sys
+import time
+
+try:
+    import numpy
+except ImportError as error:
+    raise ImportError('src.batch_evaluation needs NumPy, install it with pip install numpy') from error
+
+import src.constants
+import src.encoding
+from src.attack_tables import KNIGHT_TARGETS, ORTHOGONAL_DIRECTIONS, DIAGONAL_DIRECTIONS, ray_to_squares
+from src.bitboard import piece_index
+from src.board import ChessBoard
+from src.evaluation import evaluate, piece_value
+
+# Positions are packed into 12 planes of 64 squares, one plane per piece type and color in the order used by the
+# bitboard engine: white pawn, knight, bishop, rook, queen and king, then the same for black. A square is 1 in a plane
+# if that piece stands on it. Squares are numbered rank * 8 + file
+PLANE_COUNT = 12
+PLANE_IDS = [src.constants.PAWN, src.constants.KNIGHT, src.constants.BISHOP, src.constants.ROOK, src.constants.QUEEN,
+             src.constants.KING] * 2
+PLANE_COLORS = [src.constants.WHITE] * 6 + [src.constants.BLACK] * 6
+
+# The value of each piece on each square from white's point of view, so the material and piece-square score of a
+# position is the sum of its planes times this table
+PLANE_VALUES = numpy.array([
+    [piece_value(PLANE_IDS[plane], PLANE_COLORS[plane], square // 8, square % 8) *
+     (1 if PLANE_COLORS[plane] == src.constants.WHITE else -1) for square in range(64)]
+    for plane in range(PLANE_COUNT)
+], dtype=numpy.int32)
+
+# Centipawns for every square a piece attacks, used by the optional mobility term. Pawns and kings are left out
+MOBILITY_WEIGHTS = {
+    src.constants.KNIGHT: 4, src.constants.BISHOP: 5, src.constants.ROOK: 2, src.constants.QUEEN: 1
+}
+
+# The squares along each of the eight rays leaving every square, padded with square 64 past the edge of the board.
+# RAY_VALID marks the real squares. The first four rays are orthogonal and the last four diagonal
+RAY_DIRECTIONS = ORTHOGONAL_DIRECTIONS + DIAGONAL_DIRECTIONS
+RAY_SQUARES = numpy.full((64, 8, 7), 64, dtype=numpy.intp)
+for ray_square in range(64):
+    for ray_direction, (ray_rank_step, ray_file_step) in enumerate(RAY_DIRECTIONS):
+        ray = ray_to_squares(ray_square, ray_rank_step, ray_file_step)
+        RAY_SQUARES[ray_square, ray_direction, :len(ray)] = ray
+RAY_VALID = RAY_SQUARES < 64
+KNIGHT_MOBILITY = numpy.array([len(KNIGHT_TARGETS[square]) for square in range(64)], dtype=numpy.int32)
+
+# How many positions have their mobility worked out at once, which bounds the memory the ray arrays take
+MOBILITY_CHUNK = 4096
+
+
+# This function unpacks positions packed by ChessBoard.pack into arrays in one pass. It returns the mailboxes as an
+# N x 64 array of 4-bit piece codes (see src.encoding), and N-long arrays of the side to move (1 for white), castling
+# rights, en passant file (-1 for none), halfmove clock and fullmove number
+def unpack_positions(packed_positions):
+    data = numpy.frombuffer(b''.join(packed_positions), dtype=numpy.uint8)
+    data = data.reshape(-1, src.encoding.POSITION_SIZE)
+    mailboxes = numpy.empty((len(data), 64), dtype=numpy.uint8)
+    mailboxes[:, 0::2] = data[:, :32] & 15
+    mailboxes[:, 1::2] = data[:, :32] >> 4
+    state = data[:, 32]
+    fullmove_numbers = data[:, 35].astype(numpy.int32) | (data[:, 36].astype(numpy.int32) << 8)
+    return mailboxes, (state & 1).astype(numpy.int8), state >> 1, data[:, 33].astype(numpy.int8) - 1, data[:, 34], \
+        fullmove_numbers
+
+
+# This function turns an N x 64 array of piece codes into N x 12 x 64 piece planes
+def mailboxes_to_planes(mailboxes):
+    planes = numpy.zeros((len(mailboxes), PLANE_COUNT, 64), dtype=numpy.uint8)
+    positions, squares = numpy.nonzero(mailboxes)
+    codes = mailboxes[positions, squares]
+    # White pieces have the color bit set and take the first six planes
+    plane_indices = (codes & 7).astype(numpy.intp) - 1 + numpy.where(codes & src.encoding.WHITE_BIT, 0, 6)
+    planes[positions, plane_indices, squares] = 1
+    return planes
+
+
+# This function packs a list of boards into piece planes, returning the N x 12 x 64 planes and the side to move of each
+def pack_planes(boards):
+    mailboxes, side_to_move = unpack_positions([board.pack() for board in boards])[:2]
+    return mailboxes_to_planes(mailboxes), side_to_move
+
+
+# This function counts the squares attacked along each ray from the given squares, stopping each ray at the first piece.
+# positions and squares are matching arrays of the pieces to count for, and occupied is an N x 64 array of the occupied
+# squares. It returns M x 8 arrays of counts, in the order of RAY_DIRECTIONS
+def count_ray_attacks(occupied, positions, squares):
+    # Pad the board with an occupied square 64 for the rays to run into past the edge
+    padded = numpy.concatenate([occupied, numpy.ones((len(occupied), 1), dtype=bool)], axis=1)
+    blockers = padded[positions[:, numpy.newaxis, numpy.newaxis], RAY_SQUARES[squares]]
+    # A square on a ray is attacked if it is on the board and every square before it is empty
+    attacked = RAY_VALID[squares].copy()
+    attacked[:, :, 1:] &= numpy.logical_and.accumulate(~blockers[:, :, :-1], axis=2)
+    return attacked.sum(axis=2, dtype=numpy.int32)
+
+
+# This function returns the mobility score of N positions from white's point of view: the number of squares each knight,
+# bishop, rook and queen attacks, times its MOBILITY_WEIGHTS entry
+def mobility_scores(planes):
+    scores = numpy.zeros(len(planes), dtype=numpy.int32)
+    for start in range(0, len(planes), MOBILITY_CHUNK):
+        chunk = planes[start:start + MOBILITY_CHUNK]
+        chunk_scores = scores[start:start + MOBILITY_CHUNK]
+        occupied = chunk.any(axis=1)
+        for piece_id, weight in MOBILITY_WEIGHTS.items():
+            for color, sign in ((src.constants.WHITE, 1), (src.constants.BLACK, -1)):
+                positions, squares = numpy.nonzero(chunk[:, piece_index(color, piece_id), :])
+                if piece_id == src.constants.KNIGHT:
+                    counts = KNIGHT_MOBILITY[squares]
+                else:
+                    rays = count_ray_attacks(occupied, positions, squares)
+                    if piece_id == src.constants.BISHOP:
+                        counts = rays[:, 4:].sum(axis=1)
+                    elif piece_id == src.constants.ROOK:
+                        counts = rays[:, :4].sum(axis=1)
+                    else:
+                        counts = rays.sum(axis=1)
+                numpy.add.at(chunk_scores, positions, sign * weight * counts)
+    return scores
+
+
+# This function scores N positions given as piece planes and sides to move in one vectorized pass. Without mobility the
+# scores are exactly those of src.evaluation.evaluate, in centipawns from the point of view of the player to move
+def evaluate_planes(planes, side_to_move, mobility=False):
+    scores = numpy.einsum('npq,pq->n', planes.astype(numpy.int32), PLANE_VALUES)
+    if mobility:
+        scores += mobility_scores(planes)
+    return numpy.where(side_to_move == 1, scores, -scores)
+
+
+# This function scores a list of boards in one vectorized pass
+def evaluate_batch(boards, mobility=False):
+    planes, side_to_move = pack_planes(boards)
+    return evaluate_planes(planes, side_to_move, mobility)
+
+
+# This function scores positions packed by ChessBoard.pack without building any board or piece objects
+def evaluate_packed(packed_positions, mobility=False):
+    mailboxes, side_to_move = unpack_positions(packed_positions)[:2]
+    return evaluate_planes(mailboxes_to_planes(mailboxes), side_to_move, mobility)
+
+
+# This function writes positions packed by ChessBoard.pack to a compressed .npz file for machine learning pipelines. It
+# holds the N x 12 x 64 piece planes and the side to move, castling rights, en passant file, halfmove clock and fullmove
+# number of each position, along with the static evaluation if evaluations is true
+def export_planes(path, packed_positions, evaluations=True):
+    mailboxes, side_to_move, castling_rights, en_passant_files, halfmove_clocks, fullmove_numbers = \
+        unpack_positions(packed_positions)
+    planes = mailboxes_to_planes(mailboxes)
+    arrays = {
+        'planes': planes, 'side_to_move': side_to_move, 'castling_rights': castling_rights,
+        'en_passant_file': en_passant_files, 'halfmove_clock': halfmove_clocks, 'fullmove_number': fullmove_numbers
+    }
+    if evaluations:
+        arrays['evaluation'] = evaluate_planes(planes, side_to_move)
+    numpy.savez_compressed(path, **arrays)
+
+
+# This function plays random games to collect a list of positions to benchmark with
+def random_positions(count, seed):
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = ChessBoard()
+        for _ in range(rng.randint(10, 120)):
+            moves = board.get_all_legal_moves()
+            if not moves:
+                break
+            board.make_move(*rng.choice(moves))
+            positions.append(board.pack())
+    return positions[:count]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Score positions with the vectorized evaluation and compare it to the '
+                                                 'one position at a time evaluation')
+    parser.add_argument('--positions', type=int, default=20000, help='number of random positions to score')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random positions')
+    parser.add_argument('--mobility', action='store_true', help='add the mobility term to the vectorized scores')
+    parser.add_argument('--export', help='also write the positions as piece planes to this .npz file')
+    args = parser.parse_args(args)
+
+    positions = random_positions(args.positions, args.seed)
+    start_time = time.perf_counter()
+    scores = evaluate_packed(positions, args.mobility)
+    batch_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    boards = [ChessBoard.from_packed(position) for position in positions]
+    unpack_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    loop_scores = [evaluate(board) for board in boards]
+    loop_time = time.perf_counter() - start_time
+
+    print('Vectorized: {} positions in {:.3f}s ({:.0f} positions/s)'.format(
+        len(positions), batch_time, len(positions) / batch_time if batch_time > 0 else 0))
+    print('One at a time: {:.3f}s ({:.0f} positions/s), plus {:.3f}s to unpack the boards'.format(
+        loop_time, len(positions) / loop_time if loop_time > 0 else 0, unpack_time))
+    if not args.mobility:
+        mismatches = int(numpy.count_nonzero(scores != numpy.array(loop_scores)))
+        print('Scores that differ from src.evaluation.evaluate: {}'.format(mismatches))
+        if mismatches:
+            return 1
+    if args.export:
+        export_planes(args.export, positions)
+        print('Wrote {}'.format(args.export))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+import src.constants
+from src.attack_tables import KNIGHT_OFFSETS, KING_OFFSETS, ORTHOGONAL_DIRECTIONS, DIAGONAL_DIRECTIONS
+
+# Squares are numbered rank * 8 + file, the same as the ChessBoard mailbox, so bit n of a bitboard is square n
+FULL_BOARD = (1 << 64) - 1
+
+# Castling rights are stored as four bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+# The pieces a pawn can promote to, in the order they are generated
+PROMOTION_IDS = [src.constants.QUEEN, src.constants.ROOK, src.constants.BISHOP, src.constants.KNIGHT]
+
+# Directions are (rank step, file step). Moving in a positive direction always increases the square number, so the
+# nearest blocker on a positive ray is its lowest set bit and on a negative ray its highest set bit
+POSITIVE_DIRECTIONS = [(1, 0), (0, 1), (1, 1), (1, -1)]
+NEGATIVE_DIRECTIONS = [(-1, 0), (0, -1), (-1, -1), (-1, 1)]
+
+
+# This function turns a list of (rank, file) offsets from a square into a bitboard, dropping squares off the board
+def offsets_to_bitboard(rank, file, offsets):
+    bitboard = 0
+    for (rank_step, file_step) in offsets:
+        if 0 <= rank + rank_step < 8 and 0 <= file + file_step < 8:
+            bitboard |= 1 << ((rank + rank_step) * 8 + file + file_step)
+    return bitboard
+
+
+# This function returns the bitboard of every square from a square to the edge of the board in one direction
+def ray_to_bitboard(rank, file, rank_step, file_step):
+    bitboard = 0
+    rank, file = rank + rank_step, file + file_step
+    while 0 <= rank < 8 and 0 <= file < 8:
+        bitboard |= 1 << (rank * 8 + file)
+        rank, file = rank + rank_step, file + file_step
+    return bitboard
+
+
+# Precomputed attack tables for every square on the board
+KNIGHT_ATTACKS = [offsets_to_bitboard(square // 8, square % 8, KNIGHT_OFFSETS) for square in range(64)]
+KING_ATTACKS = [offsets_to_bitboard(square // 8, square % 8, KING_OFFSETS) for square in range(64)]
+PAWN_ATTACKS = {
+    src.constants.WHITE: [offsets_to_bitboard(square // 8, square % 8, [(1, 1), (1, -1)]) for square in range(64)],
+    src.constants.BLACK: [offsets_to_bitboard(square // 8, square % 8, [(-1, 1), (-1, -1)]) for square in range(64)]
+}
+RAYS = {
+    direction: [ray_to_bitboard(square // 8, square % 8, direction[0], direction[1]) for square in range(64)]
+    for direction in POSITIVE_DIRECTIONS + NEGATIVE_DIRECTIONS
+}
+# The ray tables each sliding piece moves along, paired with whether their direction is positive
+ORTHOGONAL_RAY_TABLES = [(RAYS[direction], direction in POSITIVE_DIRECTIONS) for direction in ORTHOGONAL_DIRECTIONS]
+DIAGONAL_RAY_TABLES = [(RAYS[direction], direction in POSITIVE_DIRECTIONS) for direction in DIAGONAL_DIRECTIONS]
+QUEEN_RAY_TABLES = ORTHOGONAL_RAY_TABLES + DIAGONAL_RAY_TABLES
+
+# Castling rights that are lost when a piece moves from or to each square
+CASTLING_MASKS = [WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE] * 64
+CASTLING_MASKS[4] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[0] &= ~WHITE_QUEENSIDE
+CASTLING_MASKS[7] &= ~WHITE_KINGSIDE
+CASTLING_MASKS[60] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[56] &= ~BLACK_QUEENSIDE
+CASTLING_MASKS[63] &= ~BLACK_KINGSIDE
+
+
+# This function returns the squares a sliding piece on a square attacks along the rays of the given ray tables,
+# stopping at (and including) the first occupied square on each ray
+def sliding_attacks(square, occupied, ray_tables):
+    attacks = 0
+    for rays, is_positive in ray_tables:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            if is_positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= rays[blocker]
+        attacks |= ray
+    return attacks
+
+
+# This function yields the square number of every set bit in a bitboard
+def iterate_squares(bitboard):
+    while bitboard:
+        lowest_bit = bitboard & -bitboard
+        yield lowest_bit.bit_length() - 1
+        bitboard ^= lowest_bit
+
+
+# This function returns the index of the bitboard holding the pieces of a color and type
+def piece_index(color, piece_id):
+    return (0 if color == src.constants.WHITE else 6) + piece_id - 1
+
+
+# A position stored as 12 64-bit integers, one per color and piece type. Moves are tuples of (from square, to square,
+# promotion piece id), where the promotion id is NONE for every move that is not a promotion
+class BitboardPosition:
+    def __init__(self, bitboards, player_turn, castling_rights, en_passant_square):
+        self.bitboards = bitboards
+        self.player_turn = player_turn
+        self.castling_rights = castling_rights
+        self.en_passant_square = en_passant_square
+        self.occupancy = {src.constants.WHITE: 0, src.constants.BLACK: 0}
+        for index, bitboard in enumerate(bitboards):
+            self.occupancy[src.constants.WHITE if index < 6 else src.constants.BLACK] |= bitboard
+        self.occupied = self.occupancy[src.constants.WHITE] | self.occupancy[src.constants.BLACK]
+
+    # This function builds a bitboard position from the pieces and state of a ChessBoard
+    @staticmethod
+    def from_chess_board(board):
+        bitboards = [0] * 12
+        for piece in board.pieces:
+            bitboards[piece_index(piece.color, piece.id)] |= 1 << (piece.rank * 8 + piece.file)
+        castling_rights = board.get_castling_rights()
+        en_passant_square = None
+        if board.en_passant_square is not None:
+            rank, file = board.en_passant_square
+            en_passant_square = rank * 8 + file
+        return BitboardPosition(bitboards, board.player_turn, castling_rights, en_passant_square)
+
+    # This function puts a piece on an empty square, or takes it off the square it is on, updating the position in
+    # place. ChessBoard calls it as pieces are placed and removed, so its bitboards never need to be rebuilt
+    def toggle_piece(self, piece_id, color, square):
+        bit = 1 << square
+        self.bitboards[piece_index(color, piece_id)] ^= bit
+        self.occupancy[color] ^= bit
+        self.occupied ^= bit
+
+    # This function returns the id and color of the piece on a square, or None if the square is empty
+    def piece_at(self, square):
+        bit = 1 << square
+        if not self.occupied & bit:
+            return None
+        for index, bitboard in enumerate(self.bitboards):
+            if bitboard & bit:
+                return index % 6 + 1, src.constants.WHITE if index < 6 else src.constants.BLACK
+
+    # This function returns true if any piece of the given color attacks the square. Otherwise, false.
+    def is_square_attacked(self, square, color):
+        offset = 0 if color == src.constants.WHITE else 6
+        bitboards = self.bitboards
+        if KNIGHT_ATTACKS[square] & bitboards[offset + src.constants.KNIGHT - 1]:
+            return True
+        if KING_ATTACKS[square] & bitboards[offset + src.constants.KING - 1]:
+            return True
+        # A pawn of the attacking color attacks this square if a pawn of the other color here would attack it
+        if PAWN_ATTACKS[not color][square] & bitboards[offset + src.constants.PAWN - 1]:
+            return True
+        queens = bitboards[offset + src.constants.QUEEN - 1]
+        if sliding_attacks(square, self.occupied, DIAGONAL_RAY_TABLES) & \
+                (bitboards[offset + src.constants.BISHOP - 1] | queens):
+            return True
+        if sliding_attacks(square, self.occupied, ORTHOGONAL_RAY_TABLES) & \
+                (bitboards[offset + src.constants.ROOK - 1] | queens):
+            return True
+        return False
+
+    # This function returns true if the king of the specified color is in check. Otherwise, false.
+    def is_in_check(self, color):
+        king = self.bitboards[piece_index(color, src.constants.KING)]
+        if not king:
+            return False
+        return self.is_square_attacked(king.bit_length() - 1, not color)
+
+    # This function returns every move for the player to move, without checking if it leaves their king in check
+    def generate_pseudo_legal_moves(self):
+        moves = []
+        color = self.player_turn
+        offset = 0 if color == src.constants.WHITE else 6
+        bitboards = self.bitboards
+        own = self.occupancy[color]
+        enemy = self.occupancy[not color]
+        empty = ~self.occupied & FULL_BOARD
+
+        # Pawns push forward one or two squares, capture diagonally and promote on the last rank
+        direction = 8 if color == src.constants.WHITE else -8
+        start_rank = 1 if color == src.constants.WHITE else 6
+        last_rank = 7 if color == src.constants.WHITE else 0
+        capture_targets = enemy
+        if self.en_passant_square is not None:
+            capture_targets |= 1 << self.en_passant_square
+        for square in iterate_squares(bitboards[offset + src.constants.PAWN - 1]):
+            targets = PAWN_ATTACKS[color][square] & capture_targets
+            forward = square + direction
+            # A pawn left on the last rank while it waits to be promoted has no square in front of it
+            if square // 8 != last_rank and empty & (1 << forward):
+                targets |= 1 << forward
+                if square // 8 == start_rank and empty & (1 << (forward + direction)):
+                    targets |= 1 << (forward + direction)
+            for target in iterate_squares(targets):
+                if target // 8 == last_rank:
+                    for promotion_id in PROMOTION_IDS:
+                        moves.append((square, target, promotion_id))
+                else:
+                    moves.append((square, target, src.constants.NONE))
+
+        # Knights and the king use the precomputed tables, sliding pieces walk their rays
+        for piece_id in (src.constants.KNIGHT, src.constants.BISHOP, src.constants.ROOK, src.constants.QUEEN,
+                         src.constants.KING):
+            for square in iterate_squares(bitboards[offset + piece_id - 1]):
+                if piece_id == src.constants.KNIGHT:
+                    targets = KNIGHT_ATTACKS[square]
+                elif piece_id == src.constants.KING:
+                    targets = KING_ATTACKS[square]
+                elif piece_id == src.constants.BISHOP:
+                    targets = sliding_attacks(square, self.occupied, DIAGONAL_RAY_TABLES)
+                elif piece_id == src.constants.ROOK:
+                    targets = sliding_attacks(square, self.occupied, ORTHOGONAL_RAY_TABLES)
+                else:
+                    targets = sliding_attacks(square, self.occupied, QUEEN_RAY_TABLES)
+                for target in iterate_squares(targets & ~own):
+                    moves.append((square, target, src.constants.NONE))
+
+        # The king cannot castle out of or through check, and the squares between the king and rook must be empty
+        if color == src.constants.WHITE:
+            back_rank, kingside, queenside = 0, WHITE_KINGSIDE, WHITE_QUEENSIDE
+        else:
+            back_rank, kingside, queenside = 56, BLACK_KINGSIDE, BLACK_QUEENSIDE
+        king_square = back_rank + 4
+        if self.castling_rights & (kingside | queenside) and not self.is_square_attacked(king_square, not color):
+            if self.castling_rights & kingside and not self.occupied & (0b01100000 << back_rank) and \
+                    not self.is_square_attacked(king_square + 1, not color):
+                moves.append((king_square, king_square + 2, src.constants.NONE))
+            if self.castling_rights & queenside and not self.occupied & (0b00001110 << back_rank) and \
+                    not self.is_square_attacked(king_square - 1, not color):
+                moves.append((king_square, king_square - 2, src.constants.NONE))
+        return moves
+
+    # This function returns the position after a move is made. Positions are never changed in place, so making a move
+    # is a copy of twelve integers and taking it back is simply dropping the new position
+    def make_move(self, move):
+        from_square, to_square, promotion_id = move
+        color = self.player_turn
+        offset = 0 if color == src.constants.WHITE else 6
+        enemy_offset = 6 - offset
+        from_bit, to_bit = 1 << from_square, 1 << to_square
+        bitboards = self.bitboards.copy()
+        moving_index = None
+        for index in range(offset, offset + 6):
+            if bitboards[index] & from_bit:
+                moving_index = index
+                break
+        piece_id = moving_index - offset + 1
+        # Take any captured piece off its square
+        if self.occupancy[not color] & to_bit:
+            for index in range(enemy_offset, enemy_offset + 6):
+                if bitboards[index] & to_bit:
+                    bitboards[index] ^= to_bit
+                    break
+        elif piece_id == src.constants.PAWN and to_square == self.en_passant_square:
+            captured_square = to_square - 8 if color == src.constants.WHITE else to_square + 8
+            bitboards[enemy_offset + src.constants.PAWN - 1] ^= 1 << captured_square
+        # Move the piece, swapping a promoting pawn for its new piece
+        bitboards[moving_index] ^= from_bit
+        if promotion_id != src.constants.NONE:
+            bitboards[offset + promotion_id - 1] |= to_bit
+        else:
+            bitboards[moving_index] |= to_bit
+        # Castling also moves the rook
+        if piece_id == src.constants.KING and abs(to_square - from_square) == 2:
+            if to_square > from_square:
+                rook_from, rook_to = from_square + 3, from_square + 1
+            else:
+                rook_from, rook_to = from_square - 4, from_square - 1
+            bitboards[offset + src.constants.ROOK - 1] ^= (1 << rook_from) | (1 << rook_to)
+        en_passant_square = None
+        if piece_id == src.constants.PAWN and abs(to_square - from_square) == 16:
+            en_passant_square = (from_square + to_square) // 2
+        castling_rights = self.castling_rights & CASTLING_MASKS[from_square] & CASTLING_MASKS[to_square]
+        return BitboardPosition(bitboards, not color, castling_rights, en_passant_square)
+
+    # This function returns true if a square would be attacked by the given color once a piece of the other color moves
+    # from one square to another, capturing whatever stands on captured_square. Only the occupancy and the captured
+    # piece change, so this is worked out on the position's own bitboards instead of on a copy made by make_move
+    def is_attacked_after_move(self, square, color, from_square, to_square, captured_square):
+        offset = 0 if color == src.constants.WHITE else 6
+        bitboards = self.bitboards
+        remaining = ~(1 << captured_square)
+        occupied = (self.occupied & ~(1 << from_square) & remaining) | (1 << to_square)
+        if KNIGHT_ATTACKS[square] & bitboards[offset + src.constants.KNIGHT - 1] & remaining:
+            return True
+        if KING_ATTACKS[square] & bitboards[offset + src.constants.KING - 1]:
+            return True
+        if PAWN_ATTACKS[not color][square] & bitboards[offset + src.constants.PAWN - 1] & remaining:
+            return True
+        queens = bitboards[offset + src.constants.QUEEN - 1]
+        if sliding_attacks(square, occupied, DIAGONAL_RAY_TABLES) & \
+                (bitboards[offset + src.constants.BISHOP - 1] | queens) & remaining:
+            return True
+        if sliding_attacks(square, occupied, ORTHOGONAL_RAY_TABLES) & \
+                (bitboards[offset + src.constants.ROOK - 1] | queens) & remaining:
+            return True
+        return False
+
+    # This function returns every legal move for the player to move. Only king moves, en passant, moves made in check
+    # and moves of pieces on a line from the king to an enemy sliding piece are tested for leaving the king attacked
+    def generate_legal_moves(self):
+        color = self.player_turn
+        king = self.bitboards[piece_index(color, src.constants.KING)]
+        if not king:
+            return self.generate_pseudo_legal_moves()
+        king_square = king.bit_length() - 1
+        in_check = self.is_square_attacked(king_square, not color)
+        pawns = self.bitboards[piece_index(color, src.constants.PAWN)]
+        # A piece can only be pinned on a line from the king that has an enemy piece able to slide along it
+        enemy_offset = 6 if color == src.constants.WHITE else 0
+        queens = self.bitboards[enemy_offset + src.constants.QUEEN - 1]
+        pin_lines = 0
+        for ray_tables, sliders in ((ORTHOGONAL_RAY_TABLES, self.bitboards[enemy_offset + src.constants.ROOK - 1]),
+                                    (DIAGONAL_RAY_TABLES, self.bitboards[enemy_offset + src.constants.BISHOP - 1])):
+            for rays, is_positive in ray_tables:
+                if rays[king_square] & (sliders | queens):
+                    pin_lines |= rays[king_square]
+        legal_moves = []
+        for move in self.generate_pseudo_legal_moves():
+            from_square, to_square, promotion_id = move
+            if from_square == king_square:
+                # Castling has already been checked for attacks on the squares the king passes
+                if not self.is_attacked_after_move(to_square, not color, from_square, to_square, to_square):
+                    legal_moves.append(move)
+                continue
+            captured_square = to_square
+            if to_square == self.en_passant_square and pawns & (1 << from_square):
+                captured_square = to_square - 8 if color == src.constants.WHITE else to_square + 8
+            elif not in_check and not pin_lines & (1 << from_square):
+                # A piece off those lines cannot be pinned, so moving it cannot uncover an attack on the king
+                legal_moves.append(move)
+                continue
+            if not self.is_attacked_after_move(king_square, not color, from_square, to_square, captured_square):
+                legal_moves.append(move)
+        return legal_moves
@@ -1,16 +1,61 @@
-import copy
+from array import array
 
 import src.constants
+import src.encoding
+import src.zobrist
+from src.bitboard import BitboardPosition, iterate_squares, WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, \
+    BLACK_QUEENSIDE
+from src.attack_tables import SQUARE_COORDINATES, KNIGHT_TARGETS, KING_TARGETS, PAWN_ATTACKS, ORTHOGONAL_RAYS, DIAGONAL_RAYS
+from src.move_generator import generate_legal_moves
 from src.piece import Pawn, Knight, Bishop, Rook, Queen, King
 
+# The piece class for each FEN letter
+FEN_PIECE_TYPES = {'p': Pawn, 'n': Knight, 'b': Bishop, 'r': Rook, 'q': Queen, 'k': King}
+
+# The pieces a pawn can promote to
+PROMOTION_TYPES = [Queen, Rook, Bishop, Knight]
+
+# The piece class for each piece id, and the other way around
+PIECE_TYPES = {
+    src.constants.PAWN: Pawn, src.constants.KNIGHT: Knight, src.constants.BISHOP: Bishop, src.constants.ROOK: Rook,
+    src.constants.QUEEN: Queen, src.constants.KING: King
+}
+PIECE_TYPE_IDS = {piece_type: piece_id for piece_id, piece_type in PIECE_TYPES.items()}
+
 class ChessBoard:
-    # TODO: Add board initialization based on given position
-    def __init__(self, pieces=None):
+    # Boards start from the default position, or from the given list of pieces. Use ChessBoard.from_fen to start from
+    # a position with its side to move, castling rights and en passant square.
+    # If use_bitboards is true, legal moves and checks are found by the bitboard engine instead of by each piece object
+    def __init__(self, pieces=None, use_bitboards=False):
+        self.use_bitboards = use_bitboards
+        # The bitboard engine's view of the pieces on the board. It is built the first time it is needed, then updated
+        # as pieces are placed and removed
+        self.bitboard_position = None
         self.player_turn = src.constants.WHITE
-        self.move_list = []
-        self.pieces = []
+        # Every move made so far as a 16-bit encoded move (see src.encoding), two bytes a move with no piece references
+        self.move_list = array('H')
+        # Square-indexed mailbox of the board, where the piece on (rank, file) is stored at index rank * 8 + file
+        self.squares = [None] * 64
         self.captured_pieces = []
-        self.is_branch = False
+        # Moves made with make_move, holding everything unmake_move needs to restore the board exactly
+        self.undo_list = []
+        # The square skipped by a pawn that just moved two ranks, which can be captured en passant on the next move
+        self.en_passant_square = None
+        # Plies since the last capture or pawn move, and the number of the current full move, as written in FEN strings
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        # 64-bit Zobrist key of the position, updated incrementally as pieces are placed and removed and moves are made
+        self.zobrist_key = 0
+        # Legal moves by starting square and check status by color for a single position, identified by its Zobrist
+        # key. Anything that changes the position changes the key, so a stale entry can never be read back
+        self.legal_move_cache_key = None
+        self.legal_move_cache = {}
+        self.check_cache_key = None
+        self.check_cache = [None, None]
+        self.legal_move_cache_hits = 0
+        self.legal_move_cache_misses = 0
+        # An endgame tablebase (see src.tablebase) that check_gameover asks about positions with few pieces left
+        self.tablebase = None
         self.is_gameover = False
         self.is_promoting = False
         self.game_result = None
@@ -19,10 +64,24 @@ class ChessBoard:
         else:
             self.clear_board()
 
+    # The list of pieces is derived from the mailbox, so the two can never disagree
+    @property
+    def pieces(self):
+        return [piece for piece in self.squares if piece is not None]
+
+    # Assigning a list of pieces rebuilds the mailbox from the rank and file of each piece
+    @pieces.setter
+    def pieces(self, pieces):
+        self.squares = [None] * 64
+        self.bitboard_position = None
+        for piece in pieces:
+            self.place_piece(piece)
+        self.zobrist_key = self.compute_zobrist_key()
+
     # Set the pieces on the board to the default position
     def clear_board(self):
         # Add in the major pieces
-        self.pieces = [
+        pieces = [
             # White pieces
             Rook(0, 0, src.constants.WHITE), Rook(0, 7, src.constants.WHITE),
             Knight(0, 1, src.constants.WHITE), Knight(0, 6, src.constants.WHITE),
@@ -36,14 +95,172 @@ class ChessBoard:
         ]
         # Add in the pawns
         for i in range(0, 8):
-            self.pieces.append(Pawn(1, i, src.constants.WHITE))
-            self.pieces.append(Pawn(6, i, src.constants.BLACK))
+            pieces.append(Pawn(1, i, src.constants.WHITE))
+            pieces.append(Pawn(6, i, src.constants.BLACK))
+        self.pieces = pieces
+
+    # This function builds a board from a FEN string. The pieces are written straight into the mailbox, so no default
+    # position is created only to be thrown away.
+    @classmethod
+    def from_fen(cls, fen, use_bitboards=False):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError('FEN needs at least 4 fields: {!r}'.format(fen))
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError('FEN position needs 8 ranks: {!r}'.format(fen))
+        board = cls([], use_bitboards=use_bitboards)
+        squares = board.squares
+        for i, row in enumerate(rows):
+            rank, file = 7 - i, 0
+            for char in row:
+                if char.isdigit():
+                    file += int(char)
+                    continue
+                piece_type = FEN_PIECE_TYPES.get(char.lower())
+                if piece_type is None or file > 7:
+                    raise ValueError('Invalid FEN rank {!r}: {!r}'.format(row, fen))
+                piece = piece_type(rank, file, src.constants.WHITE if char.isupper() else src.constants.BLACK)
+                piece.can_castle = False
+                squares[rank * 8 + file] = piece
+                file += 1
+            if file != 8:
+                raise ValueError('Invalid FEN rank {!r}: {!r}'.format(row, fen))
+        if fields[1] not in ('w', 'b'):
+            raise ValueError('Invalid FEN side to move: {!r}'.format(fen))
+        board.player_turn = src.constants.WHITE if fields[1] == 'w' else src.constants.BLACK
+        # Only the kings and rooks named by the castling field are allowed to castle
+        for char, color, back_rank, rook_file in (
+                ('K', src.constants.WHITE, 0, 7), ('Q', src.constants.WHITE, 0, 0),
+                ('k', src.constants.BLACK, 7, 7), ('q', src.constants.BLACK, 7, 0)):
+            if char in fields[2]:
+                king, rook = squares[back_rank * 8 + 4], squares[back_rank * 8 + rook_file]
+                if king is None or king.id != src.constants.KING or king.color != color or rook is None or \
+                        rook.id != src.constants.ROOK or rook.color != color:
+                    raise ValueError('Invalid FEN castling rights: {!r}'.format(fen))
+                king.can_castle = True
+                rook.can_castle = True
+        if fields[3] != '-':
+            if len(fields[3]) != 2 or fields[3][0] not in 'abcdefgh' or fields[3][1] not in '36':
+                raise ValueError('Invalid FEN en passant square: {!r}'.format(fen))
+            board.en_passant_square = (int(fields[3][1]) - 1, ord(fields[3][0]) - ord('a'))
+        if len(fields) >= 6:
+            board.halfmove_clock = int(fields[4])
+            board.fullmove_number = int(fields[5])
+        board.zobrist_key = board.compute_zobrist_key()
+        return board
+
+    # This function writes the position as a FEN string
+    def to_fen(self):
+        rows = []
+        for rank in range(7, -1, -1):
+            row = ''
+            empty_squares = 0
+            for piece in self.squares[rank * 8:rank * 8 + 8]:
+                if piece is None:
+                    empty_squares += 1
+                    continue
+                if empty_squares > 0:
+                    row += str(empty_squares)
+                    empty_squares = 0
+                letter = src.constants.PIECE_LETTERS[piece.id]
+                row += letter.upper() if piece.color == src.constants.WHITE else letter
+            if empty_squares > 0:
+                row += str(empty_squares)
+            rows.append(row)
+        castling = ''
+        castling_rights = self.get_castling_rights()
+        for char, right in (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE), ('k', BLACK_KINGSIDE),
+                            ('q', BLACK_QUEENSIDE)):
+            if castling_rights & right:
+                castling += char
+        en_passant = '-'
+        if self.en_passant_square is not None:
+            rank, file = self.en_passant_square
+            en_passant = 'abcdefgh'[file] + str(rank + 1)
+        return '{} {} {} {} {} {}'.format(
+            '/'.join(rows), 'w' if self.player_turn == src.constants.WHITE else 'b', castling or '-', en_passant,
+            self.halfmove_clock, self.fullmove_number
+        )
+
+    # This function returns the castling rights of both players as four bits. A right is only held while the king and
+    # the rook on that side are both on their starting squares and neither has moved
+    def get_castling_rights(self):
+        castling_rights = 0
+        for color, back_rank, kingside, queenside in (
+                (src.constants.WHITE, 0, WHITE_KINGSIDE, WHITE_QUEENSIDE),
+                (src.constants.BLACK, 7, BLACK_KINGSIDE, BLACK_QUEENSIDE)):
+            king = self.squares[back_rank * 8 + 4]
+            if king is None or king.id != src.constants.KING or king.color != color or not king.can_castle:
+                continue
+            for rook_file, right in ((7, kingside), (0, queenside)):
+                rook = self.squares[back_rank * 8 + rook_file]
+                if rook is not None and rook.id == src.constants.ROOK and rook.color == color and rook.can_castle:
+                    castling_rights |= right
+        return castling_rights
+
+    # This function returns the part of the Zobrist key that comes from the en passant square. Like Polyglot, the file
+    # is only hashed in if a pawn of the player to move is beside the pawn that can be captured
+    def get_en_passant_key(self):
+        if self.en_passant_square is None:
+            return 0
+        rank, file = self.en_passant_square
+        capture_rank = rank - 1 if self.player_turn == src.constants.WHITE else rank + 1
+        for capture_file in (file - 1, file + 1):
+            pawn = self.look_at(capture_rank, capture_file)
+            if pawn is not None and pawn.id == src.constants.PAWN and pawn.color == self.player_turn:
+                return src.zobrist.en_passant_key(file)
+        return 0
+
+    # This function computes the Zobrist key of the position from scratch
+    def compute_zobrist_key(self):
+        key = 0
+        for piece in self.squares:
+            if piece is not None:
+                key ^= src.zobrist.piece_key(piece.id, piece.color, piece.rank, piece.file)
+        key ^= src.zobrist.castling_key(self.get_castling_rights())
+        key ^= self.get_en_passant_key()
+        if self.player_turn == src.constants.WHITE:
+            key ^= src.zobrist.TURN_KEY
+        return key
+
+    # This function returns true if the current position has come up at least count times. Only positions since the
+    # last capture or pawn move can repeat, and they must have the same player to move.
+    def is_repetition(self, count=3):
+        repetitions = 1
+        for i in range(2, min(self.halfmove_clock, len(self.undo_list)) + 1, 2):
+            if self.undo_list[-i][-1] == self.zobrist_key:
+                repetitions += 1
+                if repetitions >= count:
+                    return True
+        return False
 
     def look_at(self, rank, file):
-        # Search thru the piece list and find the piece with the same rank and file
-        for piece in self.pieces:
-            if piece.rank == rank and piece.file == file:
-                return piece
+        # Squares off the board are always empty, otherwise the piece is read straight out of the mailbox
+        if 0 <= rank < 8 and 0 <= file < 8:
+            return self.squares[rank * 8 + file]
+        return None
+
+    # Put a piece into the mailbox at its current rank and file
+    def place_piece(self, piece):
+        self.squares[piece.rank * 8 + piece.file] = piece
+        self.zobrist_key ^= src.zobrist.piece_key(piece.id, piece.color, piece.rank, piece.file)
+        if self.bitboard_position is not None:
+            self.bitboard_position.toggle_piece(piece.id, piece.color, piece.rank * 8 + piece.file)
+
+    # Take a piece out of the mailbox
+    def remove_piece(self, piece):
+        self.squares[piece.rank * 8 + piece.file] = None
+        self.zobrist_key ^= src.zobrist.piece_key(piece.id, piece.color, piece.rank, piece.file)
+        if self.bitboard_position is not None:
+            self.bitboard_position.toggle_piece(piece.id, piece.color, piece.rank * 8 + piece.file)
+
+    # Move a piece that is already on the board to a new square, keeping the mailbox in sync
+    def relocate_piece(self, piece, rank, file):
+        self.remove_piece(piece)
+        piece.rank = rank
+        piece.file = file
+        self.place_piece(piece)
 
     # This function takes a piece and move to be made for that piece. If the function is able to make the move, it
     # return true, otherwise false.
@@ -54,94 +271,339 @@ class ChessBoard:
             # Unpack the move and see what piece is in the destination square
             rank, file = move
             dest_piece = self.look_at(rank, file)
-            # If the king is moving more than two squares, it is a castling move
-            if piece.id == src.constants.KING and abs(file - piece.file) >= 2 and piece.can_castle:
-                self.move_list.append((piece, (piece.rank, piece.file), move))
-                # Check if left castle or right castle:
-                if (file - piece.file) > 0:
-                    r_rook = self.look_at(piece.rank, piece.file + 3)
-                    r_rook.file = file - 1
-                    piece.file = file
-                    r_rook.can_castle = False
-                else:
-                    l_rook = self.look_at(piece.rank, piece.file - 4)
-                    l_rook.file = file + 1
-                    piece.file = file
-                    l_rook.can_castle = False
-                piece.can_castle = False
-                # Swap the turn variable to the opposite player
-                self.player_turn = not self.player_turn
-                self.check_gameover()
-                return True
-            # If the piece is a pawn moving diagonally
-            elif piece.id == src.constants.PAWN and abs(piece.file - file) > 1 and dest_piece is None:
-                captured_pawn = self.look_at(piece.rank, file)
-                self.captured_pieces.append(captured_pawn)
-                self.pieces.remove(captured_pawn)
-                success = True
-            if dest_piece is not None:
-                if dest_piece.capturable:
-                    self.captured_pieces.append(dest_piece)
-                    self.pieces.remove(dest_piece)
-                    success = True
-                else:
-                    return False
-            else:
-                success = True
-            if success:
-                self.move_list.append((piece, (piece.rank, piece.file), move))
-                # Move the piece to the destination square
-                piece.rank = rank
-                piece.file = file
-                # If the piece is a rook or king and it moves, it can no longer castle
-                piece.can_castle = False
-                # Swap the turn variable to the opposite player
-                self.player_turn = not self.player_turn
-                self.check_gameover()
-                if self.can_promote():
-                    self.is_promoting = True
-                return True
+            if dest_piece is not None and not dest_piece.capturable:
+                return False
+            self.make_move(piece, move)
+            self.check_gameover()
+            if self.can_promote():
+                self.is_promoting = True
+            return True
+        return False
+
+    # This function returns every legal move for the player to move as (piece, move, promotion type) tuples. A pawn
+    # reaching the last rank makes one move per promotion piece, every other move has a promotion type of None.
+    def get_all_legal_moves(self):
+        all_moves = []
+        for piece in self.pieces:
+            if piece.color == self.player_turn:
+                for move in piece.get_legal_moves(self):
+                    if piece.id == src.constants.PAWN and (move[0] == 0 or move[0] == 7):
+                        for promotion_type in PROMOTION_TYPES:
+                            all_moves.append((piece, move, promotion_type))
+                    else:
+                        all_moves.append((piece, move, None))
+        return all_moves
+
+    # This function yields the legal moves of the player to move one at a time, in the same form as get_all_legal_moves.
+    # Each move is only checked for legality when it is asked for, so a caller that stops early saves the rest of the
+    # work. The board must be back in the same position whenever the next move is asked for.
+    def iter_legal_moves(self):
+        for piece in self.pieces:
+            if piece.color == self.player_turn:
+                for move in piece.iter_legal_moves(self):
+                    if piece.id == src.constants.PAWN and (move[0] == 0 or move[0] == 7):
+                        for promotion_type in PROMOTION_TYPES:
+                            yield piece, move, promotion_type
+                    else:
+                        yield piece, move, None
+
+    # This function returns true if the player to move has at least one legal move, stopping at the first one found
+    def has_any_legal_move(self):
+        for _ in self.iter_legal_moves():
+            return True
+        return False
+
+    # This function applies a move to the board in place without checking if it is legal. Everything that changes is
+    # recorded so that unmake_move can restore the board exactly. If a promotion type is given, a pawn reaching the
+    # last rank is replaced by a new piece of that type.
+    def make_move(self, piece, move, promotion_type=None):
+        rank, file = move
+        start = (piece.rank, piece.file)
+        captured_piece = self.look_at(rank, file)
+        # A pawn moving diagonally onto an empty square is capturing en passant
+        if piece.id == src.constants.PAWN and file != piece.file and captured_piece is None:
+            captured_piece = self.look_at(piece.rank, file)
+        # If the king is moving two squares, it is a castling move and the rook moves with it
+        castling_rook = None
+        if piece.id == src.constants.KING and abs(file - piece.file) == 2:
+            castling_rook = self.look_at(piece.rank, 7 if file > piece.file else 0)
+        self.undo_list.append((
+            piece, start, move, captured_piece, castling_rook, piece.can_castle,
+            castling_rook.can_castle if castling_rook is not None else False, self.en_passant_square,
+            self.player_turn, self.is_gameover, self.is_promoting, self.game_result, self.halfmove_clock,
+            self.fullmove_number, self.zobrist_key
+        ))
+        # Take the castling rights and en passant file out of the key, they are hashed back in once the move is made
+        castling_rights = self.get_castling_rights()
+        self.zobrist_key ^= self.get_en_passant_key()
+        # Record the move in the history. The capture and castling checks above already tell us its flags, so this is
+        # the same as encode_move without looking at the board again
+        if castling_rook is not None:
+            flags = src.encoding.KING_CASTLE if file > piece.file else src.encoding.QUEEN_CASTLE
+        elif captured_piece is not None:
+            flags = src.encoding.CAPTURE if captured_piece.rank == rank else src.encoding.EN_PASSANT
+        elif piece.id == src.constants.PAWN and abs(rank - piece.rank) == 2:
+            flags = src.encoding.DOUBLE_PAWN_PUSH
+        else:
+            flags = src.encoding.QUIET
+        if promotion_type is not None and piece.id == src.constants.PAWN and (rank == 0 or rank == 7):
+            flags = (flags & src.encoding.CAPTURE) | src.encoding.promotion_flags(PIECE_TYPE_IDS[promotion_type])
+        self.move_list.append((start[0] * 8 + start[1]) | ((rank * 8 + file) << 6) | (flags << 12))
+        if captured_piece is not None:
+            self.remove_piece(captured_piece)
+            self.captured_pieces.append(captured_piece)
+        if castling_rook is not None:
+            # Check if left castle or right castle
+            self.relocate_piece(castling_rook, rank, file - 1 if file > piece.file else file + 1)
+            castling_rook.can_castle = False
+        # Move the piece to the destination square
+        self.relocate_piece(piece, rank, file)
+        # If the piece is a rook or king and it moves, it can no longer castle
+        piece.can_castle = False
+        # Remember the skipped square if a pawn moved two ranks
+        if piece.id == src.constants.PAWN and abs(rank - start[0]) == 2:
+            self.en_passant_square = ((rank + start[0]) // 2, file)
+        else:
+            self.en_passant_square = None
+        if promotion_type is not None and piece.id == src.constants.PAWN and (rank == 0 or rank == 7):
+            self.remove_piece(piece)
+            self.place_piece(promotion_type(rank, file, piece.color))
+        # Captures and pawn moves reset the halfmove clock, and a full move is complete once black has moved
+        if captured_piece is not None or piece.id == src.constants.PAWN:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if piece.color == src.constants.BLACK:
+            self.fullmove_number += 1
+        # Swap the turn variable to the opposite player
+        self.player_turn = not self.player_turn
+        self.zobrist_key ^= src.zobrist.castling_key(castling_rights ^ self.get_castling_rights())
+        self.zobrist_key ^= self.get_en_passant_key() ^ src.zobrist.TURN_KEY
+
+    # This function returns the 16-bit encoding of a move in the current position, with flags for captures, en passant,
+    # double pawn pushes, castling and promotion
+    def encode_move(self, piece, move, promotion_type=None):
+        rank, file = move
+        flags = src.encoding.QUIET
+        if piece.id == src.constants.KING and abs(file - piece.file) == 2:
+            flags = src.encoding.KING_CASTLE if file > piece.file else src.encoding.QUEEN_CASTLE
+        elif self.look_at(rank, file) is not None:
+            flags = src.encoding.CAPTURE
+        elif piece.id == src.constants.PAWN and file != piece.file:
+            flags = src.encoding.EN_PASSANT
+        elif piece.id == src.constants.PAWN and abs(rank - piece.rank) == 2:
+            flags = src.encoding.DOUBLE_PAWN_PUSH
+        if promotion_type is not None and piece.id == src.constants.PAWN and (rank == 0 or rank == 7):
+            flags = (flags & src.encoding.CAPTURE) | src.encoding.promotion_flags(PIECE_TYPE_IDS[promotion_type])
+        return src.encoding.encode_move(piece.rank * 8 + piece.file, rank * 8 + file, flags)
+
+    # This function turns a 16-bit encoded move back into the (piece, move, promotion type) form used by make_move and
+    # get_all_legal_moves. The piece is None if the from square is empty in the current position
+    def decode_move(self, code):
+        to_square = src.encoding.move_to(code)
+        promotion_id = src.encoding.promotion_id(code)
+        return self.squares[src.encoding.move_from(code)], (to_square // 8, to_square % 8), \
+            PIECE_TYPES[promotion_id] if promotion_id is not None else None
+
+    # This function plays a 16-bit encoded move through move, so it is checked the same way as a move made on the board.
+    # A promotion in the encoding is applied straight away instead of waiting for the player to pick a piece
+    def move_encoded(self, code):
+        piece, move, promotion_type = self.decode_move(code)
+        if piece is None or not self.move(piece, move):
             return False
+        if promotion_type is not None and self.is_promoting:
+            self.promote_pawn(self.look_at(*move), promotion_type)
+            self.is_promoting = False
+            self.is_gameover = False
+            self.game_result = None
+            self.check_gameover()
+        return True
+
+    # This function packs the position into src.encoding.POSITION_SIZE bytes, small enough to keep millions of
+    # positions in memory. Use ChessBoard.from_packed to turn it back into a board
+    def pack(self):
+        piece_codes = [src.encoding.piece_code(piece.id, piece.color) if piece is not None else 0
+                       for piece in self.squares]
+        en_passant_file = self.en_passant_square[1] if self.en_passant_square is not None else None
+        return src.encoding.pack_position(piece_codes, self.player_turn, self.get_castling_rights(), en_passant_file,
+                                          self.halfmove_clock, self.fullmove_number)
+
+    # This function builds a board from a position packed by ChessBoard.pack
+    @classmethod
+    def from_packed(cls, data, use_bitboards=False):
+        piece_codes, player_turn, castling_rights, en_passant_file, halfmove_clock, fullmove_number = \
+            src.encoding.unpack_position(data)
+        board = cls([], use_bitboards=use_bitboards)
+        for square, code in enumerate(piece_codes):
+            if code:
+                piece = PIECE_TYPES[src.encoding.code_piece_id(code)](square // 8, square % 8,
+                                                                      src.encoding.code_color(code))
+                piece.can_castle = False
+                board.squares[square] = piece
+        board.player_turn = player_turn
+        # Only the kings and rooks named by the castling rights are allowed to castle
+        for right, back_rank, rook_file in ((WHITE_KINGSIDE, 0, 7), (WHITE_QUEENSIDE, 0, 0), (BLACK_KINGSIDE, 7, 7),
+                                            (BLACK_QUEENSIDE, 7, 0)):
+            if castling_rights & right:
+                board.squares[back_rank * 8 + 4].can_castle = True
+                board.squares[back_rank * 8 + rook_file].can_castle = True
+        if en_passant_file is not None:
+            board.en_passant_square = (5 if player_turn == src.constants.WHITE else 2, en_passant_file)
+        board.halfmove_clock = halfmove_clock
+        board.fullmove_number = fullmove_number
+        board.zobrist_key = board.compute_zobrist_key()
+        return board
+
+    # This function takes back the last move made with make_move, restoring the board to exactly how it was before
+    def unmake_move(self):
+        piece, start, move, captured_piece, castling_rook, piece_can_castle, rook_can_castle, en_passant_square, \
+            player_turn, is_gameover, is_promoting, game_result, halfmove_clock, fullmove_number, zobrist_key = \
+            self.undo_list.pop()
+        self.move_list.pop()
+        rank, file = move
+        # Clear the destination square, which also removes any piece the pawn was promoted to
+        self.remove_piece(self.squares[rank * 8 + file])
+        piece.rank, piece.file = start
+        self.place_piece(piece)
+        piece.can_castle = piece_can_castle
+        if castling_rook is not None:
+            self.relocate_piece(castling_rook, rank, 7 if file > start[1] else 0)
+            castling_rook.can_castle = rook_can_castle
+        if captured_piece is not None:
+            self.captured_pieces.pop()
+            self.place_piece(captured_piece)
+        self.en_passant_square = en_passant_square
+        self.player_turn = player_turn
+        self.is_gameover = is_gameover
+        self.is_promoting = is_promoting
+        self.game_result = game_result
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.zobrist_key = zobrist_key
+
+    # This function returns the bitboard engine's copy of the current position. It is only built from the mailbox the
+    # first time, after which place_piece and remove_piece keep its pieces up to date
+    def get_bitboard_position(self):
+        if self.bitboard_position is None:
+            self.bitboard_position = BitboardPosition.from_chess_board(self)
+        return self.bitboard_position
+
+    # This function finds the legal moves of every piece of the given piece's color at once with the bitboard engine and
+    # caches them for the position, then returns the moves of the given piece in the same (rank, file) form as
+    # Piece.get_legal_moves
+    def get_bitboard_legal_moves(self, piece):
+        position = self.get_bitboard_position()
+        # Only the pieces are kept up to date, so the rest of the state is set for the moves being generated. En passant
+        # is only ever available to the player whose turn it is
+        position.player_turn = piece.color
+        position.castling_rights = self.get_castling_rights()
+        position.en_passant_square = None
+        if self.en_passant_square is not None and piece.color == self.player_turn:
+            position.en_passant_square = self.en_passant_square[0] * 8 + self.en_passant_square[1]
+        # Group the moves by the square they start from. A promotion is one move per piece type, but is a single
+        # destination square to the piece objects, so only the queen promotion is kept
+        moves_by_square = {}
+        for (from_square, to_square, promotion_id) in position.generate_legal_moves():
+            if promotion_id == src.constants.NONE or promotion_id == src.constants.QUEEN:
+                moves_by_square.setdefault(from_square, []).append(SQUARE_COORDINATES[to_square])
+        piece_square = piece.rank * 8 + piece.file
+        for square in iterate_squares(position.occupancy[piece.color]):
+            if square != piece_square:
+                self.cache_legal_moves(self.squares[square], moves_by_square.get(square, []))
+        return moves_by_square.get(piece_square, [])
+
+    # This function finds the legal moves of every piece of the player to move at once with src.move_generator and
+    # caches them for the position, then returns the moves of the given piece. It returns None if the player to move
+    # has no king, so nothing can be in check
+    def get_generated_legal_moves(self, piece):
+        legal_moves = generate_legal_moves(self)
+        if legal_moves is None:
+            return None
+        for other_piece, moves in legal_moves.items():
+            if other_piece is not piece:
+                self.cache_legal_moves(other_piece, moves)
+        return legal_moves.get(piece, [])
+
+    # This function returns the cached legal moves of a piece in the current position, or None if they have not been
+    # generated yet
+    def get_cached_legal_moves(self, piece):
+        if self.legal_move_cache_key == self.zobrist_key:
+            moves = self.legal_move_cache.get(piece.rank * 8 + piece.file)
+            if moves is not None:
+                self.legal_move_cache_hits += 1
+                return list(moves)
+        self.legal_move_cache_misses += 1
+        return None
 
-    def branch(self, piece, move):
-        branch = copy.deepcopy(self)
-        branch.is_branch = True
-        for future_piece in branch.pieces:
-            if piece.rank == future_piece.rank and piece.file == future_piece.file:
-                    branch.move(future_piece, move)
-        return branch
+    # This function stores the legal moves of a piece in the current position, dropping the moves of any other position.
+    # They are stored as a tuple and handed out as new lists, so a caller changing its list cannot change the cache
+    def cache_legal_moves(self, piece, moves):
+        if self.legal_move_cache_key != self.zobrist_key:
+            self.legal_move_cache_key = self.zobrist_key
+            self.legal_move_cache = {}
+        self.legal_move_cache[piece.rank * 8 + piece.file] = tuple(moves)
 
     # This function returns true if the king of the specified color is in check. Otherwise, false.
     def is_in_check(self, color):
-        king = None
-        for piece in self.pieces:
-            # If the king of the current player's turn is in check, return true
-            if piece.id == src.constants.KING and piece.color == color:
-                king = piece
-        for attacker in self.pieces:
-            if attacker.color != king.color:
-                attacks = attacker.get_legal_moves(self)
-                for (rank, file) in attacks:
-                    if rank == king.rank and file == king.file:
-                        return True
+        if self.check_cache_key != self.zobrist_key:
+            self.check_cache_key = self.zobrist_key
+            self.check_cache = [None, None]
+        elif self.check_cache[color] is not None:
+            return self.check_cache[color]
+        is_checked = False
+        if self.use_bitboards:
+            is_checked = self.get_bitboard_position().is_in_check(color)
+        else:
+            for king in self.squares:
+                if king is not None and king.id == src.constants.KING and king.color == color:
+                    is_checked = self.is_square_attacked(king.rank, king.file, not color)
+                    break
+        self.check_cache[color] = is_checked
+        return is_checked
+
+    # This function returns true if any piece of the given color attacks the square. Otherwise, false. Rather than
+    # listing the attacks of every piece, it looks outwards from the square for a piece that could reach it and stops at
+    # the first one found.
+    def is_square_attacked(self, rank, file, color):
+        if self.use_bitboards:
+            return self.get_bitboard_position().is_square_attacked(rank * 8 + file, color)
+        square = rank * 8 + file
+        squares = self.squares
+        # A pawn attacks diagonally forwards, so an attacking pawn stands where a pawn of the other color on this
+        # square would attack
+        for piece_id, targets in ((src.constants.PAWN, PAWN_ATTACKS[not color]), (src.constants.KNIGHT, KNIGHT_TARGETS),
+                                  (src.constants.KING, KING_TARGETS)):
+            for attacker_square in targets[square]:
+                attacker = squares[attacker_square]
+                if attacker is not None and attacker.id == piece_id and attacker.color == color:
+                    return True
+        for rays, sliders in ((ORTHOGONAL_RAYS, (src.constants.ROOK, src.constants.QUEEN)),
+                              (DIAGONAL_RAYS, (src.constants.BISHOP, src.constants.QUEEN))):
+            for ray in rays[square]:
+                # Only the first piece on each ray can attack along it
+                for attacker_square in ray:
+                    attacker = squares[attacker_square]
+                    if attacker is not None:
+                        if attacker.id in sliders and attacker.color == color:
+                            return True
+                        break
         return False
 
     # This function checks if the game is over and stores the result in self.game_result
     def check_gameover(self):
-        # Check if the player is in check and if they have any legal moves
-        legal_moves = []
-        is_checked = self.is_in_check(self.player_turn)
-        piece_count = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0}
-        color_count = {0: 0, 1: 0}
-        for piece in self.pieces:
-            piece_count[piece.id] = piece_count[piece.id] + 1
-            color_count[piece.color] = color_count[piece.color] + 1
-            if piece.color == self.player_turn:
-                legal_moves += piece.get_legal_moves(self)
-                if len(legal_moves) > 0:
-                    return
-        if len(legal_moves) == 0:
-            if is_checked:
+        # The game is drawn once the same position comes up for the third time
+        if self.is_repetition(3):
+            self.is_gameover = True
+            self.game_result = 'DRAW'
+            return
+        # If the player to move has no legal moves, the game is over by checkmate or stalemate. A tablebase already
+        # knows which it is for the positions it holds, otherwise finding a single legal move is enough to rule both out
+        terminal = self.tablebase.probe_terminal(self) if self.tablebase is not None else None
+        if terminal is None:
+            terminal = 'PLAYING' if self.has_any_legal_move() else \
+                'CHECKMATE' if self.is_in_check(self.player_turn) else 'STALEMATE'
+        if terminal != 'PLAYING':
+            if terminal == 'CHECKMATE':
                 if self.player_turn == src.constants.WHITE:
                     self.is_gameover = True
                     self.game_result = 'BLACK'
@@ -151,13 +613,18 @@ class ChessBoard:
             else:
                 self.is_gameover = True
                 self.game_result = 'DRAW'
+            return
+        piece_count = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0}
+        color_count = {0: 0, 1: 0}
+        for piece in self.pieces:
+            piece_count[piece.id] = piece_count[piece.id] + 1
+            color_count[piece.color] = color_count[piece.color] + 1
         # Check if there is sufficient material for checkmate
         if piece_count.get(src.constants.PAWN) <= 0 and piece_count.get(src.constants.QUEEN) <= 0 and \
             piece_count.get(src.constants.ROOK) <= 0:
             if color_count[src.constants.WHITE] < 3 and color_count[src.constants.BLACK] < 3:
                 self.is_gameover = True
                 self.game_result = 'DRAW'
-        # TODO: Check for 3-fold repetition draw
 
     def can_promote(self):
         for piece in self.pieces:
@@ -179,8 +646,13 @@ class ChessBoard:
 
     def promote_pawn(self, piece, promotion_type):
         if piece.id == src.constants.PAWN:
-            for promoter in self.pieces:
-                if promoter.rank == piece.rank and promoter.file == piece.file:
-                    self.pieces.remove(promoter)
-            self.pieces.append(promotion_type(piece.rank, piece.file, piece.color))
+            # Swap the pawn out for the promoted piece on the same square
+            self.remove_piece(piece)
+            self.place_piece(promotion_type(piece.rank, piece.file, piece.color))
+            # Record the promotion in the encoding of the move that brought the pawn here
+            if self.move_list and src.encoding.move_to(self.move_list[-1]) == piece.rank * 8 + piece.file and \
+                    src.encoding.promotion_id(self.move_list[-1]) is None:
+                flags = (src.encoding.move_flags(self.move_list[-1]) & src.encoding.CAPTURE) | \
+                    src.encoding.promotion_flags(PIECE_TYPE_IDS[promotion_type])
+                self.move_list[-1] = (self.move_list[-1] & 0xfff) | (flags << 12)
 
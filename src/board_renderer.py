@@ -1,11 +1,32 @@
+import time
+
 import pyglet
 from pyglet.shapes import Rectangle, Circle
 from pyglet.sprite import Sprite
 
+import src.assets
 import src.constants
 from src.board import ChessBoard
 from src.piece import Queen, Rook, Knight, Bishop, King, Pawn
 
+# The layers the board is drawn in, from the bottom up. A layer is marked dirty when its contents change, and the window
+# is only redrawn while some layer is dirty. Layers below the lowest dirty layer are left as they are in the window
+TILES_LAYER = 'tiles'
+MARKERS_LAYER = 'markers'
+PIECES_LAYER = 'pieces'
+GAME_RESULT_LAYER = 'game result'
+PROMOTION_LAYER = 'promotion'
+ALL_LAYERS = (TILES_LAYER, MARKERS_LAYER, PIECES_LAYER, GAME_RESULT_LAYER, PROMOTION_LAYER)
+
+# The text and color of the game result message for each game result
+GAME_RESULT_MESSAGES = {
+    'WHITE': ('WHITE WINS', (255, 255, 255, 255)),
+    'BLACK': ('BLACK WINS', (0, 0, 0, 255)),
+    'DRAW': ('DRAW', (127, 127, 127, 255))
+}
+
+# The pieces offered in the pawn promotion menu, with their offset on the square in half tiles
+PROMOTION_CHOICES = ((Queen, 0, 0), (Rook, 1, 0), (Knight, 0, 1), (Bishop, 1, 1))
 
 class ChessBoardRenderer:
     def __init__(self, x, y, width, height):
@@ -15,6 +36,8 @@ class ChessBoardRenderer:
         self.board_y = y
         self.board_width = width
         self.board_height = height
+        # Everything needs to be drawn for the first frame
+        self.dirty_layers = set(ALL_LAYERS)
 
         # Set up the width and height of our board tiles
         self.tile_width = self.board_width // 8
@@ -25,10 +48,17 @@ class ChessBoardRenderer:
         # Render the tiles into the batch
         self.render_tiles()
 
-        # Create our batch to draw our piece sprites from and a list to reference the piece sprites
+        # Create our batch to draw our piece sprites from and a dictionary mapping each piece to its sprite. Sprites are
+        # kept between updates, so a move only touches the sprites of the pieces it moved, captured or promoted
         self.pieces_batch = pyglet.graphics.Batch()
-        self.piece_sprites = []
+        self.piece_sprites = {}
         self.piece_scale = self.tile_width / width
+        # Counters to check that the number of sprites and the frame time stay flat over a long session
+        self.sprites_created = 0
+        self.sprites_deleted = 0
+        self.frame_count = 0
+        self.total_frame_time = 0
+        self.last_frame_time = 0
         self.render_pieces()
 
         # Vars to help with which piece is selected on the screen
@@ -38,22 +68,66 @@ class ChessBoardRenderer:
         self.selected_sprite = None
         self.selected_piece = None
 
-        # Vars to help with displaying game result
+        # Vars to help with displaying game result. The label is created once and only has its text changed
         self.game_result_message = None
         self.game_result_batch = pyglet.graphics.Batch()
 
-        # Vars to help with pawn promotion
+        # Vars to help with pawn promotion. Like the piece sprites, the menu sprites are kept in a dictionary, mapping
+        # each promotion piece to its sprite, and are only moved when the menu is shown somewhere else
         self.promotion_menu_pos = (0, 0)
-        self.pawn_promotion = []
+        self.promotion_menu = None
+        self.promotion_sprites = {}
+        self.promotion_background = None
         self.pawn_promotion_batch = pyglet.graphics.Batch()
 
+    # This function draws the lowest dirty layer and every layer above it, since those are drawn over it. The layers
+    # below it are still in the window from the last frame
     def draw(self):
-        self.tile_batch.draw()
-        self.selected_piece_batch.draw()
-        self.pieces_batch.draw()
-        self.game_result_batch.draw()
-        if self.board.is_promoting:
-            self.pawn_promotion_batch.draw()
+        if not self.is_dirty():
+            return
+        start_time = time.perf_counter()
+        lowest_dirty_layer = min(ALL_LAYERS.index(layer) for layer in self.dirty_layers)
+        layer_batches = (self.tile_batch, self.selected_piece_batch, self.pieces_batch, self.game_result_batch,
+                         self.pawn_promotion_batch)
+        for layer, batch in zip(ALL_LAYERS[lowest_dirty_layer:], layer_batches[lowest_dirty_layer:]):
+            if layer != PROMOTION_LAYER or self.board.is_promoting:
+                batch.draw()
+        self.last_frame_time = time.perf_counter() - start_time
+        self.total_frame_time += self.last_frame_time
+        self.frame_count += 1
+        self.dirty_layers.clear()
+
+    def mark_dirty(self, *layers):
+        self.dirty_layers.update(layers)
+
+    # This function marks layers dirty after something in them moved or was removed. Whatever was under it has to be
+    # drawn again, so the board is redrawn from the tiles up
+    def mark_uncovered(self, *layers):
+        self.dirty_layers.add(TILES_LAYER)
+        self.dirty_layers.update(layers)
+
+    # This function returns true if the given layer has changed since the board was last drawn
+    def is_layer_dirty(self, layer):
+        return layer in self.dirty_layers
+
+    # This function marks every layer dirty, for when the window contents were lost, such as after a resize or expose
+    def mark_all_dirty(self):
+        self.dirty_layers.update(ALL_LAYERS)
+
+    # This function returns true if anything has changed since the board was last drawn
+    def is_dirty(self):
+        return len(self.dirty_layers) > 0
+
+    # This function returns the frame time and sprite counters, to confirm memory and frame time stay flat over time
+    def get_render_stats(self):
+        return {
+            'frames': self.frame_count,
+            'last_frame_ms': self.last_frame_time * 1000,
+            'average_frame_ms': self.total_frame_time * 1000 / self.frame_count if self.frame_count > 0 else 0,
+            'piece_sprites': len(self.piece_sprites),
+            'sprites_created': self.sprites_created,
+            'sprites_deleted': self.sprites_deleted
+        }
 
     def update(self):
         # We don't need to re-render the tiles as they are static
@@ -86,20 +160,42 @@ class ChessBoardRenderer:
                 self.tile_list.append(rect)
 
     def render_pieces(self):
-        # CLear the list of sprites
-        self.piece_sprites = []
-        # Iterate through all pieces on the board and couple a sprite with each piece
-        for piece in self.board.pieces:
+        pieces = self.board.pieces
+        # Pieces that have left the board, by being captured or promoted, have their sprite deleted from the batch
+        pieces_on_board = set(pieces)
+        for piece in list(self.piece_sprites):
+            if piece not in pieces_on_board:
+                self.piece_sprites.pop(piece).delete()
+                self.sprites_deleted += 1
+                self.mark_uncovered(PIECES_LAYER)
+        # Iterate through all pieces on the board, moving the sprites of pieces that moved and adding a sprite for any
+        # new piece
+        for piece in pieces:
             x, y = self.rank_file_to_xy(piece.rank, piece.file)
-            image = src.constants.get_image(piece)
-            piece_sprite = Sprite(image, x=x, y=y, batch = self.pieces_batch)
-            piece_sprite.scale = self.tile_width / image.width
-            self.piece_sprites.append(piece_sprite)
+            piece_sprite = self.piece_sprites.get(piece)
+            if piece_sprite is None:
+                image = src.assets.get_image(piece)
+                piece_sprite = Sprite(image, x=x, y=y, batch = self.pieces_batch)
+                piece_sprite.scale = self.tile_width / image.width
+                self.piece_sprites[piece] = piece_sprite
+                self.sprites_created += 1
+                self.mark_dirty(PIECES_LAYER)
+            elif piece_sprite.x != x or piece_sprite.y != y:
+                piece_sprite.update(x=x, y=y)
+                self.mark_uncovered(PIECES_LAYER)
+
+    # Delete the move and check markers from their batch
+    def clear_move_markers(self):
+        if self.selected_piece_moves:
+            self.mark_uncovered(MARKERS_LAYER)
+        for marker in self.selected_piece_moves:
+            marker.delete()
+        self.selected_piece_moves = []
 
     def render_selected_piece_moves(self):
         if self.selected_sprite is not None:
             # Clear the list of possible move markers
-            self.selected_piece_moves = []
+            self.clear_move_markers()
             # Get all the possible moves of the piece
             legal_moves = self.selected_piece.get_legal_moves(self.board)
             for (rank, file) in legal_moves:
@@ -125,9 +221,9 @@ class ChessBoardRenderer:
                             batch=self.selected_piece_batch
                         )
                         self.selected_piece_moves.append(circ)
+            self.mark_dirty(MARKERS_LAYER)
         else:
-            self.selected_piece_moves = []
-            self.selected_piece_batch = pyglet.graphics.Batch()
+            self.clear_move_markers()
 
     def render_checked_king(self):
         # Find the white king and black king and see if either is in check
@@ -141,81 +237,72 @@ class ChessBoardRenderer:
                     batch=self.selected_piece_batch
                 )
                 self.selected_piece_moves.append(circ)
+                self.mark_dirty(MARKERS_LAYER)
 
+    # Render the game result message. The label is created the first time the game ends and only changes when the
+    # result does
     def render_gameover_message(self):
-        if self.board.is_gameover:
-            if self.board.game_result == 'WHITE':
-                self.game_result_message = pyglet.text.Label(
-                    'WHITE WINS',
-                    font_name='Times New Roman',
-                    font_size=src.constants.WINNER_TEXT_SIZE,
-                    x=self.board_x + (self.board_width // 2),
-                    y=self.board_y + (self.board_height // 2),
-                    anchor_x='center', anchor_y='center',
-                    batch=self.game_result_batch
-                )
-            elif self.board.game_result == 'BLACK':
-                self.game_result_message = pyglet.text.Label(
-                    'BLACK WINS',
-                    font_name='Times New Roman',
-                    font_size=src.constants.WINNER_TEXT_SIZE,
-                    x=self.board_x + (self.board_width // 2),
-                    y=self.board_y + (self.board_height // 2),
-                    anchor_x='center', anchor_y='center',
-                    batch=self.game_result_batch,
-                    color=(0,0,0,255)
-                )
-            elif self.board.game_result == 'DRAW':
-                self.game_result_message = pyglet.text.Label(
-                    'DRAW',
-                    font_name='Times New Roman',
-                    font_size=src.constants.WINNER_TEXT_SIZE,
-                    x=self.board_x + (self.board_width // 2),
-                    y=self.board_y + (self.board_height // 2),
-                    anchor_x='center', anchor_y='center',
-                    batch=self.game_result_batch,
-                    color=(127,127,127,255)
-                )
+        if not self.board.is_gameover or self.board.game_result not in GAME_RESULT_MESSAGES:
+            return
+        message, color = GAME_RESULT_MESSAGES[self.board.game_result]
+        if self.game_result_message is None:
+            self.game_result_message = pyglet.text.Label(
+                message,
+                font_name='Times New Roman',
+                font_size=src.constants.WINNER_TEXT_SIZE,
+                x=self.board_x + (self.board_width // 2),
+                y=self.board_y + (self.board_height // 2),
+                anchor_x='center', anchor_y='center',
+                batch=self.game_result_batch,
+                color=color
+            )
+            self.mark_dirty(GAME_RESULT_LAYER)
+        elif self.game_result_message.text != message:
+            self.game_result_message.text = message
+            self.game_result_message.color = color
+            self.mark_uncovered(GAME_RESULT_LAYER)
 
-    # Render the pawn promotion prompt
+    # Render the pawn promotion prompt. The menu sprites are created the first time a pawn promotes, then only moved
+    # to the promoting pawn's square and given the images for its color
     def render_pawn_promotion(self):
         promoted_piece = self.board.get_promoting_piece()
-        if promoted_piece is not None:
-            self.pawn_promotion = []
-            background = pyglet.graphics.OrderedGroup(0)
-            foreground = pyglet.graphics.OrderedGroup(1)
-            rank, file = promoted_piece.rank, promoted_piece.file
-            x, y = self.rank_file_to_xy(rank, file)
-            self.promotion_menu_pos = x, y
-            # Draw the four possible piece promotions at 1/4 the scale of each piece
-            queen_image = src.constants.get_image(Queen(0, 0, promoted_piece.color))
-            queen = Sprite(queen_image, x=x, y=y, batch=self.pawn_promotion_batch, group=foreground)
-            queen.scale = (0.5 * self.tile_width) / queen_image.width
-            self.pawn_promotion.append(queen)
-            rook_image = src.constants.get_image(Rook(0, 0, promoted_piece.color))
-            rook = Sprite(rook_image, x=x + (0.5 * self.tile_width), y=y,
-                          batch=self.pawn_promotion_batch, group=foreground)
-            rook.scale = (0.5 * self.tile_width) / rook_image.width
-            self.pawn_promotion.append(rook)
-            knight_image = src.constants.get_image(Knight(0, 0, promoted_piece.color))
-            knight = Sprite(knight_image, x=x, y=y + (0.5 * self.tile_width),
-                            batch=self.pawn_promotion_batch, group=foreground)
-            knight.scale = (0.5 * self.tile_width) / knight_image.width
-            self.pawn_promotion.append(knight)
-            bishop_image = src.constants.get_image(Bishop(0, 0, promoted_piece.color))
-            bishop = Sprite(bishop_image, x=x + (0.5 * self.tile_width) , y=y + (0.5 * self.tile_width),
-                            batch=self.pawn_promotion_batch, group=foreground)
-            bishop.scale = (0.5 * self.tile_width) / bishop_image.width
-            self.pawn_promotion.append(bishop)
+        if promoted_piece is None:
+            return
+        x, y = self.rank_file_to_xy(promoted_piece.rank, promoted_piece.file)
+        if self.promotion_menu == (x, y, promoted_piece.color):
+            return
+        if self.promotion_menu is not None:
+            self.mark_uncovered(PROMOTION_LAYER)
+        else:
+            self.mark_dirty(PROMOTION_LAYER)
+        self.promotion_menu = x, y, promoted_piece.color
+        self.promotion_menu_pos = x, y
+        if self.promotion_background is None:
             # Draw a grey box on the square as a background for the promotion menu
-            rect = Rectangle(
+            self.promotion_background = Rectangle(
                 x=x, y=y,
                 width=self.tile_width, height=self.tile_height,
                 color=(127, 127, 127),
                 batch=self.pawn_promotion_batch,
-                group=background
+                group=pyglet.graphics.OrderedGroup(0)
             )
-            self.pawn_promotion.append(rect)
+        else:
+            self.promotion_background.position = x, y
+        # Draw the four possible piece promotions at 1/4 the scale of each piece
+        foreground = pyglet.graphics.OrderedGroup(1)
+        for piece_type, x_offset, y_offset in PROMOTION_CHOICES:
+            image = src.assets.get_image(piece_type(0, 0, promoted_piece.color))
+            sprite_x = x + (x_offset * 0.5 * self.tile_width)
+            sprite_y = y + (y_offset * 0.5 * self.tile_width)
+            sprite = self.promotion_sprites.get(piece_type)
+            if sprite is None:
+                sprite = Sprite(image, x=sprite_x, y=sprite_y, batch=self.pawn_promotion_batch, group=foreground)
+                sprite.scale = (0.5 * self.tile_width) / image.width
+                self.promotion_sprites[piece_type] = sprite
+                self.sprites_created += 1
+            else:
+                sprite.image = image
+                sprite.update(x=sprite_x, y=sprite_y)
 
     # Based on the xy coords, get the piece/sprite at that location
     def select_piece_at(self, x, y):
@@ -230,18 +317,17 @@ class ChessBoardRenderer:
             self.update()
 
     def find_piece_at(self, x, y):
-        for sprite in self.piece_sprites:
-            # Check to see if the selection overlaps with one of the pieces on the board
-            if sprite.x <= x <= sprite.x + sprite.width:
-                if sprite.y <= y <= sprite.y + sprite.height:
-                    rank, file = self.xy_to_rank_file(sprite.x, sprite.y)
-                    piece = self.board.look_at(rank, file)
-                    # Figure out how far to offset the piece sprite from the mouse, so that it aligns with where the player
-                    # originally clicked the piece
-                    x = x - sprite.x
-                    y = y - sprite.y
-                    self.selected_offset = x, y
-                    return sprite, piece
+        # Look up the piece on the square under the cursor, and its sprite
+        rank, file = self.xy_to_rank_file(x, y)
+        piece = self.board.look_at(rank, file)
+        sprite = self.piece_sprites.get(piece) if piece is not None else None
+        if sprite is not None:
+            # Figure out how far to offset the piece sprite from the mouse, so that it aligns with where the player
+            # originally clicked the piece
+            x = x - sprite.x
+            y = y - sprite.y
+            self.selected_offset = x, y
+            return sprite, piece
         return None, None
 
     def get_promotion_selection(self, x, y):
@@ -263,13 +349,16 @@ class ChessBoardRenderer:
         if selection is not None:
             self.board.promote_pawn(piece, selection)
             self.board.is_promoting = False
-            self.pawn_promotion = []
+            # The menu sprites are kept for the next promotion, and are not drawn while no pawn is promoting
+            self.promotion_menu = None
+            self.mark_uncovered(PROMOTION_LAYER)
 
     def make_legal_move(self, piece, move):
         success = self.board.move(piece, move)
         if success:
             self.selected_piece, self.selected_sprite = None, None
             self.update()
+        return success
 
     def is_selected(self):
         return True if self.selected_sprite is not None else False
@@ -279,6 +368,7 @@ class ChessBoardRenderer:
             x=x-self.selected_offset[0],
             y=y-self.selected_offset[1]
         )
+        self.mark_uncovered(PIECES_LAYER)
 
     def reset_selected(self):
         if self.selected_piece is not None:
@@ -1,5 +1,3 @@
-import pyglet.image
-
 # Define all the piece and color id #'s
 NONE = 0
 
@@ -13,27 +11,10 @@ KING = 6
 WHITE = 1
 BLACK = 0
 
-# Images for pieces
-image_dict = {}
-
-# Game message settings
-WINNER_TEXT_SIZE = 72
+# Letters used for each piece in FEN strings and move notation. White pieces are written in upper case
+PIECE_LETTERS = {PAWN: 'p', KNIGHT: 'n', BISHOP: 'b', ROOK: 'r', QUEEN: 'q', KING: 'k'}
 
-# Load in the images
-def initialize():
-    image_dict[(WHITE, PAWN)] = pyglet.image.load('../assets/white_pawn.png')
-    image_dict[(WHITE, KNIGHT)] = pyglet.image.load('../assets/white_knight.png')
-    image_dict[(WHITE, BISHOP)] = pyglet.image.load('../assets/white_bishop.png')
-    image_dict[(WHITE, ROOK)] = pyglet.image.load('../assets/white_rook.png')
-    image_dict[(WHITE, QUEEN)] = pyglet.image.load('../assets/white_queen.png')
-    image_dict[(WHITE, KING)] = pyglet.image.load('../assets/white_king.png')
-    image_dict[(BLACK, PAWN)] = pyglet.image.load('../assets/black_pawn.png')
-    image_dict[(BLACK, KNIGHT)] = pyglet.image.load('../assets/black_knight.png')
-    image_dict[(BLACK, BISHOP)] = pyglet.image.load('../assets/black_bishop.png')
-    image_dict[(BLACK, ROOK)] = pyglet.image.load('../assets/black_rook.png')
-    image_dict[(BLACK, QUEEN)] = pyglet.image.load('../assets/black_queen.png')
-    image_dict[(BLACK, KING)] = pyglet.image.load('../assets/black_king.png')
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 
-def get_image(piece):
-    key = (piece.color, piece.id)
-    return image_dict[key]
\ No newline at end of file
+# Game message settings
+WINNER_TEXT_SIZE = 72
\ No newline at end of file
@@ -0,0 +1,90 @@
+import struct
+
+import src.constants
+
+# Moves are packed into 16 bits, in the usual from-to-flags layout: the from square in bits 0-5, the to square in bits
+# 6-11 and four flag bits on top. Squares are numbered rank * 8 + file, the same as the ChessBoard mailbox
+QUIET = 0
+DOUBLE_PAWN_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EN_PASSANT = 5
+# Promotions set the promotion bit, the low two flag bits pick the piece and the capture bit may also be set
+PROMOTION = 8
+PROMOTION_PIECE_IDS = [src.constants.KNIGHT, src.constants.BISHOP, src.constants.ROOK, src.constants.QUEEN]
+
+# Pieces are packed into 4 bits: the piece id in the low three bits and a set fourth bit for white. 0 is an empty square
+WHITE_BIT = 8
+
+# Packed positions are the 64 squares at two per byte, then the side to move and castling rights, the en passant file,
+# the halfmove clock and the fullmove number
+POSITION_FORMAT = struct.Struct('<32sBBBH')
+POSITION_SIZE = POSITION_FORMAT.size
+
+
+def encode_move(from_square, to_square, flags=QUIET):
+    return from_square | (to_square << 6) | (flags << 12)
+
+
+def move_from(code):
+    return code & 63
+
+
+def move_to(code):
+    return (code >> 6) & 63
+
+
+def move_flags(code):
+    return code >> 12
+
+
+def is_capture(code):
+    return (code >> 12) & CAPTURE != 0
+
+
+# This function returns the id of the piece a move promotes to, or None if it is not a promotion
+def promotion_id(code):
+    flags = code >> 12
+    if flags & PROMOTION:
+        return PROMOTION_PIECE_IDS[flags & 3]
+    return None
+
+
+# This function returns the flags for promoting to the piece with the given id
+def promotion_flags(piece_id):
+    return PROMOTION | PROMOTION_PIECE_IDS.index(piece_id)
+
+
+def piece_code(piece_id, color):
+    return piece_id | (WHITE_BIT if color == src.constants.WHITE else 0)
+
+
+def code_piece_id(code):
+    return code & 7
+
+
+def code_color(code):
+    return src.constants.WHITE if code & WHITE_BIT else src.constants.BLACK
+
+
+# This function packs a position into POSITION_SIZE bytes. piece_codes is the 64 piece codes in square order, the
+# castling rights are the four bits used by ChessBoard.get_castling_rights and the en passant file is None if there is
+# no en passant square
+def pack_position(piece_codes, player_turn, castling_rights, en_passant_file, halfmove_clock, fullmove_number):
+    squares = bytes(piece_codes[square] | (piece_codes[square + 1] << 4) for square in range(0, 64, 2))
+    state = (1 if player_turn == src.constants.WHITE else 0) | (castling_rights << 1)
+    return POSITION_FORMAT.pack(squares, state, en_passant_file + 1 if en_passant_file is not None else 0,
+                                min(halfmove_clock, 255), fullmove_number)
+
+
+# This function unpacks a position packed by pack_position, returning the same values that were packed
+def unpack_position(data):
+    squares, state, en_passant, halfmove_clock, fullmove_number = POSITION_FORMAT.unpack(data)
+    piece_codes = []
+    for byte in squares:
+        piece_codes.append(byte & 15)
+        piece_codes.append(byte >> 4)
+    player_turn = src.constants.WHITE if state & 1 else src.constants.BLACK
+    return piece_codes, player_turn, state >> 1, en_passant - 1 if en_passant else None, halfmove_clock, \
+        fullmove_number
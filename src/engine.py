@@ -0,0 +1,355 @@
+import argparse
+import sys
+import time
+
+import src.constants
+from src.board import ChessBoard
+from src.evaluation import PIECE_VALUES, evaluate
+from src.notation import move_to_string
+from src.opening_book import OpeningBook
+from src.piece import Knight, Bishop, Rook, Queen
+from src.tablebase import Tablebase, WIN_RESULT, DRAW_RESULT
+from src.transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+# Scores are in centipawns. A checkmate scores MATE less the number of plies it takes, so quicker mates score higher
+MATE = 100000
+MATE_THRESHOLD = MATE - 1000
+INFINITY = MATE + 1
+MAX_PLY = 128
+
+# The material gained by promoting to each piece
+PROMOTION_VALUES = {
+    Queen: PIECE_VALUES[src.constants.QUEEN], Rook: PIECE_VALUES[src.constants.ROOK],
+    Bishop: PIECE_VALUES[src.constants.BISHOP], Knight: PIECE_VALUES[src.constants.KNIGHT]
+}
+
+# How often, in nodes, the clock is checked against the time budget
+TIME_CHECK_INTERVAL = 1024
+
+
+# Raised inside the search to unwind it as soon as the time or node budget runs out, or a stop is requested
+class SearchStopped(Exception):
+    pass
+
+
+# The outcome of a search. The best move is a (piece, move, promotion type) tuple that can be played on the searched
+# board, and the principal variation is the expected line of play in coordinate notation
+class SearchResult:
+    def __init__(self, best_move, score, depth, pv, nodes, elapsed):
+        self.best_move = best_move
+        self.score = score
+        self.depth = depth
+        self.pv = pv
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.nps = int(nodes / elapsed) if elapsed > 0 else 0
+
+
+# This function turns a generated (piece, move, promotion type) tuple into a key that identifies the move by its
+# squares, so it can be compared across positions and stored in the transposition table
+def move_key(piece, move, promotion_type):
+    return (piece.rank, piece.file), move, promotion_type
+
+
+# A negamax alpha-beta searcher with iterative deepening, quiescence search and a transposition table. Moves are ordered
+# by the transposition table move, then captures by most valuable victim and least valuable attacker, then killer moves.
+# If given an opening book (see src.opening_book), positions in the book are answered with its heaviest move unsearched.
+# If given a tablebase (see src.tablebase), positions it holds are scored exactly below the root instead of searched
+class Engine:
+    def __init__(self, table_size=1 << 18, book=None, tablebase=None):
+        self.table = TranspositionTable(table_size)
+        self.book = book
+        self.tablebase = tablebase
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.pv_table = [[] for _ in range(MAX_PLY + 1)]
+        self.nodes = 0
+        self.node_limit = None
+        self.deadline = None
+        self.stop_requested = False
+        # A shared flag, such as a multiprocessing.Value, that lets another process stop the search
+        self.shared_stop = None
+
+    # This function asks a running search to stop. The search then returns the best move of its last completed
+    # iteration. The request stays until clear_stop, so a stop that comes in before the search has started is not lost
+    def stop(self):
+        self.stop_requested = True
+
+    # This function drops any earlier stop request. Callers that stop searches from another thread call it before
+    # starting the next search, never from inside the search
+    def clear_stop(self):
+        self.stop_requested = False
+
+    # This function searches the position on the board and returns a SearchResult. The search deepens one ply at a time
+    # until it reaches the depth, runs out of time (in seconds) or nodes, or is stopped. info is called with the result
+    # of every completed iteration. The board is always left exactly as it was given.
+    def search(self, board, depth=None, time_limit=None, node_limit=None, info=None):
+        if self.book is not None:
+            book_move = self.book.choose_move(board)
+            if book_move is not None:
+                return SearchResult(book_move, 0, 0, [move_to_string(*book_move)], 0, 0)
+        start_time = time.perf_counter()
+        self.start_search(time_limit, node_limit)
+        max_depth = depth if depth is not None else MAX_PLY - 1
+        undo_length = len(board.undo_list)
+
+        root_moves = board.get_all_legal_moves()
+        result = SearchResult(root_moves[0] if root_moves else None, 0, 0, [], 0, 0)
+        for iteration_depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(board, iteration_depth, -INFINITY, INFINITY, 0)
+            except SearchStopped:
+                # Take back every move the interrupted search had made
+                while len(board.undo_list) > undo_length:
+                    board.unmake_move()
+                break
+            pv = self.pv_table[0]
+            best_move = result.best_move
+            if pv:
+                for piece, move, promotion_type in root_moves:
+                    if move_key(piece, move, promotion_type) == pv[0]:
+                        best_move = (piece, move, promotion_type)
+            result = SearchResult(best_move, score, iteration_depth, pv_to_strings(board, pv), self.nodes,
+                                  time.perf_counter() - start_time)
+            if info is not None:
+                info(result)
+            # There is no point searching deeper once a forced mate has been found
+            if abs(score) >= MATE_THRESHOLD:
+                break
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start_time
+        result.nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+    # This function resets the node count and budgets before a search. A pending stop request is kept
+    def start_search(self, time_limit=None, node_limit=None):
+        self.nodes = 0
+        self.node_limit = node_limit
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.table.new_search()
+
+    # This function counts a node and raises SearchStopped once the search is out of budget
+    def count_node(self):
+        self.nodes += 1
+        if self.stop_requested:
+            raise SearchStopped()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchStopped()
+        if self.nodes % TIME_CHECK_INTERVAL == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchStopped()
+            if self.shared_stop is not None and self.shared_stop.value:
+                raise SearchStopped()
+
+    # This function returns the negamax score of the position from the point of view of the player to move
+    def negamax(self, board, depth, alpha, beta, ply):
+        self.count_node()
+        self.pv_table[ply] = []
+        if ply > 0 and (board.halfmove_clock >= 100 or board.is_repetition(2)):
+            return 0
+        if ply >= MAX_PLY - 1:
+            return evaluate(board)
+        # A tablebase position is scored as a mate in the number of plies it gives, counted from the root like any mate
+        if ply > 0 and self.tablebase is not None:
+            result = self.tablebase.probe(board)
+            if result is not None:
+                if result[0] == DRAW_RESULT:
+                    return 0
+                return MATE - ply - result[1] if result[0] == WIN_RESULT else -MATE + ply + result[1]
+
+        # Use the stored result if it was searched deep enough, and its move to order the search otherwise
+        original_alpha = alpha
+        table_move = None
+        entry = self.table.probe(board.zobrist_key)
+        if entry is not None:
+            table_move = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                value = score_from_table(entry[2], ply)
+                if entry[3] == EXACT:
+                    return value
+                elif entry[3] == LOWER_BOUND and value >= beta:
+                    return value
+                elif entry[3] == UPPER_BOUND and value <= alpha:
+                    return value
+
+        if depth <= 0:
+            return self.quiescence(board, alpha, beta, ply)
+
+        moves = board.get_all_legal_moves()
+        if not moves:
+            # Checkmate or stalemate
+            return -MATE + ply if board.is_in_check(board.player_turn) else 0
+
+        best_score = -INFINITY
+        best_move = None
+        for piece, move, promotion_type in self.order_moves(board, moves, table_move, ply):
+            key = move_key(piece, move, promotion_type)
+            is_capture = self.is_capture(board, piece, move)
+            board.make_move(piece, move, promotion_type)
+            score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = key
+            if score > alpha:
+                alpha = score
+                self.pv_table[ply] = [key] + self.pv_table[ply + 1]
+            if alpha >= beta:
+                # Remember quiet moves that cause a cutoff, they are likely to do so again at the same ply
+                if not is_capture and promotion_type is None and self.killers[ply][0] != key:
+                    self.killers[ply][1] = self.killers[ply][0]
+                    self.killers[ply][0] = key
+                break
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.table.store(board.zobrist_key, depth, score_to_table(best_score, ply), flag, best_move)
+        return best_score
+
+    # This function searches captures only until the position is quiet, so the evaluation is never taken in the middle
+    # of an exchange. The player to move may also stand pat on the static evaluation, unless they are in check.
+    def quiescence(self, board, alpha, beta, ply):
+        if ply >= MAX_PLY - 1:
+            return evaluate(board)
+        in_check = board.is_in_check(board.player_turn)
+        if not in_check:
+            stand_pat = evaluate(board)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+        moves = board.get_all_legal_moves()
+        if in_check and not moves:
+            return -MATE + ply
+        if not in_check:
+            moves = [(piece, move, promotion_type) for piece, move, promotion_type in moves
+                     if promotion_type is not None or self.is_capture(board, piece, move)]
+        best_score = alpha
+        for piece, move, promotion_type in self.order_moves(board, moves, None, ply):
+            self.count_node()
+            board.make_move(piece, move, promotion_type)
+            score = -self.quiescence(board, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return best_score
+
+    # This function returns true if the move captures a piece, including en passant
+    def is_capture(self, board, piece, move):
+        if board.look_at(*move) is not None:
+            return True
+        return piece.id == src.constants.PAWN and move[1] != piece.file
+
+    # This function sorts the moves so that the ones most likely to be best are searched first
+    def order_moves(self, board, moves, table_move, ply):
+        killers = self.killers[ply] if ply < MAX_PLY else [None, None]
+        scored_moves = []
+        for piece, move, promotion_type in moves:
+            key = move_key(piece, move, promotion_type)
+            if key == table_move:
+                score = 1000000
+            elif self.is_capture(board, piece, move):
+                # Most valuable victim, least valuable attacker
+                victim = board.look_at(*move)
+                victim_value = PIECE_VALUES[victim.id] if victim is not None else PIECE_VALUES[src.constants.PAWN]
+                score = 100000 + victim_value * 10 - PIECE_VALUES[piece.id]
+            elif promotion_type is not None:
+                score = 95000
+            elif key == killers[0]:
+                score = 90000
+            elif key == killers[1]:
+                score = 80000
+            else:
+                score = 0
+            if promotion_type is not None:
+                score += PROMOTION_VALUES[promotion_type]
+            scored_moves.append((score, len(scored_moves), piece, move, promotion_type))
+        scored_moves.sort(reverse=True)
+        return [(piece, move, promotion_type) for score, index, piece, move, promotion_type in scored_moves]
+
+
+# This function plays through a principal variation of move keys to write each move in coordinate notation
+def pv_to_strings(board, pv):
+    names = []
+    for (start, move, promotion_type) in pv:
+        piece = board.look_at(*start)
+        if piece is None:
+            break
+        names.append(move_to_string(piece, move, promotion_type))
+        board.make_move(piece, move, promotion_type)
+    for _ in names:
+        board.unmake_move()
+    return names
+
+
+# Mate scores are stored relative to the position rather than the root, so they stay right when the position is reached
+# again at a different ply
+def score_to_table(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_table(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+# This function writes a score the way chess interfaces show it, either in centipawns or as a number of moves to mate
+def score_to_string(score):
+    if abs(score) >= MATE_THRESHOLD:
+        moves_to_mate = (MATE - abs(score) + 1) // 2
+        return 'mate {}'.format(moves_to_mate if score > 0 else -moves_to_mate)
+    return 'cp {}'.format(score)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Search a position for the best move')
+    parser.add_argument('--fen', help='position to search, instead of the start position')
+    parser.add_argument('--depth', type=int, help='maximum depth to search in plies')
+    parser.add_argument('--time', type=float, help='time budget in seconds')
+    parser.add_argument('--nodes', type=int, help='node budget')
+    parser.add_argument('--bitboards', action='store_true', help='generate moves with the bitboard engine')
+    parser.add_argument('--book', help='Polyglot opening book to play from before searching')
+    parser.add_argument('--tablebase', help='directory of endgame tables to score positions with few pieces')
+    args = parser.parse_args(args)
+
+    if args.fen is None:
+        board = ChessBoard(use_bitboards=args.bitboards)
+    else:
+        board = ChessBoard.from_fen(args.fen, args.bitboards)
+    depth = args.depth
+    if depth is None and args.time is None and args.nodes is None:
+        depth = 4
+
+    def print_info(result):
+        print('info depth {} score {} nodes {} nps {} time {} pv {}'.format(
+            result.depth, score_to_string(result.score), result.nodes, result.nps, int(result.elapsed * 1000),
+            ' '.join(result.pv)))
+
+    book = OpeningBook(args.book) if args.book is not None else None
+    tablebase = Tablebase(args.tablebase) if args.tablebase is not None else None
+    board.tablebase = tablebase
+    result = Engine(book=book, tablebase=tablebase).search(board, depth, args.time, args.nodes, print_info)
+    if result.best_move is None:
+        print('bestmove (none)')
+    else:
+        print('bestmove {}'.format(move_to_string(*result.best_move)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
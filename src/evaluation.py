@@ -0,0 +1,91 @@
+import src.constants
+
+# Material value of each piece in centipawns. The king is never traded, so it has no material value
+PIECE_VALUES = {
+    src.constants.PAWN: 100, src.constants.KNIGHT: 320, src.constants.BISHOP: 330, src.constants.ROOK: 500,
+    src.constants.QUEEN: 900, src.constants.KING: 0
+}
+
+# Piece-square tables give a bonus or penalty for a piece standing on each square. They are written from white's side
+# of the board with the 8th rank first, the way a board diagram is drawn
+PIECE_SQUARE_TABLES = {
+    src.constants.PAWN: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0
+    ],
+    src.constants.KNIGHT: [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50
+    ],
+    src.constants.BISHOP: [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20
+    ],
+    src.constants.ROOK: [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0
+    ],
+    src.constants.QUEEN: [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20
+    ],
+    src.constants.KING: [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20
+    ]
+}
+
+
+# This function returns the value of a piece on its square, counting both its material and its piece-square bonus
+def piece_value(piece_id, color, rank, file):
+    # White reads the table upside down since it is drawn with the 8th rank first, black reads it as written
+    table_rank = 7 - rank if color == src.constants.WHITE else rank
+    return PIECE_VALUES[piece_id] + PIECE_SQUARE_TABLES[piece_id][table_rank * 8 + file]
+
+
+# This function scores the position in centipawns from the point of view of the player to move
+def evaluate(board):
+    score = 0
+    for piece in board.squares:
+        if piece is not None:
+            if piece.color == src.constants.WHITE:
+                score += piece_value(piece.id, piece.color, piece.rank, piece.file)
+            else:
+                score -= piece_value(piece.id, piece.color, piece.rank, piece.file)
+    return score if board.player_turn == src.constants.WHITE else -score
@@ -0,0 +1,357 @@
+import argparse
+import collections
+import heapq
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+import src.encoding
+from src.board import ChessBoard
+from src.notation import move_to_string
+from src.pgn import PGNError, PGNGame, read_games, parse_san, is_game_finished, batch_games, BATCH_SIZE, \
+    BATCHES_PER_WORKER
+from src.self_play import RESULT_CODES, RESULT_NAMES, read_binary_games
+
+# A database is a directory of three files:
+#     games.bin      the games one after another, each a record header, the packed start position if the game does
+#                    not start from the standard position, and one 16-bit encoded move per ply (see src.encoding)
+#     games.idx      the offset of each game's record in games.bin, eight bytes per game
+#     positions.idx  an entry of Zobrist key, game and ply for every position of every game, sorted by key
+# Games are numbered from 0 in the order they were added, and ply counts the moves played before the position
+GAMES_FILE = 'games.bin'
+OFFSETS_FILE = 'games.idx'
+POSITIONS_FILE = 'positions.idx'
+GAME_HEADER = struct.Struct('<BBH')
+OFFSET_FORMAT = struct.Struct('<Q')
+ENTRY_FORMAT = struct.Struct('<QIH')
+ENTRY_SIZE = ENTRY_FORMAT.size
+KEY_FORMAT = struct.Struct('<Q')
+# Set in a game header's flags when the packed start position follows the header
+HAS_START_POSITION = 1
+START_KEY = ChessBoard().zobrist_key
+
+# How many index entries are gathered in memory before they are sorted and written out as one run, and how many bytes
+# are read and written at a time while the runs are merged into the index
+RUN_SIZE = 1 << 20
+IO_BUFFER_SIZE = 1 << 20
+
+
+# This function replays a game read from a PGN archive or a self-play binary file through ChessBoard.move, which checks
+# every move. The task is the name of the file the game came from and the game. It returns the game's record for
+# games.bin and the Zobrist keys of its positions, starting with the start position, or None and a message saying why
+# the game could not be replayed
+def replay_game(task):
+    source, game = task
+    is_pgn = isinstance(game, PGNGame)
+    if is_pgn:
+        try:
+            board = ChessBoard.from_fen(game.headers['FEN']) if 'FEN' in game.headers else ChessBoard()
+        except ValueError as error:
+            return None, '{}: game {}: bad FEN header: {}'.format(source, game.index, error)
+    else:
+        board = ChessBoard()
+    start_position = board.pack() if board.zobrist_key != START_KEY else b''
+    moves = array('H')
+    keys = array('Q', [board.zobrist_key])
+    for move in game.moves:
+        try:
+            if is_game_finished(board):
+                raise PGNError('the game is already over')
+            # PGN moves are (SAN, line number) pairs, self-play moves are already encoded
+            code = board.encode_move(*parse_san(board, move[0])) if is_pgn else move
+            if not board.move_encoded(code):
+                raise PGNError('illegal move')
+        except PGNError as error:
+            return None, '{}: game {} ply {}: {}'.format(source, game.index, len(moves) + 1, error)
+        moves.append(code)
+        keys.append(board.zobrist_key)
+    result = game.result if game.result in RESULT_CODES else '*'
+    header = GAME_HEADER.pack(RESULT_CODES[result], HAS_START_POSITION if start_position else 0, len(moves))
+    return header + start_position + moves.tobytes(), keys
+
+
+# This function replays a list of tasks in a worker process
+def replay_batch(tasks):
+    return [replay_game(task) for task in tasks]
+
+
+# A generator that replays the tasks of replay_game and yields the result for each, in order. With more than one
+# worker, batches of games are replayed in parallel while only a few batches are held in memory at a time
+def replay_games(tasks, workers=1):
+    if workers <= 1:
+        for task in tasks:
+            yield replay_game(task)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for batch in batch_games(tasks, BATCH_SIZE):
+            pending.append(pool.apply_async(replay_batch, (batch,)))
+            if len(pending) >= workers * BATCHES_PER_WORKER:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+# A generator that reads the entries of a sorted run or index file as (key, game, ply) tuples, a buffer at a time
+def read_entries(path):
+    with open(path, 'rb') as entries_file:
+        while True:
+            data = entries_file.read(IO_BUFFER_SIZE // ENTRY_SIZE * ENTRY_SIZE)
+            if not data:
+                return
+            yield from ENTRY_FORMAT.iter_unpack(data)
+
+
+# This function sorts a run of entries and writes it to a temporary file in the directory, returning its path
+def write_run(entries, directory):
+    entries.sort()
+    handle, path = tempfile.mkstemp(prefix='run-', suffix='.tmp', dir=directory)
+    with os.fdopen(handle, 'wb') as run_file:
+        for start in range(0, len(entries), IO_BUFFER_SIZE // ENTRY_SIZE):
+            run_file.write(b''.join(ENTRY_FORMAT.pack(*entry)
+                                    for entry in entries[start:start + IO_BUFFER_SIZE // ENTRY_SIZE]))
+    return path
+
+
+# This function adds games to the database in the directory, creating it if needed, and returns the number of games
+# added and the messages of the games that could not be replayed. games gives (file name, game) pairs, from any number
+# of files. Games are appended to games.bin as they are replayed, while their index entries are gathered into sorted
+# runs of RUN_SIZE entries on disk. The runs and the existing index are then merged into a new index in one sequential
+# pass, which replaces the old one once it is complete, so the index is written in large blocks and never updated in
+# place. Adding everything in one call rewrites the index once. If anything goes wrong before the new index is in
+# place, games.bin and games.idx are cut back to their old length, so no game is ever left out of the index
+def add_games(directory, games, workers=1):
+    os.makedirs(directory, exist_ok=True)
+    games_path = os.path.join(directory, GAMES_FILE)
+    offsets_path = os.path.join(directory, OFFSETS_FILE)
+    positions_path = os.path.join(directory, POSITIONS_FILE)
+    games_size = os.path.getsize(games_path) if os.path.exists(games_path) else 0
+    offsets_size = os.path.getsize(offsets_path) if os.path.exists(offsets_path) else 0
+    game_number = offsets_size // OFFSET_FORMAT.size
+    added = 0
+    errors = []
+    runs = []
+    entries = []
+    merged_path = None
+    try:
+        with open(games_path, 'ab') as games_file, open(offsets_path, 'ab') as offsets_file:
+            for record, keys in replay_games(games, workers):
+                if record is None:
+                    errors.append(keys)
+                    continue
+                offsets_file.write(OFFSET_FORMAT.pack(games_file.tell()))
+                games_file.write(record)
+                entries.extend((key, game_number, ply) for ply, key in enumerate(keys))
+                game_number += 1
+                added += 1
+                if len(entries) >= RUN_SIZE:
+                    runs.append(write_run(entries, directory))
+                    entries = []
+        if entries:
+            runs.append(write_run(entries, directory))
+            entries = []
+        sources = [read_entries(path) for path in runs]
+        if os.path.exists(positions_path):
+            sources.append(read_entries(positions_path))
+        handle, merged_path = tempfile.mkstemp(prefix='positions-', suffix='.tmp', dir=directory)
+        with os.fdopen(handle, 'wb') as merged_file:
+            buffer = []
+            for entry in heapq.merge(*sources):
+                buffer.append(ENTRY_FORMAT.pack(*entry))
+                if len(buffer) >= IO_BUFFER_SIZE // ENTRY_SIZE:
+                    merged_file.write(b''.join(buffer))
+                    buffer = []
+            merged_file.write(b''.join(buffer))
+        # Temporary files are only readable by their owner, unlike the files they replace
+        os.chmod(merged_path, 0o644)
+        os.replace(merged_path, positions_path)
+    except BaseException:
+        if merged_path is not None and os.path.exists(merged_path):
+            os.remove(merged_path)
+        for path, size in ((games_path, games_size), (offsets_path, offsets_size)):
+            if os.path.exists(path):
+                os.truncate(path, size)
+        raise
+    finally:
+        for path in runs:
+            os.remove(path)
+    return added, errors
+
+
+# A database of games and the positions they reached, read through memory maps. A position is found by binary searching
+# the sorted index for its Zobrist key, which touches a few dozen entries on as many index pages, so lookups take
+# microseconds however many games there are, and only the pages that lookups touch are ever read from disk
+class GameDatabase:
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = []
+        self.games = self.open_map(os.path.join(directory, GAMES_FILE))
+        self.offsets = self.open_map(os.path.join(directory, OFFSETS_FILE))
+        self.positions = self.open_map(os.path.join(directory, POSITIONS_FILE))
+        self.game_count = len(self.offsets) // OFFSET_FORMAT.size
+        self.entry_count = len(self.positions) // ENTRY_SIZE
+
+    def open_map(self, path):
+        data_file = open(path, 'rb')
+        self.files.append(data_file)
+        # Empty files cannot be mapped, and have nothing to look up anyway
+        if os.fstat(data_file.fileno()).st_size == 0:
+            return b''
+        data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Lookups jump around the files, so reading ahead of each one would only waste the page cache
+        if hasattr(data, 'madvise') and hasattr(mmap, 'MADV_RANDOM'):
+            data.madvise(mmap.MADV_RANDOM)
+        return data
+
+    def close(self):
+        for data in (self.games, self.offsets, self.positions):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for data_file in self.files:
+            data_file.close()
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # This function returns the index of the first entry with a key not less than the given key
+    def find_first(self, key):
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY_FORMAT.unpack_from(self.positions, middle * ENTRY_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # This function returns the (game, ply) pairs of every time a position with the Zobrist key was reached, in game
+    # order, at most limit of them if a limit is given
+    def find_position(self, key, limit=None):
+        found = []
+        index = self.find_first(key)
+        while index < self.entry_count and (limit is None or len(found) < limit):
+            entry_key, game, ply = ENTRY_FORMAT.unpack_from(self.positions, index * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            found.append((game, ply))
+            index += 1
+        return found
+
+    # This function returns a game as its result, its packed start position or None for the standard start position,
+    # and its encoded moves
+    def get_game(self, game):
+        if not 0 <= game < self.game_count:
+            raise IndexError('No game {} in the database'.format(game))
+        offset = OFFSET_FORMAT.unpack_from(self.offsets, game * OFFSET_FORMAT.size)[0]
+        result_code, flags, plies = GAME_HEADER.unpack_from(self.games, offset)
+        offset += GAME_HEADER.size
+        start_position = None
+        if flags & HAS_START_POSITION:
+            start_position = bytes(self.games[offset:offset + src.encoding.POSITION_SIZE])
+            offset += src.encoding.POSITION_SIZE
+        moves = array('H')
+        moves.frombytes(self.games[offset:offset + 2 * plies])
+        return RESULT_NAMES[result_code], start_position, moves
+
+    # This function returns the encoded move played at a ply of a game, or None if the game ended there
+    def get_move(self, game, ply):
+        offset = OFFSET_FORMAT.unpack_from(self.offsets, game * OFFSET_FORMAT.size)[0]
+        _, flags, plies = GAME_HEADER.unpack_from(self.games, offset)
+        if ply >= plies:
+            return None
+        offset += GAME_HEADER.size + (src.encoding.POSITION_SIZE if flags & HAS_START_POSITION else 0)
+        return struct.unpack_from('<H', self.games, offset + 2 * ply)[0]
+
+    # This function replays a game up to a ply, or to its end, and returns the board
+    def replay(self, game, ply=None):
+        _, start_position, moves = self.get_game(game)
+        board = ChessBoard.from_packed(start_position) if start_position is not None else ChessBoard()
+        for code in moves[:ply]:
+            board.make_move(*board.decode_move(code))
+        return board
+
+    # This function returns the moves played next from the position on the board, as (move in coordinate notation,
+    # number of games, number of those games won by white, drawn and won by black) tuples, the most played first.
+    # Games that ended in the position are not counted
+    def get_next_moves(self, board):
+        counts = {}
+        for game, ply in self.find_position(board.zobrist_key):
+            code = self.get_move(game, ply)
+            if code is None:
+                continue
+            stats = counts.setdefault(code, [0, 0, 0, 0])
+            stats[0] += 1
+            result = self.get_result(game)
+            if result in ('1-0', '1/2-1/2', '0-1'):
+                stats[('1-0', '1/2-1/2', '0-1').index(result) + 1] += 1
+        moves = []
+        for code, stats in counts.items():
+            piece, move, promotion_type = board.decode_move(code)
+            # A key collision could name a move from an empty square
+            if piece is not None:
+                moves.append((move_to_string(piece, move, promotion_type), *stats))
+        moves.sort(key=lambda move: -move[1])
+        return moves
+
+    def get_result(self, game):
+        offset = OFFSET_FORMAT.unpack_from(self.offsets, game * OFFSET_FORMAT.size)[0]
+        return RESULT_NAMES[self.games[offset]]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build a database of games indexed by position, or look positions up')
+    parser.add_argument('--directory', default='games.db', help='directory the database is kept in')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_parser = subparsers.add_parser('add', help='replay games and add them to the database')
+    add_parser.add_argument('files', nargs='+',
+                            help='PGN archives, or binary game files written by src.self_play (.bin)')
+    add_parser.add_argument('--workers', type=int, default=1,
+                            help='number of worker processes, 0 for one per core (default 1)')
+    add_parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    query_parser = subparsers.add_parser('query', help='list the games that reached a position and the moves played')
+    query_parser.add_argument('--fen', help='position to look up, instead of the start position')
+    query_parser.add_argument('--limit', type=int, default=10, help='number of games to list')
+    args = parser.parse_args(args)
+
+    if args.command == 'add':
+        workers = args.workers if args.workers > 0 else os.cpu_count()
+        start_time = time.perf_counter()
+        games = ((file_name, game) for file_name in args.files
+                 for game in (read_binary_games(file_name) if file_name.endswith('.bin') else read_games(file_name)))
+        total, errors = add_games(args.directory, games, workers)
+        invalid = len(errors)
+        if not args.quiet:
+            for error in errors:
+                print(error)
+        elapsed = time.perf_counter() - start_time
+        with GameDatabase(args.directory) as database:
+            print('Added {} games ({} invalid) in {:.3f}s ({:.1f} games/s), the database holds {} games and {} '
+                  'positions'.format(total, invalid, elapsed, total / elapsed if elapsed > 0 else 0,
+                                     database.game_count, database.entry_count))
+        return 1 if invalid > 0 else 0
+
+    board = ChessBoard() if args.fen is None else ChessBoard.from_fen(args.fen)
+    with GameDatabase(args.directory) as database:
+        start_time = time.perf_counter()
+        found = database.find_position(board.zobrist_key)
+        moves = database.get_next_moves(board)
+        elapsed = time.perf_counter() - start_time
+        print('{} games reached the position (looked up in {:.3f}ms)'.format(len(found), elapsed * 1000))
+        for name, games, white_wins, draws, black_wins in moves:
+            print('{:<6} {:>8} games  +{} ={} -{}'.format(name, games, white_wins, draws, black_wins))
+        for game, ply in found[:args.limit]:
+            print('game {} ply {} ({})'.format(game, ply, database.get_result(game)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import signal
+import sys
+import threading
+
+import src.constants
+from src.board import ChessBoard
+from src.notation import move_to_string, parse_move_string
+from src.self_play import get_termination
+
+RESULTS = {'WHITE': '1-0', 'BLACK': '0-1', 'DRAW': '1/2-1/2'}
+
+# Requests are JSON objects, one per line, with an op naming the request, an id that is copied into the reply, and the
+# fields the op needs:
+#     new          {"op": "new", "fen": optional FEN} starts a game and replies with its game number
+#     move         {"op": "move", "game": G, "move": "e2e4"} plays a move in coordinate notation
+#     state        {"op": "state", "game": G} replies with the FEN, side to move and result
+#     legal_moves  {"op": "legal_moves", "game": G} replies with every legal move in coordinate notation
+#     watch        {"op": "watch", "game": G} also sends the game's events to this connection
+#     close        {"op": "close", "game": G} drops the game
+# Replies have ok set to true or false, with an error message when false. When a move ends a game, every connection that
+# started or watches the game is sent {"event": "gameover", "game": G, "result": "1-0", "termination": "checkmate"}
+GAME_OPS = ('new', 'move', 'state', 'legal_moves', 'close')
+
+# The boards hosted by this process. A game always lives in the same worker, so its board never leaves that worker
+worker_games = {}
+
+
+# This function returns the state of a game as the fields of a reply
+def get_game_state(board):
+    state = {
+        'ok': True, 'fen': board.to_fen(), 'turn': 'white' if board.player_turn == src.constants.WHITE else 'black',
+        'result': RESULTS.get(board.game_result, '*') if board.is_gameover else '*'
+    }
+    if board.is_gameover:
+        state['termination'] = get_termination(board)
+    return state
+
+
+# This function plays a move in coordinate notation through ChessBoard.move, which checks that it is legal. A pawn
+# reaching the last rank must say which piece it promotes to
+def play_move(board, name):
+    if not isinstance(name, str):
+        raise ValueError('Missing move')
+    if board.is_gameover:
+        raise ValueError('The game is over')
+    piece, move, promotion_type = parse_move_string(board, name)
+    if piece is None or piece.color != board.player_turn:
+        raise ValueError('Illegal move {}'.format(name))
+    if (piece.id == src.constants.PAWN and move[0] in (0, 7)) != (promotion_type is not None):
+        raise ValueError('Illegal move {}'.format(name))
+    if not board.move_encoded(board.encode_move(piece, move, promotion_type)):
+        raise ValueError('Illegal move {}'.format(name))
+
+
+# This function runs a request on the game it names. It runs in a worker, where all the expensive legality work is done
+# away from the event loop, and only the small dictionaries of the request and reply pass between them
+def handle_game_request(game, op, argument):
+    if op == 'new':
+        try:
+            worker_games[game] = ChessBoard.from_fen(str(argument)) if argument else ChessBoard()
+        except (ValueError, IndexError, KeyError) as error:
+            return {'ok': False, 'error': 'Bad FEN: {}'.format(error)}
+        return get_game_state(worker_games[game])
+    board = worker_games.get(game)
+    if board is None:
+        return {'ok': False, 'error': 'Unknown game {}'.format(game)}
+    if op == 'move':
+        try:
+            play_move(board, argument)
+        except ValueError as error:
+            return {'ok': False, 'error': str(error)}
+        return get_game_state(board)
+    if op == 'state':
+        return get_game_state(board)
+    if op == 'legal_moves':
+        moves = [] if board.is_gameover else board.get_all_legal_moves()
+        return {'ok': True, 'moves': [move_to_string(*move) for move in moves]}
+    del worker_games[game]
+    return {'ok': True}
+
+
+# Hosts any number of games and runs their requests on a pool of workers. Each worker is a pool of its own with a
+# single process or thread, and every game is kept on one worker, so the requests of a game run one at a time and in
+# order while different games run side by side. With process workers the event loop never waits on move generation.
+class GameServer:
+    def __init__(self, workers=None, use_processes=True):
+        workers = workers if workers is not None else os.cpu_count()
+        if use_processes:
+            self.executors = [concurrent.futures.ProcessPoolExecutor(1) for _ in range(workers)]
+        else:
+            self.executors = [concurrent.futures.ThreadPoolExecutor(1) for _ in range(workers)]
+        self.game_numbers = itertools.count(1)
+        # The connections to send the events of each game to
+        self.watchers = {}
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+    # This function runs one game request on the game's worker
+    async def run_on_worker(self, game, op, argument=None):
+        executor = self.executors[game % len(self.executors)]
+        return await asyncio.get_running_loop().run_in_executor(executor, handle_game_request, game, op, argument)
+
+    # This function answers one request from a connection. send is called with every message for the connection. A
+    # request that fails in a way the checks below do not foresee, or whose worker fails, is answered with an error like
+    # any other bad request, so it cannot take the connection or the server down with it
+    async def handle_request(self, request, send):
+        op = request.get('op')
+        game = request.get('game')
+        try:
+            if op == 'new':
+                game = next(self.game_numbers)
+                # The game can be watched as soon as it has a number, even before its worker has set it up
+                self.watchers[game] = [send]
+                reply = await self.run_on_worker(game, op, request.get('fen'))
+                if reply['ok']:
+                    reply['game'] = game
+                else:
+                    del self.watchers[game]
+            elif op in GAME_OPS or op == 'watch':
+                if not isinstance(game, int):
+                    reply = {'ok': False, 'error': 'Missing game number'}
+                elif op == 'watch':
+                    if game in self.watchers:
+                        self.watchers[game].append(send)
+                        reply = {'ok': True}
+                    else:
+                        reply = {'ok': False, 'error': 'Unknown game {}'.format(game)}
+                else:
+                    reply = await self.run_on_worker(game, op, request.get('move'))
+                    if op == 'close' and reply['ok']:
+                        self.watchers.pop(game, None)
+            else:
+                reply = {'ok': False, 'error': 'Unknown op {!r}'.format(op)}
+        except Exception as error:
+            if op == 'new':
+                self.watchers.pop(game, None)
+            reply = {'ok': False, 'error': 'Request failed: {!r}'.format(error)}
+        if 'id' in request:
+            reply['id'] = request['id']
+        send(reply)
+        if op == 'move' and reply['ok'] and reply['result'] != '*':
+            event = {'event': 'gameover', 'game': game, 'result': reply['result'],
+                     'termination': reply['termination']}
+            for watcher in self.watchers.get(game, []):
+                watcher(event)
+
+    # This function reads requests from a stream of JSON lines and answers them as they complete. Requests are handled
+    # concurrently, so a slow request does not hold up the ones after it
+    async def serve_lines(self, lines, send):
+        tasks = set()
+        async for line in lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('requests must be JSON objects')
+            except ValueError as error:
+                send({'ok': False, 'error': 'Bad request: {}'.format(error)})
+                continue
+            task = asyncio.ensure_future(self.handle_request(request, send))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    # This function serves one socket connection until the client closes it
+    async def serve_connection(self, reader, writer):
+        def send(message):
+            if not writer.is_closing():
+                writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+
+        async def lines():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield line
+
+        try:
+            await self.serve_lines(lines(), send)
+        except ConnectionError:
+            pass
+        finally:
+            for watchers in self.watchers.values():
+                if send in watchers:
+                    watchers.remove(send)
+            writer.close()
+
+    # This function serves clients on a TCP socket until cancelled or terminated. ready is called with the port once it
+    # is listening
+    async def serve_tcp(self, host, port, ready=None):
+        stop_on_terminate()
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        async with server:
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            await server.serve_forever()
+
+    # This function serves requests from standard input and writes replies to standard output until input ends
+    async def serve_stdio(self):
+        stop_on_terminate()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def read_input():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(queue.put_nowait, line)
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        async def lines():
+            while True:
+                line = await queue.get()
+                if line is None:
+                    return
+                yield line
+
+        def send(message):
+            sys.stdout.write(json.dumps(message, separators=(',', ':')) + '\n')
+            sys.stdout.flush()
+
+        threading.Thread(target=read_input, daemon=True).start()
+        await self.serve_lines(lines(), send)
+
+
+# This function cancels the running task when the process is asked to terminate, so the server leaves through the same
+# clean shutdown as an interrupt and stops its workers. Signal handlers are not available on Windows event loops
+def stop_on_terminate():
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Host many games at once and validate their moves over JSON lines')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port to listen on, 0 to pick a free one')
+    parser.add_argument('--stdio', action='store_true', help='serve standard input and output instead of a socket')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes or threads')
+    parser.add_argument('--threads', action='store_true', help='run the games on worker threads instead of processes')
+    args = parser.parse_args(args)
+
+    server = GameServer(args.workers, not args.threads)
+    try:
+        if args.stdio:
+            asyncio.run(server.serve_stdio())
+        else:
+            def ready(port):
+                print('Listening on {}:{}'.format(args.host, port), file=sys.stderr, flush=True)
+
+            asyncio.run(server.serve_tcp(args.host, args.port, ready))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
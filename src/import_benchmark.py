@@ -0,0 +1,55 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# The modules a headless worker needs to play and check games
+HEADLESS_MODULES = ['src.board', 'src.piece']
+
+# Printed by the child interpreter: every third-party module that importing the headless core pulled in
+CHECK_SCRIPT = '''
+import sys
+import {modules}
+print(','.join(sorted(name for name in sys.modules if name.split('.')[0] in ('pyglet', 'numpy'))))
+'''
+
+
+# This function returns how long, in seconds, a fresh interpreter takes to run a script
+def time_interpreter(script, repeats):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    output = ''
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', script], cwd=root, check=True, capture_output=True,
+                                text=True).stdout
+        timings.append(time.perf_counter() - start_time)
+    # The fastest run is the one least disturbed by the rest of the machine
+    return min(timings), output.strip()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Check that the rules engine imports quickly and without pyglet')
+    parser.add_argument('--repeats', type=int, default=10, help='number of fresh interpreters to time')
+    parser.add_argument('--max-ms', type=float, default=100.0,
+                        help='fail if importing the headless core takes longer than this many milliseconds')
+    args = parser.parse_args(args)
+
+    baseline, _ = time_interpreter('pass', args.repeats)
+    elapsed, loaded = time_interpreter(CHECK_SCRIPT.format(modules=', '.join(HEADLESS_MODULES)), args.repeats)
+    import_ms = (elapsed - baseline) * 1000
+    print('Interpreter startup: {:.1f} ms'.format(baseline * 1000))
+    print('Importing {}: {:.1f} ms'.format(', '.join(HEADLESS_MODULES), import_ms))
+    print('Third-party modules loaded: {}'.format(loaded or 'none'))
+    if loaded:
+        print('FAILED: the headless core must only import the standard library')
+        return 1
+    if import_ms > args.max_ms:
+        print('FAILED: import took longer than {:.1f} ms'.format(args.max_ms))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
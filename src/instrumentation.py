@@ -0,0 +1,256 @@
+import argparse
+import collections
+import contextlib
+import cProfile
+import functools
+import os
+import random
+import sys
+import time
+
+import src.board
+from src.board import ChessBoard
+from src.perft import perft
+from src.piece import Piece
+
+# The hot methods that are timed while instrumentation is enabled. Legal moves are asked for through the Piece base
+# class for every piece type, and are counted separately for each type. The moves of every piece of the player to move
+# are found together by src.move_generator.generate_legal_moves, which is timed through the name src.board calls it by
+BOARD_METHODS = ['look_at', 'get_generated_legal_moves', 'is_in_check', 'check_gameover', 'make_move']
+PIECE_METHODS = ['get_legal_moves']
+GENERATOR_FUNCTION = 'generate_legal_moves'
+# The speed is given in moves made. Perft counts the moves of its last ply without making them, so perft reports more
+# nodes than there are moves made
+MOVE_METHOD = 'ChessBoard.make_move'
+
+
+# The number of calls to one method and the time spent in them, including the time spent in the methods they call
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+
+
+# Records how often the hot methods of the board and pieces are called and how long they take. While enabled, the
+# methods are replaced on their classes by timing wrappers, and disabling puts the original methods back, so the
+# instrumentation costs nothing at all when it is not in use. Only one Instrumentation can be enabled at a time
+class Instrumentation:
+    active = None
+
+    def __init__(self):
+        self.stats = collections.defaultdict(CallStats)
+        self.originals = []
+        self.start_time = None
+        self.elapsed = 0.0
+
+    def enable(self):
+        if Instrumentation.active is not None:
+            raise RuntimeError('Instrumentation is already enabled')
+        Instrumentation.active = self
+        for name in BOARD_METHODS:
+            self.wrap(ChessBoard, name, self.stats['ChessBoard.' + name])
+        for name in PIECE_METHODS:
+            self.wrap_by_type(Piece, name)
+        self.wrap(src.board, GENERATOR_FUNCTION, self.stats['move_generator.' + GENERATOR_FUNCTION])
+        self.start_time = time.perf_counter()
+
+    def disable(self):
+        if Instrumentation.active is not self:
+            return
+        self.elapsed += time.perf_counter() - self.start_time
+        for cls, name, method in reversed(self.originals):
+            setattr(cls, name, method)
+        self.originals = []
+        Instrumentation.active = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    # This function replaces a method of a class, or a function of a module, with a wrapper that adds its calls and time
+    # to stats
+    def wrap(self, cls, name, stats):
+        method = cls.__dict__[name]
+        self.originals.append((cls, name, method))
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats.calls += 1
+                stats.total_time += time.perf_counter() - start_time
+
+        setattr(cls, name, wrapper)
+
+    # This function replaces a method shared by several classes with a wrapper that keeps separate stats for the class
+    # of each object it is called on
+    def wrap_by_type(self, cls, name):
+        method = cls.__dict__[name]
+        self.originals.append((cls, name, method))
+        all_stats = self.stats
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats = all_stats[type(self).__name__ + '.' + name]
+                stats.calls += 1
+                stats.total_time += time.perf_counter() - start_time
+
+        setattr(cls, name, wrapper)
+
+    # This function returns the number of moves made per second of instrumented time
+    def moves_per_second(self):
+        elapsed = self.get_elapsed()
+        return self.stats[MOVE_METHOD].calls / elapsed if elapsed > 0 else 0
+
+    def get_elapsed(self):
+        if Instrumentation.active is self:
+            return self.elapsed + time.perf_counter() - self.start_time
+        return self.elapsed
+
+    # This function returns a table of the recorded stats, the most expensive methods first. Times include the time
+    # spent in the methods they call, so the rows do not add up to the total
+    def report(self):
+        elapsed = self.get_elapsed()
+        lines = ['{:<36} {:>10} {:>10} {:>10} {:>7}'.format('method', 'calls', 'total s', 'per call', '% time')]
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1].total_time):
+            if stats.calls == 0:
+                continue
+            lines.append('{:<36} {:>10} {:>10.3f} {:>8.2f}us {:>6.1f}%'.format(
+                name, stats.calls, stats.total_time, stats.total_time / stats.calls * 1e6,
+                stats.total_time / elapsed * 100 if elapsed > 0 else 0))
+        lines.append('{} moves made in {:.3f}s ({:.0f} moves/s, slowed down by the instrumentation)'.format(
+            self.stats[MOVE_METHOD].calls, elapsed, self.moves_per_second()))
+        return '\n'.join(lines)
+
+
+# A context manager that instruments the hot methods for the code in its block, e.g.
+#     with instrument() as instrumentation:
+#         perft(board, 3)
+#     print(instrumentation.report())
+@contextlib.contextmanager
+def instrument():
+    instrumentation = Instrumentation()
+    with instrumentation:
+        yield instrumentation
+
+
+# Records the time spent in every call stack through sys.setprofile and writes them in the collapsed stack format read
+# by flamegraph.pl, speedscope and similar tools: one line per stack of semicolon separated frames and microseconds
+class StackProfiler:
+    def __init__(self):
+        self.stack = []
+        self.times = collections.Counter()
+        self.last_time = None
+
+    def enable(self):
+        self.last_time = time.perf_counter()
+        sys.setprofile(self.profile)
+
+    def disable(self):
+        sys.setprofile(None)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disable()
+
+    def profile(self, frame, event, arg):
+        now = time.perf_counter()
+        # The time since the last event was spent in whatever is on top of the stack
+        if self.stack:
+            self.times[self.stack[-1]] += now - self.last_time
+        if event == 'call':
+            # co_qualname is only there from Python 3.11, so methods are named after the class of their self argument
+            name = frame.f_code.co_name
+            if 'self' in frame.f_locals:
+                name = type(frame.f_locals['self']).__name__ + '.' + name
+            self.push('{}:{}'.format(os.path.basename(frame.f_code.co_filename), name))
+        elif event == 'c_call':
+            self.push(getattr(arg, '__qualname__', getattr(arg, '__name__', repr(arg))))
+        elif self.stack:
+            self.stack.pop()
+        self.last_time = time.perf_counter()
+
+    def push(self, name):
+        self.stack.append(self.stack[-1] + ';' + name if self.stack else name)
+
+    def write(self, path):
+        with open(path, 'w') as output:
+            for stack, seconds in self.times.items():
+                microseconds = int(seconds * 1e6)
+                if microseconds > 0:
+                    output.write('{} {}\n'.format(stack, microseconds))
+
+
+# This function plays a game of random legal moves, which gives a repeatable workload with game over checks on every
+# move like a real game
+def play_random_game(seed, max_plies, use_bitboards=False):
+    rng = random.Random(seed)
+    board = ChessBoard(use_bitboards=use_bitboards)
+    while not board.is_gameover and len(board.move_list) < max_plies:
+        piece, move, promotion_type = rng.choice(board.get_all_legal_moves())
+        board.make_move(piece, move, promotion_type)
+        board.check_gameover()
+    return board
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Report where the time goes in a perft run or a scripted game')
+    parser.add_argument('workload', choices=('perft', 'game'), help='a perft run or a game of random moves')
+    parser.add_argument('--depth', type=int, default=3, help='perft depth')
+    parser.add_argument('--fen', help='position to run perft from, instead of the start position')
+    parser.add_argument('--games', type=int, default=1, help='number of random games to play')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first random game')
+    parser.add_argument('--max-plies', type=int, default=300, help='stop each random game after this many plies')
+    parser.add_argument('--bitboards', action='store_true', help='generate moves with the bitboard engine')
+    parser.add_argument('--profile',
+                        help='also write cProfile stats of the workload to this file, for pstats or snakeviz')
+    parser.add_argument('--collapsed', help='also write the workload\'s call stacks to this file for a flame graph')
+    args = parser.parse_args(args)
+
+    def run():
+        if args.workload == 'perft':
+            if args.fen is None:
+                board = ChessBoard(use_bitboards=args.bitboards)
+            else:
+                board = ChessBoard.from_fen(args.fen, args.bitboards)
+            print('Nodes: {}'.format(perft(board, args.depth)))
+        else:
+            for game in range(args.games):
+                play_random_game(args.seed + game, args.max_plies, args.bitboards)
+
+    # Each kind of output comes from its own run, so one does not add its overhead to the others
+    start_time = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start_time
+    print('Uninstrumented: {:.3f}s'.format(elapsed))
+    with instrument() as instrumentation:
+        run()
+    print(instrumentation.report())
+    if args.profile is not None:
+        profiler = cProfile.Profile()
+        profiler.runcall(run)
+        profiler.dump_stats(args.profile)
+        print('Wrote cProfile stats to {}'.format(args.profile))
+    if args.collapsed is not None:
+        stack_profiler = StackProfiler()
+        with stack_profiler:
+            run()
+        stack_profiler.write(args.collapsed)
+        print('Wrote collapsed stacks to {}'.format(args.collapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
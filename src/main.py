@@ -1,8 +1,8 @@
 from src.renderer import Renderer
-import src.constants
+import src.assets
 import sys
 
 # Load image assets
-src.constants.initialize()
+src.assets.initialize()
 # Initialize the renderer
 renderer = Renderer()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import src.constants
+from src.attack_tables import SQUARE_COORDINATES, KNIGHT_TARGETS, PAWN_ATTACKS, ORTHOGONAL_RAYS, DIAGONAL_RAYS
+
+
+# This function finds the pieces giving check to the king of the given color and the pieces of that color that are
+# pinned to their king. It returns the list of checkers, the squares that block or capture a single checker, and a
+# dictionary mapping each pinned piece to the squares it can still move to along its pin.
+def find_checkers_and_pins(board, king, color):
+    checkers = []
+    pins = {}
+    block_squares = set()
+    squares = board.squares
+    king_square = king.rank * 8 + king.file
+    for rays, sliders in ((ORTHOGONAL_RAYS, (src.constants.ROOK, src.constants.QUEEN)),
+                          (DIAGONAL_RAYS, (src.constants.BISHOP, src.constants.QUEEN))):
+        for ray in rays[king_square]:
+            # Walk out from the king, remembering the first of our own pieces that we pass
+            pinned_piece = None
+            for index, square in enumerate(ray):
+                piece = squares[square]
+                if piece is None:
+                    continue
+                if piece.color == color:
+                    # A second piece of our own color means nothing on this ray can pin or check
+                    if pinned_piece is not None:
+                        break
+                    pinned_piece = piece
+                    continue
+                if piece.id in sliders:
+                    ray_squares = [SQUARE_COORDINATES[ray_square] for ray_square in ray[:index + 1]]
+                    if pinned_piece is None:
+                        checkers.append(piece)
+                        block_squares.update(ray_squares)
+                    else:
+                        pins[pinned_piece] = set(ray_squares)
+                break
+    # Knights and pawns can give check but never pin. An attacking pawn stands where a pawn of our color on the king's
+    # square would attack
+    for piece_id, targets in ((src.constants.KNIGHT, KNIGHT_TARGETS), (src.constants.PAWN, PAWN_ATTACKS[color])):
+        for square in targets[king_square]:
+            piece = squares[square]
+            if piece is not None and piece.id == piece_id and piece.color != color:
+                checkers.append(piece)
+                block_squares.add(SQUARE_COORDINATES[square])
+    return checkers, block_squares, pins
+
+
+# This function returns the king's moves that do not step onto an attacked square. The king is lifted off the board
+# while the squares are checked so that it cannot hide from a sliding piece behind itself.
+def get_safe_king_moves(board, king):
+    moves = king.get_pseudo_legal_moves(board)
+    board.remove_piece(king)
+    # King.get_castle_moves rules out castling out of and through check, and the square the king lands on is checked
+    # here like any other
+    safe_moves = [move for move in moves if not board.is_square_attacked(move[0], move[1], not king.color)]
+    board.place_piece(king)
+    return safe_moves
+
+
+# This function returns a dictionary mapping each piece of the player to move to its legal moves. The checkers and
+# pinned pieces are found once for the whole position, so, unlike trying each move on the board, no move needs to be
+# simulated to see if it leaves the king in check. The only exception is en passant, which is rare enough to simply be
+# tried on the board. It returns None if the player to move has no king.
+def generate_legal_moves(board):
+    color = board.player_turn
+    king = None
+    for piece in board.squares:
+        if piece is not None and piece.id == src.constants.KING and piece.color == color:
+            king = piece
+    if king is None:
+        return None
+    checkers, block_squares, pins = find_checkers_and_pins(board, king, color)
+    legal_moves = {}
+    for piece in board.pieces:
+        if piece.color != color:
+            continue
+        if piece is king:
+            moves = get_safe_king_moves(board, king)
+        elif len(checkers) > 1:
+            # Only the king can get out of double check
+            moves = []
+        else:
+            moves = []
+            for move in piece.get_pseudo_legal_moves(board):
+                rank, file = move
+                if piece.id == src.constants.PAWN and file != piece.file and board.look_at(rank, file) is None:
+                    # Capturing en passant takes two pieces off the same rank, so try it on the board
+                    board.make_move(piece, move)
+                    if not board.is_in_check(color):
+                        moves.append(move)
+                    board.unmake_move()
+                    continue
+                if checkers and move not in block_squares:
+                    continue
+                if piece in pins and move not in pins[piece]:
+                    continue
+                moves.append(move)
+        legal_moves[piece] = moves
+    return legal_moves
@@ -0,0 +1,48 @@
+import src.constants
+from src.piece import Knight, Bishop, Rook, Queen
+
+FILE_NAMES = 'abcdefgh'
+PROMOTION_LETTERS = {Queen: 'q', Rook: 'r', Bishop: 'b', Knight: 'n'}
+
+
+# This function writes a square in algebraic notation, such as e4
+def square_to_string(rank, file):
+    return FILE_NAMES[file] + str(rank + 1)
+
+
+# This function writes a move in coordinate notation, such as e2e4 or a7a8q
+def move_to_string(piece, move, promotion_type=None):
+    name = square_to_string(piece.rank, piece.file) + square_to_string(*move)
+    if promotion_type is not None:
+        name += PROMOTION_LETTERS[promotion_type]
+    return name
+
+
+# This function reads a move written in coordinate notation, such as e2e4 or a7a8q, into a (piece, move, promotion type)
+# tuple without checking that it can be played. The piece is None if the from square is empty. It raises ValueError if
+# the move is malformed
+def parse_move_string(board, name):
+    if len(name) not in (4, 5) or name[0] not in FILE_NAMES or name[2] not in FILE_NAMES or \
+            name[1] not in '12345678' or name[3] not in '12345678':
+        raise ValueError('Not a move in coordinate notation: {!r}'.format(name))
+    piece = board.look_at(int(name[1]) - 1, FILE_NAMES.index(name[0]))
+    move = (int(name[3]) - 1, FILE_NAMES.index(name[2]))
+    promotion_type = None
+    if len(name) == 5:
+        promotion_type = next((piece_type for piece_type, letter in PROMOTION_LETTERS.items() if letter == name[4]),
+                              None)
+        if promotion_type is None:
+            raise ValueError('Unknown promotion piece in {!r}'.format(name))
+    return piece, move, promotion_type
+
+
+# This function finds the legal move written in coordinate notation and returns it as a (piece, move, promotion type)
+# tuple. It raises ValueError if the move is malformed or not legal in the position
+def string_to_move(board, name):
+    piece, move, promotion_type = parse_move_string(board, name)
+    if piece is None or piece.color != board.player_turn or move not in piece.get_legal_moves(board):
+        raise ValueError('Illegal move {}'.format(name))
+    is_promotion = piece.id == src.constants.PAWN and move[0] in (0, 7)
+    if is_promotion != (promotion_type is not None):
+        raise ValueError('Illegal move {}'.format(name))
+    return piece, move, promotion_type
@@ -0,0 +1,151 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import src.constants
+from src.board import ChessBoard
+from src.notation import move_to_string
+from src.piece import Knight, Bishop, Rook, Queen
+
+# Polyglot books are a sorted array of 16-byte big-endian entries: the position's Zobrist key, the move, its weight and
+# a learning value. Several entries with the same key give the choice of moves in that position
+ENTRY_FORMAT = struct.Struct('>QHHI')
+ENTRY_SIZE = ENTRY_FORMAT.size
+KEY_FORMAT = struct.Struct('>Q')
+
+# Polyglot moves hold the to file and rank in bits 0-5, the from file and rank in bits 6-11 and the promotion piece in
+# bits 12-14. Squares are numbered rank * 8 + file, the same as the ChessBoard mailbox
+POLYGLOT_PROMOTIONS = {1: Knight, 2: Bishop, 3: Rook, 4: Queen}
+
+
+# A Polyglot opening book read through a memory map. Opening a book reads nothing from it, whatever its size, and each
+# lookup binary searches the sorted entries, so only the few pages on the search path are ever read. Every process that
+# opens the same book shares its pages in the operating system's page cache instead of holding a copy of its own
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY_SIZE != 0:
+            self.file.close()
+            raise ValueError('{} is not a Polyglot book, its size is not a multiple of {} bytes'.format(
+                path, ENTRY_SIZE))
+        self.entry_count = size // ENTRY_SIZE
+        # Empty files cannot be mapped, and have nothing to look up anyway
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        # Lookups jump around the file, so reading ahead of each one would only waste the page cache
+        if size > 0 and hasattr(self.data, 'madvise') and hasattr(mmap, 'MADV_RANDOM'):
+            self.data.madvise(mmap.MADV_RANDOM)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # This function returns the index of the first entry with a key not less than the given key
+    def find_first(self, key):
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY_FORMAT.unpack_from(self.data, middle * ENTRY_SIZE)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # This function returns the (move, weight, learn) values of every entry for a Zobrist key, in book order
+    def get_entries(self, key):
+        entries = []
+        index = self.find_first(key)
+        while index < self.entry_count:
+            entry_key, move, weight, learn = ENTRY_FORMAT.unpack_from(self.data, index * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            entries.append((move, weight, learn))
+            index += 1
+        return entries
+
+    # This function returns the book moves for the position on the board as (piece, move, promotion type, weight)
+    # tuples, heaviest first. Moves that are not legal in the position, which a corrupt book or a key collision could
+    # give, are left out
+    def get_moves(self, board):
+        moves = []
+        for code, weight, _ in self.get_entries(board.zobrist_key):
+            book_move = decode_polyglot_move(board, code)
+            if book_move is None:
+                continue
+            piece, move, promotion_type = book_move
+            if piece.color == board.player_turn and move in piece.get_legal_moves(board):
+                moves.append((piece, move, promotion_type, weight))
+        moves.sort(key=lambda book_move: -book_move[3])
+        return moves
+
+    # This function picks a book move for the position as a (piece, move, promotion type) tuple, or returns None if
+    # the position is not in the book. With a random generator the moves are picked in proportion to their weights,
+    # otherwise the heaviest move is always picked
+    def choose_move(self, board, rng=None):
+        moves = [book_move for book_move in self.get_moves(board) if book_move[3] > 0]
+        if not moves:
+            return None
+        if rng is None:
+            piece, move, promotion_type, _ = moves[0]
+        else:
+            piece, move, promotion_type, _ = rng.choices(moves, weights=[book_move[3] for book_move in moves])[0]
+        return piece, move, promotion_type
+
+
+# This function turns a Polyglot move into the (piece, move, promotion type) form used by ChessBoard, or returns None if
+# its from square is empty. Polyglot writes castling as the king taking its own rook, which is turned into the king's
+# two square move
+def decode_polyglot_move(board, code):
+    to_square = code & 63
+    from_square = (code >> 6) & 63
+    piece = board.squares[from_square]
+    if piece is None:
+        return None
+    rank, file = to_square // 8, to_square % 8
+    if piece.id == src.constants.KING and piece.file == 4 and rank == piece.rank:
+        target = board.squares[to_square]
+        if target is not None and target.id == src.constants.ROOK and target.color == piece.color:
+            file = 6 if file == 7 else 2
+    return piece, (rank, file), POLYGLOT_PROMOTIONS.get((code >> 12) & 7)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='List the moves a Polyglot opening book gives for a position')
+    parser.add_argument('book', help='Polyglot .bin book')
+    parser.add_argument('--fen', help='position to look up, instead of the start position')
+    parser.add_argument('--line', type=int, default=0,
+                        help='play this many plies of weighted random book moves, printing each position\'s choices')
+    parser.add_argument('--seed', type=int, help='seed for the random book moves')
+    args = parser.parse_args(args)
+
+    board = ChessBoard() if args.fen is None else ChessBoard.from_fen(args.fen)
+    rng = random.Random(args.seed)
+    with OpeningBook(args.book) as book:
+        print('{} entries'.format(book.entry_count))
+        for ply in range(args.line + 1):
+            moves = book.get_moves(board)
+            total_weight = sum(weight for _, _, _, weight in moves)
+            print('{}: {}'.format(board.to_fen(), ', '.join(
+                '{} {:.1f}%'.format(move_to_string(piece, move, promotion_type),
+                                    100 * weight / total_weight if total_weight > 0 else 0)
+                for piece, move, promotion_type, weight in moves) or 'not in book'))
+            book_move = book.choose_move(board, rng)
+            if book_move is None or ply == args.line:
+                break
+            board.make_move(*book_move)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from src.board import ChessBoard
+from src.engine import Engine, SearchResult, SearchStopped, INFINITY, MATE_THRESHOLD, move_key, pv_to_strings, \
+    score_to_string
+from src.notation import move_to_string
+from src.transposition import UPPER_BOUND
+
+# Each worker process keeps its own engine, so its transposition table stays warm from one iteration to the next, and
+# the board of the position being searched. The best score found so far at the root and the stop flag are shared by
+# every worker through shared memory
+worker_engine = None
+worker_board = None
+worker_fen = None
+shared_alpha = None
+shared_stop = None
+
+
+# This function runs once in every worker process to set up its engine and the shared values
+def initialize_worker(alpha, stop, table_size):
+    global worker_engine, shared_alpha, shared_stop
+    worker_engine = Engine(table_size)
+    worker_engine.shared_stop = stop
+    shared_alpha = alpha
+    shared_stop = stop
+
+
+# This function stores the moves of a principal variation from the last iteration in the worker's transposition table,
+# so they are searched first even when another worker searched the line last time. Only positions the table knows
+# nothing about are given a move, and the entries are too shallow to ever be used for their score
+def seed_principal_variation(board, pv):
+    undo_length = len(board.undo_list)
+    for start, move, promotion_type in pv:
+        piece = board.look_at(*start)
+        if piece is None:
+            break
+        if worker_engine.table.probe(board.zobrist_key) is None:
+            worker_engine.table.store(board.zobrist_key, -1, 0, UPPER_BOUND, (start, move, promotion_type))
+        board.make_move(piece, move, promotion_type)
+    while len(board.undo_list) > undo_length:
+        board.unmake_move()
+
+
+# This function searches one root move in a worker. The window starts at the best score any worker has found so far,
+# so every move after the first is searched with a tighter bound. The moves the last iteration expected to follow the
+# root move are searched first. It returns the move, its score, whether the score is exact, the principal variation
+# below it and the number of nodes searched. A score no better than the bound it was searched with is only an upper
+# bound on the move's score. A score of None means the search ran out of budget before it finished.
+def search_root_move(task):
+    global worker_board, worker_fen
+    fen, use_bitboards, key, depth, deadline, node_limit, pv = task
+    if worker_fen != (fen, use_bitboards):
+        worker_board = ChessBoard.from_fen(fen, use_bitboards)
+        worker_fen = (fen, use_bitboards)
+    board = worker_board
+    time_limit = max(deadline - time.time(), 0) if deadline is not None else None
+    worker_engine.start_search(time_limit, node_limit)
+    if shared_stop.value:
+        return key, None, False, [], 0
+    start, move, promotion_type = key
+    board.make_move(board.look_at(*start), move, promotion_type)
+    seed_principal_variation(board, pv)
+    undo_length = len(board.undo_list)
+    try:
+        alpha = shared_alpha.value
+        score = -worker_engine.negamax(board, depth - 1, -INFINITY, -alpha, 1)
+        is_exact = score > alpha
+        pv = [key] + worker_engine.pv_table[1] if is_exact else []
+    except SearchStopped:
+        while len(board.undo_list) > undo_length:
+            board.unmake_move()
+        score, is_exact, pv = None, False, []
+    board.unmake_move()
+    if is_exact:
+        with shared_alpha.get_lock():
+            if score > shared_alpha.value:
+                shared_alpha.value = score
+    return key, score, is_exact, pv, worker_engine.nodes
+
+
+# A search that splits the root moves across a pool of worker processes. Every iteration of the iterative deepening
+# hands out the root moves best first, ordered like Engine.order_moves on the first iteration and by the scores of the
+# last iteration after that. The first move is searched on its own, so the others all start with its score as their
+# bound, and each worker tightens the shared root bound as soon as it finds a better move. It returns the same
+# SearchResult as Engine.search. Positions are sent to the workers as FEN, so repetitions of positions from before the
+# searched position are not seen.
+class ParallelEngine:
+    def __init__(self, workers=None, table_size=1 << 18):
+        self.workers = workers if workers is not None else os.cpu_count()
+        # Only used to order the root moves, so it needs no transposition table to speak of
+        self.ordering_engine = Engine(1)
+        self.shared_alpha = multiprocessing.Value('l', -INFINITY)
+        self.shared_stop = multiprocessing.Value('b', 0)
+        self.pool = multiprocessing.Pool(
+            self.workers, initializer=initialize_worker, initargs=(self.shared_alpha, self.shared_stop, table_size)
+        )
+
+    # This function asks a running search to stop. The search then returns the best move of its last completed
+    # iteration. As with Engine.stop, the request stays until clear_stop
+    def stop(self):
+        self.shared_stop.value = 1
+
+    def clear_stop(self):
+        self.shared_stop.value = 0
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # A generator that searches the root moves on the workers and yields the result of search_root_move for each as it
+    # finishes. The first move is searched before any other is handed out. After that a move is only handed out when a
+    # worker is free, with a node budget of whatever is left of the iteration's budget after the moves still running
+    # have taken theirs, so the iteration never goes over its budget and nodes a move did not use go to the moves after
+    # it. pvs maps root moves to the principal variation the last iteration found for them
+    def search_root_moves(self, fen, use_bitboards, keys, depth, deadline, node_limit, pvs):
+        results = queue.Queue()
+        available_nodes = node_limit
+        budgets = {}
+        pending = list(reversed(keys))
+        running = 0
+        is_first_move_done = False
+        while pending or running:
+            while pending and running < (self.workers if is_first_move_done else 1):
+                key = pending.pop()
+                budget = None
+                if available_nodes is not None:
+                    budget = available_nodes // (self.workers - running)
+                    if budget <= 0:
+                        pending.append(key)
+                        break
+                    available_nodes -= budget
+                budgets[key] = budget
+                task = (fen, use_bitboards, key, depth, deadline, budget, pvs.get(key, [])[1:])
+                self.pool.apply_async(search_root_move, (task,), callback=results.put, error_callback=results.put)
+                running += 1
+            if running == 0:
+                # Out of nodes before every move was searched
+                for key in pending:
+                    yield key, None, False, [], 0
+                return
+            result = results.get()
+            if isinstance(result, BaseException):
+                raise result
+            running -= 1
+            is_first_move_done = True
+            if available_nodes is not None:
+                available_nodes += budgets[result[0]] - result[4]
+            yield result
+
+    def search(self, board, depth=None, time_limit=None, node_limit=None, info=None):
+        start_time = time.perf_counter()
+        deadline = time.time() + time_limit if time_limit is not None else None
+        max_depth = depth if depth is not None else 64
+        fen = board.to_fen()
+        root_moves = self.ordering_engine.order_moves(board, board.get_all_legal_moves(), None, 0)
+        moves_by_key = {move_key(*root_move): root_move for root_move in root_moves}
+        ordered_keys = list(moves_by_key)
+        pvs = {}
+        result = SearchResult(root_moves[0] if root_moves else None, 0, 0, [], 0, 0)
+        nodes = 0
+        if len(root_moves) > 1:
+            for iteration_depth in range(1, max_depth + 1):
+                self.shared_alpha.value = -INFINITY
+                remaining_nodes = node_limit - nodes if node_limit is not None else None
+                if remaining_nodes is not None and remaining_nodes <= 0:
+                    break
+                scores = {}
+                best_key, best_score, best_pv = None, -INFINITY, []
+                is_complete = True
+                for key, score, is_exact, pv, task_nodes in self.search_root_moves(
+                        fen, board.use_bitboards, ordered_keys, iteration_depth, deadline, remaining_nodes, pvs):
+                    nodes += task_nodes
+                    if score is None:
+                        is_complete = False
+                        continue
+                    # An upper bound is still good enough to order the moves next time, but the move cannot be best:
+                    # it is no better than the exact score that raised the bound it was searched with
+                    scores[key] = score
+                    if not is_exact:
+                        continue
+                    pvs[key] = pv
+                    # Ties go to the move that was ordered first
+                    if score > best_score or (score == best_score and
+                                              ordered_keys.index(key) < ordered_keys.index(best_key)):
+                        best_key, best_score, best_pv = key, score, pv
+                if node_limit is not None and nodes >= node_limit:
+                    is_complete = False
+                if not is_complete:
+                    break
+                result = SearchResult(moves_by_key[best_key], best_score, iteration_depth,
+                                      pv_to_strings(board, best_pv), nodes, time.perf_counter() - start_time)
+                if info is not None:
+                    info(result)
+                if abs(best_score) >= MATE_THRESHOLD:
+                    break
+                # Search the best moves first next time
+                ordered_keys.sort(key=lambda move: -scores[move])
+        result.nodes = nodes
+        result.elapsed = time.perf_counter() - start_time
+        result.nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Search a position for the best move across several processes')
+    parser.add_argument('--fen', help='position to search, instead of the start position')
+    parser.add_argument('--depth', type=int, default=4, help='maximum depth to search in plies')
+    parser.add_argument('--time', type=float, help='time budget in seconds')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--scaling', action='store_true',
+                        help='repeat the search with 1, 2, 4, ... workers up to --workers and report the speedup')
+    parser.add_argument('--bitboards', action='store_true', help='generate moves with the bitboard engine')
+    args = parser.parse_args(args)
+
+    if args.fen is None:
+        board = ChessBoard(use_bitboards=args.bitboards)
+    else:
+        board = ChessBoard.from_fen(args.fen, args.bitboards)
+
+    worker_counts = [args.workers]
+    if args.scaling:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= args.workers:
+            worker_counts.append(worker_counts[-1] * 2)
+        if worker_counts[-1] != args.workers:
+            worker_counts.append(args.workers)
+
+    single_worker_time = None
+    for workers in worker_counts:
+        with ParallelEngine(workers) as engine:
+            result = engine.search(board, args.depth, args.time)
+        if single_worker_time is None:
+            single_worker_time = result.elapsed
+        print('workers {} depth {} score {} nodes {} nps {} time {:.3f}s speedup {:.2f} bestmove {} pv {}'.format(
+            workers, result.depth, score_to_string(result.score), result.nodes, result.nps, result.elapsed,
+            single_worker_time / max(result.elapsed, 1e-9),
+            move_to_string(*result.best_move) if result.best_move is not None else '(none)', ' '.join(result.pv)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import argparse
+import sys
+import time
+
+import src.constants
+from src.board import ChessBoard
+from src.notation import move_to_string, square_to_string
+from src.transposition import TranspositionTable
+
+# Standard perft reference positions and their node counts at depth 1, 2, 3, ... The start position has no FEN since it
+# is built by ChessBoard.clear_board
+PERFT_SUITE = [
+    ('Start position', None, [20, 400, 8902, 197281, 4865609]),
+    ('Kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862, 4085603]),
+    ('Position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    ('Position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 264, 9467, 422333]),
+    ('Position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+    ('Position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594])
+]
+
+
+# This function counts the leaf nodes of the move tree to the given depth. If a transposition table is given, the count
+# below every position is stored in it, so positions reached by more than one move order are only counted once
+def perft(board, depth, table=None):
+    if depth == 0:
+        return 1
+    if table is not None:
+        entry = table.probe(board.zobrist_key)
+        if entry is not None and entry[1] == depth:
+            return entry[2]
+    all_moves = board.get_all_legal_moves()
+    # The number of leaves one ply from the end is just the number of moves, so there is no need to make them
+    if depth == 1:
+        return len(all_moves)
+    nodes = 0
+    for piece, move, promotion_type in all_moves:
+        board.make_move(piece, move, promotion_type)
+        nodes += perft(board, depth - 1, table)
+        board.unmake_move()
+    if table is not None:
+        table.store(board.zobrist_key, depth, nodes)
+    return nodes
+
+
+# This function returns a list of (move name, node count) pairs, breaking the perft count down by each root move
+def divide(board, depth, table=None):
+    results = []
+    for piece, move, promotion_type in board.get_all_legal_moves():
+        name = move_to_string(piece, move, promotion_type)
+        board.make_move(piece, move, promotion_type)
+        results.append((name, perft(board, depth - 1, table)))
+        board.unmake_move()
+    return results
+
+
+# This function runs perft on every position in the reference suite up to the given depth. It prints the node count,
+# speed and result of each position and returns true if every count matched
+def run_suite(max_depth, use_bitboards=False, hash_size=0):
+    all_passed = True
+    total_nodes, total_time = 0, 0
+    for name, fen, expected_counts in PERFT_SUITE:
+        for depth in range(1, min(max_depth, len(expected_counts)) + 1):
+            board = ChessBoard(use_bitboards=use_bitboards) if fen is None else ChessBoard.from_fen(fen, use_bitboards)
+            table = TranspositionTable(hash_size) if hash_size > 0 else None
+            start_time = time.perf_counter()
+            nodes = perft(board, depth, table)
+            elapsed = time.perf_counter() - start_time
+            total_nodes += nodes
+            total_time += elapsed
+            passed = nodes == expected_counts[depth - 1]
+            all_passed = all_passed and passed
+            print('{:<16} depth {}  nodes {:>10}  expected {:>10}  {:>10.0f} nps  {}'.format(
+                name, depth, nodes, expected_counts[depth - 1], nodes / max(elapsed, 1e-9),
+                'ok' if passed else 'FAILED'))
+    print('Total: {} nodes in {:.3f}s ({:.0f} nps)'.format(
+        total_nodes, total_time, total_nodes / max(total_time, 1e-9)))
+    return all_passed
+
+
+# This function returns the legal moves of every piece on the board, of both colors, by the name of their square, and
+# whether each king is in check. It is what compare_backends checks the two backends agree on
+def describe_position(board):
+    moves = {}
+    for piece in board.pieces:
+        moves[square_to_string(piece.rank, piece.file)] = sorted(piece.get_legal_moves(board))
+    return moves, board.is_in_check(src.constants.WHITE), board.is_in_check(src.constants.BLACK)
+
+
+# This function walks the move tree to the given depth on two boards of the same position, one generating moves with
+# the piece objects and the other with the bitboard engine. Every position reached is described by both boards, and the
+# FEN of each position they disagree on is added to mismatches. It returns the number of positions compared
+def compare_backends(board, bitboard_board, depth, mismatches):
+    all_moves = sorted(board.get_all_legal_moves(), key=lambda move: move_to_string(*move))
+    bitboard_moves = sorted(bitboard_board.get_all_legal_moves(), key=lambda move: move_to_string(*move))
+    if describe_position(board) != describe_position(bitboard_board) or \
+            [move_to_string(*move) for move in all_moves] != [move_to_string(*move) for move in bitboard_moves]:
+        mismatches.append(board.to_fen())
+        return 1
+    if depth == 0:
+        return 1
+    positions = 1
+    for (piece, move, promotion_type), (bitboard_piece, _, _) in zip(all_moves, bitboard_moves):
+        board.make_move(piece, move, promotion_type)
+        bitboard_board.make_move(bitboard_piece, move, promotion_type)
+        positions += compare_backends(board, bitboard_board, depth - 1, mismatches)
+        bitboard_board.unmake_move()
+        board.unmake_move()
+    return positions
+
+
+# This function compares the legal moves found by the piece objects and by the bitboard engine in every position of
+# the reference suite up to the given depth. It prints the positions compared and the result for each reference
+# position, and returns true if the backends agreed everywhere
+def run_comparison(max_depth):
+    all_passed = True
+    for name, fen, expected_counts in PERFT_SUITE:
+        fen = fen or src.constants.STARTING_FEN
+        mismatches = []
+        start_time = time.perf_counter()
+        positions = compare_backends(ChessBoard.from_fen(fen), ChessBoard.from_fen(fen, True), max_depth, mismatches)
+        elapsed = time.perf_counter() - start_time
+        all_passed = all_passed and not mismatches
+        print('{:<16} depth {}  positions {:>8}  {:>7.3f}s  {}'.format(
+            name, max_depth, positions, elapsed, 'ok' if not mismatches else '{} FAILED'.format(len(mismatches))))
+        for mismatch in mismatches[:10]:
+            print('    backends disagree on {}'.format(mismatch))
+    return all_passed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Count the leaf nodes of the move tree to check move generation')
+    parser.add_argument('depth', type=int, nargs='?', default=3, help='number of plies to search')
+    parser.add_argument('--fen', help='position to search from, instead of the start position')
+    parser.add_argument('--divide', action='store_true', help='break the node count down by root move')
+    parser.add_argument('--suite', action='store_true', help='check every reference position up to the depth')
+    parser.add_argument('--compare', action='store_true',
+                        help='check that both move generation backends agree in every position of the reference suite')
+    parser.add_argument('--bitboards', action='store_true', help='generate moves with the bitboard engine')
+    parser.add_argument('--hash', type=int, default=0, help='transposition table entries, 0 to count every node')
+    args = parser.parse_args(args)
+
+    if args.suite:
+        return 0 if run_suite(args.depth, args.bitboards, args.hash) else 1
+    if args.compare:
+        return 0 if run_comparison(args.depth) else 1
+
+    if args.fen is None:
+        board = ChessBoard(use_bitboards=args.bitboards)
+    else:
+        board = ChessBoard.from_fen(args.fen, args.bitboards)
+    table = TranspositionTable(args.hash) if args.hash > 0 else None
+    start_time = time.perf_counter()
+    if args.divide:
+        results = divide(board, args.depth, table)
+        for name, nodes in results:
+            print('{}: {}'.format(name, nodes))
+        nodes = sum(count for name, count in results)
+        print('Moves: {}'.format(len(results)))
+    else:
+        nodes = perft(board, args.depth, table)
+    elapsed = time.perf_counter() - start_time
+    print('Nodes: {}'.format(nodes))
+    print('Time: {:.3f}s ({:.0f} nps)'.format(elapsed, nodes / max(elapsed, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import argparse
+import collections
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+import src.constants
+from src.board import ChessBoard
+from src.piece import Knight, Bishop, Rook, Queen
+
+# Tag pairs such as [Event "Casual game"]. The value runs to the last quote on the line, so values with unescaped
+# quotes, which some tools write, are still read
+TAG_PATTERN = re.compile(r'\[\s*([A-Za-z0-9_]+)\s+"(.*)"\s*\]\s*$')
+# The tokens of the movetext: comments, variations, annotation glyphs, move numbers, results and moves. Anything not
+# matched by one of the first alternatives is taken to be a move
+TOKEN_PATTERN = re.compile(r'\{|;|\(|\)|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{};()$]+')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+# Standard algebraic notation: piece, disambiguation file and rank, capture, destination and promotion
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?(x)?([a-h])([1-8])(?:=?([NBRQ]))?$')
+
+PIECE_LETTERS = {
+    'N': src.constants.KNIGHT, 'B': src.constants.BISHOP, 'R': src.constants.ROOK, 'Q': src.constants.QUEEN,
+    'K': src.constants.KING
+}
+PROMOTION_PIECES = {'N': Knight, 'B': Bishop, 'R': Rook, 'Q': Queen}
+
+# How many games each worker is sent at a time, and how many batches per worker may be waiting at once. Only this many
+# games are ever held in memory, however large the archive is
+BATCH_SIZE = 64
+BATCHES_PER_WORKER = 4
+
+
+# Raised for a move that cannot be played. The message says why, and the game, line and move number say where
+class PGNError(ValueError):
+    pass
+
+
+# One game read from a PGN archive. moves holds (SAN, line number) pairs for the main line only, comments and variations
+# are skipped. index counts the games in the archive from 1, and line_number is the line the game starts on.
+class PGNGame:
+    def __init__(self, index, line_number):
+        self.index = index
+        self.line_number = line_number
+        self.headers = {}
+        self.moves = []
+        self.result = None
+
+
+# A generator that yields the games of a PGN archive one at a time, reading the archive a line at a time. source is a
+# file name or a file-like object of text
+def read_games(source):
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, encoding='utf-8-sig', errors='replace') as pgn_file:
+            yield from read_games(pgn_file)
+        return
+    game = None
+    index = 0
+    in_comment = False
+    variation_depth = 0
+    for line_number, line in enumerate(source, 1):
+        if in_comment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            in_comment = False
+        stripped = line.strip()
+        # Lines starting with % are escaped and ignored
+        if not stripped or stripped.startswith('%'):
+            continue
+        if stripped.startswith('[') and variation_depth == 0:
+            tag = TAG_PATTERN.match(stripped)
+            if tag is not None:
+                # A tag after the moves of a game starts the next game, even if the last one had no result
+                if game is not None and game.moves:
+                    yield game
+                    game = None
+                if game is None:
+                    index += 1
+                    game = PGNGame(index, line_number)
+                game.headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace('\\\\', '\\')
+                continue
+        position = 0
+        while True:
+            token = TOKEN_PATTERN.search(line, position)
+            if token is None:
+                break
+            position = token.end()
+            text = token.group()
+            if text == '{':
+                end = line.find('}', position)
+                if end < 0:
+                    in_comment = True
+                    break
+                position = end + 1
+            elif text == ';':
+                break
+            elif text == '(':
+                variation_depth += 1
+            elif text == ')':
+                variation_depth = max(variation_depth - 1, 0)
+            elif variation_depth > 0 or text[0] == '$' or text[0].isdigit() and text[-1] == '.':
+                continue
+            else:
+                if game is None:
+                    index += 1
+                    game = PGNGame(index, line_number)
+                if text in RESULTS:
+                    game.result = text
+                    yield game
+                    game = None
+                else:
+                    game.moves.append((text, line_number))
+    if game is not None:
+        yield game
+
+
+# This function finds the legal move written in standard algebraic notation in the current position. It returns it as
+# a (piece, move, promotion type) tuple, or raises PGNError if the move is malformed, illegal or ambiguous. Only the
+# pieces that could have made the move have their legal moves generated
+def parse_san(board, san):
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        back_rank = 0 if board.player_turn == src.constants.WHITE else 7
+        move = (back_rank, 6 if len(text) == 3 else 2)
+        king = board.look_at(back_rank, 4)
+        if king is None or king.id != src.constants.KING or king.color != board.player_turn or \
+                move not in king.get_legal_moves(board):
+            raise PGNError('illegal castling')
+        return king, move, None
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise PGNError('not a move in standard algebraic notation')
+    letter, from_file, from_rank, _, to_file, to_rank, promotion = match.groups()
+    piece_id = PIECE_LETTERS[letter] if letter is not None else src.constants.PAWN
+    move = (int(to_rank) - 1, ord(to_file) - ord('a'))
+    candidates = []
+    for piece in board.pieces:
+        if piece.color != board.player_turn or piece.id != piece_id:
+            continue
+        if from_file is not None and piece.file != ord(from_file) - ord('a'):
+            continue
+        # A pawn move without a file to start from is a push straight up the file
+        if from_file is None and piece_id == src.constants.PAWN and piece.file != move[1]:
+            continue
+        if from_rank is not None and piece.rank != int(from_rank) - 1:
+            continue
+        if move in piece.get_legal_moves(board):
+            candidates.append(piece)
+    if not candidates:
+        raise PGNError('illegal move')
+    if len(candidates) > 1:
+        raise PGNError('ambiguous move')
+    is_promotion = piece_id == src.constants.PAWN and (move[0] == 0 or move[0] == 7)
+    if is_promotion and promotion is None:
+        raise PGNError('missing promotion piece')
+    if promotion is not None and not is_promotion:
+        raise PGNError('only a pawn reaching the last rank can promote')
+    return candidates[0], move, PROMOTION_PIECES[promotion] if promotion is not None else None
+
+
+# This function tells whether a game has ended by checkmate or stalemate. check_gameover also ends a game on threefold
+# repetition or too little material to mate, but in an archived game those are draws that could have been claimed, and
+# play may go on after them
+def is_game_finished(board):
+    return board.is_gameover and not board.has_any_legal_move()
+
+
+# This function replays a game through ChessBoard.move and returns (game index, plies played, error). The error is None
+# for a valid game, or a message saying what went wrong and where
+def validate_game(game):
+    try:
+        if 'FEN' in game.headers:
+            board = ChessBoard.from_fen(game.headers['FEN'])
+        else:
+            board = ChessBoard()
+    except ValueError as error:
+        return game.index, 0, 'game {} line {}: bad FEN header: {}'.format(game.index, game.line_number, error)
+    for ply, (san, line_number) in enumerate(game.moves):
+        move_number = '{}{}'.format(board.fullmove_number, '.' if board.player_turn == src.constants.WHITE else '...')
+        try:
+            if is_game_finished(board):
+                raise PGNError('the game is already over')
+            piece, move, promotion_type = parse_san(board, san)
+            if not board.move_encoded(board.encode_move(piece, move, promotion_type)):
+                raise PGNError('illegal move')
+        except PGNError as error:
+            return game.index, ply, 'game {} line {}: move {} {}: {}'.format(game.index, line_number, move_number, san,
+                                                                             error)
+    return game.index, len(game.moves), None
+
+
+# This function validates a list of games in a worker process
+def validate_batch(games):
+    return [validate_game(game) for game in games]
+
+
+# This function groups the games into lists of at most size games
+def batch_games(games, size):
+    batch = []
+    for game in games:
+        batch.append(game)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# A generator that validates every game of an archive and yields (game index, plies played, error) in archive order.
+# With more than one worker, batches of games are replayed in parallel across a process pool, while only a few batches
+# are held in memory at a time
+def validate_games(source, workers=1):
+    games = read_games(source)
+    if workers <= 1:
+        for game in games:
+            yield validate_game(game)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        pending = collections.deque()
+        for batch in batch_games(games, BATCH_SIZE):
+            pending.append(pool.apply_async(validate_batch, (batch,)))
+            if len(pending) >= workers * BATCHES_PER_WORKER:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Replay and validate every game in PGN archives')
+    parser.add_argument('files', nargs='+', help='PGN files to validate')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per core (default 1)')
+    parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    args = parser.parse_args(args)
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    start_time = time.perf_counter()
+    game_count, invalid_count, ply_count = 0, 0, 0
+    for file_name in args.files:
+        for index, plies, error in validate_games(file_name, workers):
+            game_count += 1
+            ply_count += plies
+            if error is not None:
+                invalid_count += 1
+                if not args.quiet:
+                    print('{}: {}'.format(file_name, error))
+    elapsed = time.perf_counter() - start_time
+    print('{} games, {} invalid, {} moves in {:.3f}s ({:.1f} games/s, {:.0f} moves/s) with {} worker{}'.format(
+        game_count, invalid_count, ply_count, elapsed, game_count / elapsed if elapsed > 0 else 0,
+        ply_count / elapsed if elapsed > 0 else 0, workers, '' if workers == 1 else 's'))
+    return 1 if invalid_count > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
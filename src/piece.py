@@ -1,8 +1,13 @@
 import src.constants
+from src.attack_tables import SQUARE_COORDINATES, KNIGHT_TARGETS, KING_TARGETS, ORTHOGONAL_RAYS, DIAGONAL_RAYS, \
+    QUEEN_RAYS
 
-# Parent class for all pieces - basic functions to get possible moves, move the piece, and check if a square is in the
-# bounds of the board
+# Parent class for all pieces - basic functions to get legal moves and move the piece. Each piece type finds its
+# pseudo-legal moves from the precomputed tables in src.attack_tables
 class Piece:
+    # Pieces are created for every position that is set up, so they use slots instead of a per-instance dictionary
+    __slots__ = ('rank', 'file', 'id', 'color', 'capturable', 'can_castle')
+
     def __init__(self, rank, file, piece_id, color):
         self.rank, self.file = rank, file
         self.id = piece_id
@@ -10,63 +15,84 @@ class Piece:
         self.capturable = True
         self.can_castle = False
 
-    # This function represents the possible squares that a piece can go to, given no obstacles on infinite
-    def get_possible_moves(self, board):
-        return []
-
     # This function returns the set of all legal moves from the set of all possible moves
     def get_legal_moves(self, board):
-        moves = self.get_possible_moves(board)
-        # For every vector in the list of possible moves, remove every square out of bounds
-        for i, vector in enumerate(moves):
-            moves[i] = self.remove_out_of_bounds(vector)
-        # Remove all the blocked squares from the list
-        self.remove_illegal_moves(moves, board)
-        # Take the list of move vectors and convert it into a single concatenated list of moves
-        moves = sum(moves, [])
-        # Finally, see if our color is in check and if any of the moves gets us out of check
-        self.remove_check_moves(moves, board)
-        # Append every move vector into a single list of possible moves
+        # The moves may already have been generated for this position, by the renderer or while checking for game over
+        moves = board.get_cached_legal_moves(self)
+        if moves is not None:
+            return moves
+        # Boards using the bitboard engine find the legal moves of every piece in one pass
+        moves = None
+        if board.use_bitboards:
+            moves = board.get_bitboard_legal_moves(self)
+        elif self.color == board.player_turn:
+            # The moves of every piece of the player to move are found together from the checks and pins
+            moves = board.get_generated_legal_moves(self)
+        if moves is None:
+            moves = self.get_pseudo_legal_moves(board)
+            # Finally, see if our color is in check and if any of the moves gets us out of check
+            self.remove_check_moves(moves, board)
+        board.cache_legal_moves(self, moves)
+        return moves
+
+    # This function yields the legal moves of the piece one at a time. Each move is only tried on the board when it is
+    # asked for, so a caller that only needs to know whether a legal move exists can stop at the first one. The board
+    # must be back in the same position whenever the next move is asked for.
+    def iter_legal_moves(self, board):
+        moves = board.get_cached_legal_moves(self)
+        if moves is not None or board.use_bitboards:
+            yield from moves if moves is not None else self.get_legal_moves(board)
+            return
+        key = board.zobrist_key
+        legal_moves = []
+        for move in self.get_pseudo_legal_moves(board):
+            board.make_move(self, move)
+            is_legal = not board.is_in_check(self.color)
+            board.unmake_move()
+            if is_legal:
+                legal_moves.append(move)
+                yield move
+        # The moves were all tried, so they can be cached the same as if get_legal_moves had been called
+        if board.zobrist_key == key:
+            board.cache_legal_moves(self, legal_moves)
+
+    # This function walks the precomputed rays leaving the piece's square, stopping each ray at the first piece it
+    # meets. A piece of the other color is kept as a capture
+    def get_sliding_moves(self, board, rays):
+        moves = []
+        squares = board.squares
+        for ray in rays[self.rank * 8 + self.file]:
+            for square in ray:
+                occupant = squares[square]
+                if occupant is None:
+                    moves.append(SQUARE_COORDINATES[square])
+                else:
+                    if occupant.color != self.color:
+                        moves.append(SQUARE_COORDINATES[square])
+                    break
         return moves
 
-    # This function evaluates a list of moves and returns a modified list with only the moves that are within the bounds
-    # of the board
-    def remove_out_of_bounds(self, square_list):
-        for (rank, file) in square_list.copy():
-            if rank < 0 or rank > 7 or file < 0 or file > 7:
-                square_list.remove((rank, file))
-        return square_list
+    # This function returns the squares in a precomputed target table that the piece can step to, which are those that
+    # are empty or hold a piece of the other color
+    def get_step_moves(self, board, targets):
+        squares = board.squares
+        moves = []
+        for square in targets[self.rank * 8 + self.file]:
+            occupant = squares[square]
+            if occupant is None or occupant.color != self.color:
+                moves.append(SQUARE_COORDINATES[square])
+        return moves
 
     # This function removes any moves from a list of moves that would put the player's king in check
     def remove_check_moves(self, moves, board):
-        if not board.is_branch:
-            # Simulate the move and see if it puts the king in check
-            for move in moves.copy():
-                if board.branch(self, move).is_in_check(self.color):
-                    moves.remove(move)
-
-    # This function evaluates a list of move vectors, or lists of moves, and evaluates if there is a obstacle in the way
-    # of that piece continuing its path
-    def remove_illegal_moves(self, vector_list, board):
-        for i, vector in enumerate(vector_list):
-            vector_list[i] = self.remove_out_of_bounds(vector)
-            is_blocked = False
-            for (rank, file) in vector.copy():
-                square = board.look_at(rank, file)
-                # If the square was blocked by one of the previous squares in the vector, remove it from the vector
-                if is_blocked:
-                    vector.remove((rank, file))
-                # Otherwise, if the square was filled with a piece
-                elif square is not None:
-                    # If the square is filled with a piece of the same color as the selected piece's color, every piece
-                    # later in the vector will be blocked
-                    if square.color == self.color:
-                        vector.remove((rank, file))
-                        is_blocked = True
-                    # Otherwise, if the square has a piece of the opposite color, all remaining squares are blocked, but
-                    # the move is kept as a capturing move
-                    else:
-                        is_blocked = True
+        # Make the move on the board in place, see if it puts the king in check, then take it back
+        legal_moves = []
+        for move in moves:
+            board.make_move(self, move)
+            if not board.is_in_check(self.color):
+                legal_moves.append(move)
+            board.unmake_move()
+        moves[:] = legal_moves
 
     # Move the piece to a new square
     def move(self, rank, file):
@@ -74,11 +100,13 @@ class Piece:
         self.file = file
 
 class Pawn(Piece):
+    __slots__ = ()
+
     def __init__(self, rank, file, color):
-        self.piece_id = src.constants.PAWN
-        super(Pawn, self).__init__(rank, file, self.piece_id, color)
+        super(Pawn, self).__init__(rank, file, src.constants.PAWN, color)
 
-    def get_possible_moves(self, board):
+    # This function returns every move the pawn could make if we ignore whether it leaves our own king in check
+    def get_pseudo_legal_moves(self, board):
         destination_squares = []
         # We need to determine which color the pawn is to determine which way it is moving
         if self.color == src.constants.WHITE:
@@ -112,199 +140,105 @@ class Pawn(Piece):
             square = board.look_at(self.rank - 1, self.file - 1)
             if square is not None and square.color == src.constants.WHITE:
                 destination_squares.append((self.rank - 1, self.file - 1))
-        # Before we return the list of pawn moves, check which moves are out of bounds
         destination_squares += self.get_en_passant_moves(board)
-        destination_squares = self.remove_out_of_bounds(destination_squares)
-        return destination_squares
-
-    def get_legal_moves(self, board):
-        moves = self.get_possible_moves(board)
-        self.remove_out_of_bounds(moves)
-        # Remove any moves that would put us in check
-        self.remove_check_moves(moves, board)
-        return moves
+        # A pawn left on the last rank while it waits to be promoted has nowhere to go. Captures off the board were
+        # already ruled out, since look_at finds no piece there
+        return [(rank, file) for (rank, file) in destination_squares if 0 <= rank < 8]
 
-    # TODO: implement en passant moves
     def get_en_passant_moves(self, board):
         en_passant_moves = []
-        if len(board.move_list) >= 1:
-            last_piece, start, end = board.move_list[-1]
-            # The last piece that moved needs to be a pawn - en passant is only available for one move - and needs to be
-            # the opposite color
-            if last_piece.id == src.constants.PAWN and last_piece.color == self.color:
-                start_rank, start_file = start
-                end_rank, end_file = end
-                # The pawn needs to have moved two ranks and the pawn we are moving needs to be on the same rank
-                if abs(end_rank - start_rank) >= 2 and self.rank == end_rank:
-                    # The direction of the capture depends on the color of the pawn
-                    if self.color == src.constants.WHITE:
-                        en_passant_moves.append((self.rank + 1, end_file))
-                    elif self.color == src.constants.BLACK:
-                        en_passant_moves.append((self.rank - 1, end_file))
-                    print(en_passant_moves)
-                    return en_passant_moves
+        # The board remembers the square skipped by a pawn that just moved two ranks - en passant is only available for
+        # one move
+        if board.en_passant_square is not None:
+            target_rank, target_file = board.en_passant_square
+            # The direction of the capture depends on the color of the pawn, and the pawn we are moving needs to be
+            # beside the pawn that moved
+            direction = 1 if self.color == src.constants.WHITE else -1
+            if self.color == board.player_turn and self.rank + direction == target_rank and \
+                    abs(self.file - target_file) == 1:
+                en_passant_moves.append((target_rank, target_file))
         return en_passant_moves
 
 class Knight(Piece):
-    def __init__(self, rank, file, color):
-        self.piece_id = src.constants.KNIGHT
-        super(Knight, self).__init__(rank, file, self.piece_id, color)
+    __slots__ = ()
 
-    # This function returns the valid knight moves from a given square on the board
-    def get_possible_moves(self, board):
-        # Find all 8 knight moves of +/- 1/2 ranks and +/- 2/1 files
-        destination_squares = [
-            (self.rank + 2, self.file + 1), (self.rank + 2, self.file - 1),
-            (self.rank - 2, self.file + 1), (self.rank - 2, self.file - 1),
-            (self.rank - 1, self.file + 2), (self.rank - 1, self.file - 2),
-            (self.rank + 1, self.file + 2), (self.rank + 1, self.file - 2)
-        ]
-        return destination_squares
+    def __init__(self, rank, file, color):
+        super(Knight, self).__init__(rank, file, src.constants.KNIGHT, color)
 
-    def get_legal_moves(self, board):
-        moves = self.get_possible_moves(board)
-        self.remove_out_of_bounds(moves)
-        for move in moves.copy():
-            rank, file = move
-            square = board.look_at(rank, file)
-            if square is not None and square.color == self.color:
-                moves.remove(move)
-        # Remove any moves that would put us in check
-        self.remove_check_moves(moves, board)
-        return moves
+    def get_pseudo_legal_moves(self, board):
+        return self.get_step_moves(board, KNIGHT_TARGETS)
 
 class Bishop(Piece):
+    __slots__ = ()
+
     def __init__(self, rank, file, color):
-        self.piece_id = src.constants.BISHOP
-        super(Bishop, self).__init__(rank, file, self.piece_id, color)
+        super(Bishop, self).__init__(rank, file, src.constants.BISHOP, color)
 
-    def get_possible_moves(self, board):
-        # We find all squares diagonally aligned with the bishop within the width of a board (8 squares)
-        destination_squares = [
-            [(self.rank + increment, self.file + increment) for increment in range(1,8)],
-            [(self.rank + increment, self.file - increment) for increment in range(1,8)],
-            [(self.rank - increment, self.file + increment) for increment in range(1,8)],
-            [(self.rank - increment, self.file - increment) for increment in range(1,8)]
-        ]
-        return destination_squares
+    def get_pseudo_legal_moves(self, board):
+        return self.get_sliding_moves(board, DIAGONAL_RAYS)
 
 class Rook(Piece):
+    __slots__ = ()
+
     def __init__(self, rank, file, color):
-        self.piece_id = src.constants.ROOK
-        super(Rook, self).__init__(rank, file, self.piece_id, color)
+        super(Rook, self).__init__(rank, file, src.constants.ROOK, color)
         self.can_castle = True
 
-    def get_possible_moves(self, board):
-        # We find all squares horizontally and vertically aligned with the rook within the width of the board
-        # (8 squares)
-        destination_squares = [
-            [(self.rank + increment, self.file) for increment in range(1,8)],
-            [(self.rank - increment, self.file) for increment in range(1,8)],
-            [(self.rank, self.file + increment) for increment in range(1,8)],
-            [(self.rank, self.file - increment) for increment in range(1,8)]
-        ]
-        return destination_squares
+    def get_pseudo_legal_moves(self, board):
+        return self.get_sliding_moves(board, ORTHOGONAL_RAYS)
 
 class Queen(Piece):
+    __slots__ = ()
+
     def __init__(self, rank, file, color):
-        self.piece_id = src.constants.QUEEN
-        super(Queen, self).__init__(rank, file, self.piece_id, color)
+        super(Queen, self).__init__(rank, file, src.constants.QUEEN, color)
 
-    def get_possible_moves(self, board):
-        # We find all squares vertically, horizontally, and diagonally aligned with the Queen within the width of the
-        # board (8 squares)
-        destination_squares = [
-            [(self.rank + increment, self.file + increment) for increment in range(1,8)],
-            [(self.rank + increment, self.file - increment) for increment in range(1,8)],
-            [(self.rank - increment, self.file + increment) for increment in range(1,8)],
-            [(self.rank - increment, self.file - increment) for increment in range(1,8)],
-            [(self.rank + increment, self.file) for increment in range(1,8)],
-            [(self.rank - increment, self.file) for increment in range(1,8)],
-            [(self.rank, self.file + increment) for increment in range(1,8)],
-            [(self.rank, self.file - increment) for increment in range(1,8)]
-        ]
-        return destination_squares
+    def get_pseudo_legal_moves(self, board):
+        return self.get_sliding_moves(board, QUEEN_RAYS)
 
 class King(Piece):
+    __slots__ = ()
+
     def __init__(self, rank, file, color):
-        self.piece_id = src.constants.KING
-        super(King, self).__init__(rank, file, self.piece_id, color)
+        super(King, self).__init__(rank, file, src.constants.KING, color)
         self.capturable = False
         self.can_castle = True
 
-    def get_possible_moves(self, board):
-        # This list contains all squares of distance 1 away from the king
-        destination_squares = [
-             (self.rank + 1, self.file), (self.rank - 1, self.file),
-             (self.rank, self.file + 1), (self.rank, self.file - 1),
-             (self.rank - 1, self.file + 1), (self.rank - 1, self.file - 1),
-             (self.rank + 1, self.file + 1), (self.rank + 1, self.file - 1)
-        ]
-        return destination_squares
-
-    def get_legal_moves(self, board):
-        moves = self.get_possible_moves(board)
-        # Remove all moves that are out of bounds
-        self.remove_out_of_bounds(moves)
-        # Remove all moves with the pieces of the same color in the destination square
-        for (rank, file) in moves.copy():
-            dest_square = board.look_at(rank, file)
-            if dest_square is not None:
-                if dest_square.color == self.color:
-                    moves.remove((rank, file))
+    def get_pseudo_legal_moves(self, board):
+        # Leave out the squares with pieces of the same color on them
+        moves = self.get_step_moves(board, KING_TARGETS)
         if self.can_castle:
             moves += self.get_castle_moves(board)
-        # Remove any moves that would put us in check
-        self.remove_check_moves(moves, board)
         return moves
 
     def get_castle_moves(self, board):
-        # Figure out if we can castle - we need to be on the back rank for our color
+        # Figure out if we can castle - we need to be on our starting square and cannot castle out of check
         castle_moves = []
         if not self.can_castle:
             return castle_moves
-        if self.color == src.constants.WHITE and self.rank == 0 and not board.is_in_check():
-            # See which rooks are available for castling
-            l_rook = board.look_at(0, 0)
-            r_rook = board.look_at(0, 7)
-            if l_rook is not None and l_rook.can_castle:
-                # Check if any pieces are in the way of the left rook
-                squares_to_check = [(0, 1), (0, 2), (0, 3)]
-                is_blocked = False
-                for (rank, file) in squares_to_check:
-                    if board.look_at(rank, file) is not None:
-                        is_blocked = True
-                if not is_blocked:
-                    castle_moves.append((0, 2))
-            if r_rook is not None and r_rook.can_castle:
-                # Check if any pieces are in the way of the right rook
-                squares_to_check = [(0, 5), (0, 6)]
-                is_blocked = False
-                for (rank, file) in squares_to_check:
-                    if board.look_at(rank, file) is not None:
-                        is_blocked = True
-                if not is_blocked:
-                    castle_moves.append((0, 6))
-        elif self.color == src.constants.BLACK and self.rank == 7:
-            # See which rooks are available for castling
-            l_rook = board.look_at(7, 0)
-            r_rook = board.look_at(7, 7)
-            if l_rook is not None and l_rook.can_castle:
-                # Check if any pieces are in the way of the left rook
-                squares_to_check = [(7, 1), (7, 2), (7, 3)]
-                is_blocked = False
-                for (rank, file) in squares_to_check:
-                    if board.look_at(rank, file) is not None:
-                        is_blocked = True
-                if not is_blocked:
-                    castle_moves.append((7, 2))
-            if r_rook is not None and r_rook.can_castle:
-                # Check if any pieces are in the way of the right rook
-                squares_to_check = [(7, 5), (7, 6)]
-                is_blocked = False
-                for (rank, file) in squares_to_check:
-                    if board.look_at(rank, file) is not None:
-                        is_blocked = True
-                if not is_blocked:
-                    castle_moves.append((7, 6))
-        return castle_moves
\ No newline at end of file
+        back_rank = 0 if self.color == src.constants.WHITE else 7
+        if self.rank != back_rank or self.file != 4 or board.is_in_check(self.color):
+            return castle_moves
+        enemy_color = not self.color
+        # See which rooks are available for castling
+        l_rook = board.look_at(back_rank, 0)
+        r_rook = board.look_at(back_rank, 7)
+        if l_rook is not None and l_rook.can_castle and l_rook.color == self.color:
+            # Check if any pieces are in the way of the left rook, and that the king does not pass through check
+            squares_to_check = [(back_rank, 1), (back_rank, 2), (back_rank, 3)]
+            is_blocked = False
+            for (rank, file) in squares_to_check:
+                if board.look_at(rank, file) is not None:
+                    is_blocked = True
+            if not is_blocked and not board.is_square_attacked(back_rank, 3, enemy_color):
+                castle_moves.append((back_rank, 2))
+        if r_rook is not None and r_rook.can_castle and r_rook.color == self.color:
+            # Check if any pieces are in the way of the right rook, and that the king does not pass through check
+            squares_to_check = [(back_rank, 5), (back_rank, 6)]
+            is_blocked = False
+            for (rank, file) in squares_to_check:
+                if board.look_at(rank, file) is not None:
+                    is_blocked = True
+            if not is_blocked and not board.is_square_attacked(back_rank, 5, enemy_color):
+                castle_moves.append((back_rank, 6))
+        return castle_moves
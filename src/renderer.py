@@ -1,21 +1,59 @@
-from src.board_renderer import ChessBoardRenderer
+from src.board_renderer import ChessBoardRenderer, TILES_LAYER
 from src.piece import Piece
 import pyglet
 
 class Renderer(pyglet.window.Window):
     def __init__(self, x=0, y=0, width=800, height=800):
-        super(Renderer, self).__init__(width, height)
+        # Only the dirty layers are drawn each frame, so the window has to keep what was drawn before. A double
+        # buffered window does not, so if a single buffer is not available every frame redraws the whole board
+        try:
+            super(Renderer, self).__init__(width, height, config=pyglet.gl.Config(double_buffer=False))
+            self.keeps_contents = True
+        except pyglet.window.NoSuchConfigException:
+            super(Renderer, self).__init__(width, height)
+            self.keeps_contents = False
 
         # Create the chess board object that will store the game information
         self.chess_board = ChessBoardRenderer(x, y, 800, 800)
+        # Count the frames drawn against the events that left nothing new to draw
+        self.rendered_frames = 0
+        self.skipped_frames = 0
 
         # Start the application
         pyglet.app.run()
 
     # Main rendering loop
     def on_draw(self):
-        self.clear()
+        if not self.keeps_contents:
+            self.chess_board.mark_all_dirty()
+        # The tiles cover the whole board, so the window only needs clearing when they are drawn again
+        if self.chess_board.is_layer_dirty(TILES_LAYER):
+            self.clear()
         self.chess_board.draw()
+        self.rendered_frames += 1
+        # Nothing else needs drawing until the chess board changes again
+        self.invalid = False
+
+    # This function asks the event loop to redraw the window after an event, but only if the chess board has changed
+    def schedule_redraw(self):
+        if self.chess_board.is_dirty():
+            self.invalid = True
+        else:
+            self.skipped_frames += 1
+
+    # This function returns how many frames were drawn and how many were skipped because nothing had changed
+    def get_frame_stats(self):
+        return {'rendered': self.rendered_frames, 'skipped': self.skipped_frames}
+
+    # The window contents are lost when the window is resized or uncovered, so the whole board has to be drawn again
+    def on_resize(self, width, height):
+        super(Renderer, self).on_resize(width, height)
+        self.chess_board.mark_all_dirty()
+        self.invalid = True
+
+    def on_expose(self):
+        self.chess_board.mark_all_dirty()
+        self.invalid = True
 
     def on_mouse_press(self, x, y, button, modifiers):
         if not self.chess_board.is_selected():
@@ -30,11 +68,13 @@ class Renderer(pyglet.window.Window):
                 self.chess_board.select_piece_at(x, y)
             elif dest_piece != self.chess_board.selected_piece:
                 self.chess_board.make_legal_move(self.chess_board.selected_piece, move)
+        self.schedule_redraw()
 
     def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
         # If we have picked up a piece, we need to draw that piece at the current cursor postion
         if self.chess_board.is_selected():
             self.chess_board.update_selected(x, y)
+        self.schedule_redraw()
 
     def on_mouse_release(self, x, y, button, modifiers):
         # Drop the piece back the original position
@@ -44,4 +84,5 @@ class Renderer(pyglet.window.Window):
             move_success = self.chess_board.make_legal_move(self.chess_board.selected_piece, move)
             if not move_success:
                 self.chess_board.reset_selected()
-                self.chess_board.update()
\ No newline at end of file
+                self.chess_board.update()
+        self.schedule_redraw()
\ No newline at end of file
@@ -0,0 +1,282 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+
+import src.constants
+import src.encoding
+from src.board import ChessBoard
+from src.engine import Engine
+from src.notation import move_to_string
+from src.opening_book import OpeningBook
+
+# Results in PGN notation, and the byte each one is stored as in the binary format
+RESULT_CODES = {'*': 0, '1-0': 1, '0-1': 2, '1/2-1/2': 3}
+RESULT_NAMES = {code: result for result, code in RESULT_CODES.items()}
+
+# Binary records are a header of the game index, signed seed, result byte and number of plies, followed by one 16-bit
+# encoded move per ply (see src.encoding) and the final position packed by ChessBoard.pack
+RECORD_HEADER = struct.Struct('<IqBH')
+
+
+# Plays a uniformly random legal move. Each game is seeded on its own, so a game plays out the same whichever worker
+# plays it
+class RandomPolicy:
+    def __init__(self):
+        self.random = random.Random()
+
+    def new_game(self, seed):
+        self.random.seed(seed)
+
+    def choose_move(self, board):
+        return self.random.choice(board.get_all_legal_moves())
+
+
+# Plays the best move found by the built-in engine. Searches should be limited by depth or nodes rather than time if the
+# games need to be reproducible
+class EnginePolicy:
+    def __init__(self, depth=2, time_limit=None, node_limit=None):
+        self.engine = Engine()
+        self.depth = depth
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+
+    # The transposition table is cleared between games, so one game cannot change how the next is played
+    def new_game(self, seed):
+        self.engine.table.clear()
+
+    def choose_move(self, board):
+        return self.engine.search(board, self.depth, self.time_limit, self.node_limit).best_move
+
+
+# Plays the moves returned by a function of (board, random generator), which must return a (piece, move, promotion
+# type) tuple like the ones from ChessBoard.get_all_legal_moves. The random generator is seeded for every game
+class CallbackPolicy:
+    def __init__(self, callback):
+        self.callback = callback
+        self.random = random.Random()
+
+    def new_game(self, seed):
+        self.random.seed(seed)
+
+    def choose_move(self, board):
+        return self.callback(board, self.random)
+
+
+# Plays a book move while the position is in the opening book, picked at random in proportion to the book weights, and
+# leaves the rest of the game to another policy. The book is opened separately in every worker process through a memory
+# map, so the workers share its pages instead of each reading it into memory
+class BookPolicy:
+    def __init__(self, book, policy):
+        self.book = book
+        self.policy = policy
+        self.random = random.Random()
+
+    def new_game(self, seed):
+        self.random.seed(seed)
+        self.policy.new_game(seed)
+
+    def choose_move(self, board):
+        book_move = self.book.choose_move(board, self.random)
+        if book_move is not None:
+            return book_move
+        return self.policy.choose_move(board)
+
+
+# This function builds a policy from its command line name: random, engine, engine:DEPTH or callback:MODULE:FUNCTION
+def make_policy(spec):
+    name, _, argument = spec.partition(':')
+    if name == 'random':
+        return RandomPolicy()
+    if name == 'engine':
+        return EnginePolicy(int(argument) if argument else 2)
+    if name == 'callback':
+        module_name, _, function_name = argument.partition(':')
+        if not function_name:
+            raise ValueError('Callback policies are written callback:MODULE:FUNCTION: {!r}'.format(spec))
+        return CallbackPolicy(getattr(importlib.import_module(module_name), function_name))
+    raise ValueError('Unknown policy {!r}'.format(spec))
+
+
+# One finished game. moves holds the 16-bit encoded moves of the game and move_names the same moves in coordinate
+# notation, which are worked out from the encoded moves if they are not given
+class GameRecord:
+    def __init__(self, index, seed, result, termination, moves, fen, packed_position, move_names=None):
+        self.index = index
+        self.seed = seed
+        self.result = result
+        self.termination = termination
+        self.moves = moves
+        self.fen = fen
+        self.packed_position = packed_position
+        self.move_names = move_names if move_names is not None else decode_moves(moves)
+
+    def to_json(self):
+        return json.dumps({
+            'game': self.index, 'seed': self.seed, 'result': self.result, 'termination': self.termination,
+            'plies': len(self.moves), 'moves': ' '.join(self.move_names), 'fen': self.fen
+        }, separators=(',', ':'))
+
+    def to_bytes(self):
+        return RECORD_HEADER.pack(self.index, self.seed, RESULT_CODES[self.result], len(self.moves)) + \
+            array('H', self.moves).tobytes() + self.packed_position
+
+
+# This function replays encoded moves from the start position and writes them in coordinate notation
+def decode_moves(moves):
+    board = ChessBoard()
+    names = []
+    for code in moves:
+        piece, move, promotion_type = board.decode_move(code)
+        names.append(move_to_string(piece, move, promotion_type))
+        board.make_move(piece, move, promotion_type)
+    return names
+
+
+# This function plays one game between two policies and returns its GameRecord. Games are stopped as drawn after
+# max_plies plies, and the fifty-move rule is applied as soon as it can be claimed
+def play_game(index, seed, white, black, max_plies):
+    white.new_game(seed)
+    black.new_game(seed + 1)
+    board = ChessBoard()
+    move_names = []
+    termination = None
+    while not board.is_gameover and len(move_names) < max_plies:
+        if board.halfmove_clock >= 100:
+            board.is_gameover = True
+            board.game_result = 'DRAW'
+            termination = 'fifty-move rule'
+            break
+        policy = white if board.player_turn == src.constants.WHITE else black
+        piece, move, promotion_type = policy.choose_move(board)
+        name = move_to_string(piece, move, promotion_type)
+        if not board.move_encoded(board.encode_move(piece, move, promotion_type)):
+            raise ValueError('Policy played an illegal move {} in {}'.format(name, board.to_fen()))
+        move_names.append(name)
+    if termination is None:
+        termination = get_termination(board) if board.is_gameover else 'max plies'
+    result = {'WHITE': '1-0', 'BLACK': '0-1', 'DRAW': '1/2-1/2'}.get(board.game_result, '*') \
+        if board.is_gameover else '*'
+    return GameRecord(index, seed, result, termination, list(board.move_list), board.to_fen(), board.pack(),
+                      move_names)
+
+
+# This function says how a finished game ended
+def get_termination(board):
+    if board.game_result != 'DRAW':
+        return 'checkmate'
+    if board.is_repetition(3):
+        return 'threefold repetition'
+    if not board.has_any_legal_move():
+        return 'stalemate'
+    return 'insufficient material'
+
+
+# Each worker process builds its policies once, so an engine keeps its allocated table from one game to the next
+worker_policies = None
+worker_max_plies = None
+
+
+def initialize_worker(white_spec, black_spec, max_plies, book_path=None):
+    global worker_policies, worker_max_plies
+    worker_policies = (make_policy(white_spec), make_policy(black_spec))
+    if book_path is not None:
+        book = OpeningBook(book_path)
+        worker_policies = tuple(BookPolicy(book, policy) for policy in worker_policies)
+    worker_max_plies = max_plies
+
+
+# This function plays one game in a worker process. Every game has its own seed, taken from the base seed and its index
+def play_worker_game(task):
+    index, base_seed = task
+    white, black = worker_policies
+    return play_game(index, base_seed + 2 * index, white, black, worker_max_plies)
+
+
+# A generator that plays the games across a pool of worker processes and yields their GameRecords in game order as they
+# finish. The games only depend on the seed, so the same seed always plays the same games with any number of workers
+def run_games(games, white_spec, black_spec, seed=0, workers=None, max_plies=400, book_path=None):
+    workers = workers if workers is not None else os.cpu_count()
+    tasks = ((index, seed) for index in range(games))
+    with multiprocessing.Pool(workers, initializer=initialize_worker,
+                              initargs=(white_spec, black_spec, max_plies, book_path)) as pool:
+        yield from pool.imap(play_worker_game, tasks, chunksize=max(1, min(16, games // (workers * 4))))
+
+
+# This function reads a binary record written by GameRecord.to_bytes
+def record_from_bytes(data):
+    index, seed, result_code, plies = RECORD_HEADER.unpack_from(data)
+    moves = array('H')
+    moves.frombytes(data[RECORD_HEADER.size:RECORD_HEADER.size + 2 * plies])
+    packed_position = bytes(data[RECORD_HEADER.size + 2 * plies:])
+    board = ChessBoard.from_packed(packed_position)
+    return GameRecord(index, seed, RESULT_NAMES[result_code], None, list(moves), board.to_fen(), packed_position)
+
+
+# A generator that yields the GameRecords of a file written with --format binary. The termination is not stored in the
+# binary format, so it is None
+def read_binary_games(path):
+    with open(path, 'rb') as games_file:
+        while True:
+            header = games_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            plies = RECORD_HEADER.unpack(header)[3]
+            data = header + games_file.read(2 * plies + src.encoding.POSITION_SIZE)
+            yield record_from_bytes(data)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Play games between move policies across worker processes')
+    parser.add_argument('--games', type=int, default=100, help='number of games to play')
+    parser.add_argument('--white', default='random',
+                        help='policy for white: random, engine[:DEPTH] or callback:MODULE:FUNCTION')
+    parser.add_argument('--black', default='random', help='policy for black, in the same form as --white')
+    parser.add_argument('--seed', type=int, default=0, help='base seed, the same seed always plays the same games')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--max-plies', type=int, default=400, help='stop a game as unfinished after this many plies')
+    parser.add_argument('--output', help='file to write the games to, instead of standard output')
+    parser.add_argument('--book', help='Polyglot opening book that both sides play from while they can')
+    parser.add_argument('--format', choices=('jsonl', 'binary'), default='jsonl',
+                        help='one JSON object per line, or packed binary records with 16-bit encoded moves')
+    args = parser.parse_args(args)
+
+    # Fail on a bad policy name or book before starting any workers
+    make_policy(args.white)
+    make_policy(args.black)
+    if args.book is not None:
+        OpeningBook(args.book).close()
+    if args.format == 'binary' and args.output is None:
+        parser.error('--format binary needs --output')
+
+    start_time = time.perf_counter()
+    games, plies = 0, 0
+    results = dict.fromkeys(RESULT_CODES, 0)
+    output = open(args.output, 'wb' if args.format == 'binary' else 'w') if args.output is not None else sys.stdout
+    try:
+        for record in run_games(args.games, args.white, args.black, args.seed, args.workers, args.max_plies,
+                                args.book):
+            output.write(record.to_bytes() if args.format == 'binary' else record.to_json() + '\n')
+            games += 1
+            plies += len(record.moves)
+            results[record.result] += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start_time
+    print('{} games ({} white wins, {} black wins, {} draws, {} unfinished), {} plies in {:.3f}s: {:.1f} games/s, '
+          '{:.0f} plies/s with {} workers'.format(
+              games, results['1-0'], results['0-1'], results['1/2-1/2'], results['*'], plies, elapsed,
+              games / elapsed if elapsed > 0 else 0, plies / elapsed if elapsed > 0 else 0, args.workers),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import subprocess
+import sys
+import time
+
+# How long to wait for a server started by the benchmark to shut down, in seconds
+SHUTDOWN_TIMEOUT = 30
+
+
+# A client connection to the game server. Requests from many games share the connection and their replies are matched
+# up by id, while game over events are handed to the game they belong to
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.gameover_events = {}
+        self.read_task = asyncio.ensure_future(self.read_replies())
+
+    @classmethod
+    async def connect(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def read_replies(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if 'event' in message:
+                self.gameover_events[message['game']] = message
+            elif message.get('id') in self.pending:
+                self.pending.pop(message['id']).set_result(message)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError('The server closed the connection'))
+
+    # This function sends a request and waits for its reply
+    async def request(self, **request):
+        request['id'] = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request['id']] = future
+        self.writer.write(json.dumps(request, separators=(',', ':')).encode() + b'\n')
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.read_task
+
+
+# This function plays one game of random legal moves on the server. Every move request's round trip time is added to
+# latencies, and the number of moves played is returned
+async def play_game(client, rng, max_plies, latencies):
+    reply = await client.request(op='new')
+    game = reply['game']
+    plies = 0
+    while plies < max_plies:
+        moves = (await client.request(op='legal_moves', game=game))['moves']
+        if not moves:
+            break
+        start_time = time.perf_counter()
+        reply = await client.request(op='move', game=game, move=rng.choice(moves))
+        latencies.append(time.perf_counter() - start_time)
+        if not reply['ok']:
+            raise RuntimeError('The server rejected a legal move: {}'.format(reply['error']))
+        plies += 1
+        if reply['result'] != '*':
+            break
+    await client.request(op='close', game=game)
+    return plies
+
+
+# This function returns the value below which the given fraction of the sorted values fall
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+# This function plays the games concurrently over a number of connections and returns the move latencies in seconds,
+# the number of moves played and the time taken
+async def run_load(host, port, games, connections, max_plies, seed):
+    clients = [await Client.connect(host, port) for _ in range(min(connections, games))]
+    latencies = []
+    start_time = time.perf_counter()
+    plies = await asyncio.gather(*[
+        play_game(clients[index % len(clients)], random.Random(seed + index), max_plies, latencies)
+        for index in range(games)
+    ])
+    elapsed = time.perf_counter() - start_time
+    for client in clients:
+        await client.close()
+    return latencies, sum(plies), elapsed
+
+
+# This function starts a game server in a new process on a free port and returns the process and the port
+def start_server(workers, use_threads):
+    command = [sys.executable, '-m', 'src.game_server', '--port', '0']
+    if workers is not None:
+        command += ['--workers', str(workers)]
+    if use_threads:
+        command.append('--threads')
+    server = subprocess.Popen(command, stderr=subprocess.PIPE, text=True)
+    line = server.stderr.readline()
+    if not line.startswith('Listening on'):
+        server.kill()
+        raise RuntimeError('The game server did not start: {}'.format(line.strip()))
+    return server, int(line.rsplit(':', 1)[1])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Measure the move validation latency of the game server under load')
+    parser.add_argument('--games', type=int, default=1000, help='number of games played at the same time')
+    parser.add_argument('--connections', type=int, default=50, help='number of connections the games share')
+    parser.add_argument('--max-plies', type=int, default=40, help='number of plies to play in each game at most')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random moves')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the server')
+    parser.add_argument('--port', type=int, help='port of a running server, instead of starting one')
+    parser.add_argument('--workers', type=int,
+                        help='workers of the server started by the benchmark, one per core by default')
+    parser.add_argument('--threads', action='store_true', help='start the server with worker threads')
+    args = parser.parse_args(args)
+
+    server = None
+    port = args.port
+    if port is None:
+        server, port = start_server(args.workers, args.threads)
+    try:
+        latencies, plies, elapsed = asyncio.run(
+            run_load(args.host, port, args.games, args.connections, args.max_plies, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(SHUTDOWN_TIMEOUT)
+    latencies.sort()
+    print('{} games, {} moves in {:.3f}s ({:.0f} moves/s) over {} connections'.format(
+        args.games, plies, elapsed, plies / elapsed if elapsed > 0 else 0, min(args.connections, args.games)))
+    print('Move validation latency: p50 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms'.format(
+        percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+        (latencies[-1] if latencies else 0) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
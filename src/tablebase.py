@@ -0,0 +1,402 @@
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+import src.constants
+from src.board import ChessBoard, PIECE_TYPE_IDS
+from src.piece import King, Knight, Bishop, Rook, Queen, Pawn
+
+# Tables cover a white king and one other white piece against a lone black king, and positions with the extra piece on
+# the black side are looked up with the colors swapped. A piece that cannot force mate on its own gives a draw in every
+# position, so bishops and knights need no table
+PIECE_LETTERS = {src.constants.QUEEN: 'Q', src.constants.ROOK: 'R', src.constants.PAWN: 'P'}
+LETTER_TYPES = {'Q': Queen, 'R': Rook, 'P': Pawn}
+MATERIALS = ['KQK', 'KRK', 'KPK']
+DRAWN_PROMOTIONS = (Bishop, Knight)
+
+# Positions are indexed by side to move (0 for white), then the squares of the white king, the black king and the extra
+# piece, each numbered rank * 8 + file
+ENTRY_COUNT = 2 * 64 * 64 * 64
+
+# Every position is stored in one byte from the point of view of the player to move: 0 for a draw, 1-126 for a win that
+# mates in that many plies, 127 for stalemate, 128 plus the number of plies until mate for a loss, and 255 for positions
+# that cannot come up in a game
+DRAW = 0
+STALEMATE = 127
+LOSS = 128
+INVALID = 255
+MAX_PLIES = 126
+
+# Results returned by probes, from the point of view of the player to move
+WIN_RESULT = 1
+DRAW_RESULT = 0
+LOSS_RESULT = -1
+
+# Table files are a header of a magic number, the material and the number of entries, followed by one byte per position
+HEADER = struct.Struct('<4s4sI')
+MAGIC = b'CTB1'
+TABLE_EXTENSION = '.ctb'
+
+# The kind of each position found by the analysis, before any values are worked out
+NORMAL = 0
+MATED = 1
+STALEMATED = 2
+ILLEGAL = 3
+
+# How many positions each task of the parallel analysis covers
+CHUNK_SIZE = 4096
+
+
+def get_index(white_to_move, white_king, black_king, piece_square):
+    return (((0 if white_to_move else 1) * 64 + white_king) * 64 + black_king) * 64 + piece_square
+
+
+def split_index(index):
+    return index >> 18 == 0, (index >> 12) & 63, (index >> 6) & 63, index & 63
+
+
+# This function turns a stored byte into a (result, plies to mate) pair, or None for a position that cannot come up.
+# Draws and stalemates have no plies to mate
+def decode_value(value):
+    if value == INVALID:
+        return None
+    if value == DRAW or value == STALEMATE:
+        return DRAW_RESULT, None
+    if value < LOSS:
+        return WIN_RESULT, value
+    return LOSS_RESULT, value - LOSS
+
+
+# A set of tables read through memory maps. Opening them reads nothing, and a probe reads a single byte, so probes take
+# about as long as it takes to find the pieces on the board. Worker processes share the tables through the page cache
+class Tablebase:
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.files = []
+        for material in MATERIALS:
+            path = os.path.join(directory, material + TABLE_EXTENSION)
+            if os.path.exists(path):
+                self.tables[material[1]] = self.open_table(path, material)
+
+    def open_table(self, path, material):
+        table_file = open(path, 'rb')
+        self.files.append(table_file)
+        data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, table_material, entry_count = HEADER.unpack_from(data)
+        if magic != MAGIC or table_material.rstrip(b'\0').decode() != material or entry_count != ENTRY_COUNT or \
+                len(data) != HEADER.size + ENTRY_COUNT:
+            raise ValueError('{} is not a {} table'.format(path, material))
+        return data
+
+    def close(self):
+        for data in self.tables.values():
+            data.close()
+        for table_file in self.files:
+            table_file.close()
+        self.tables = {}
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Boards hold on to their tablebase, and may be copied or sent to worker processes. The maps are shared by copies
+    # instead of copied, and reopened in other processes
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getstate__(self):
+        return self.directory
+
+    def __setstate__(self, directory):
+        self.__init__(directory)
+
+    # This function returns the stored byte for the position on the board, or None if no table covers it
+    def probe_value(self, board):
+        pieces = board.pieces
+        if len(pieces) != 3 or board.get_castling_rights():
+            return None
+        extra = None
+        kings = [None, None]
+        for piece in pieces:
+            if piece.id == src.constants.KING:
+                kings[piece.color] = piece
+            else:
+                extra = piece
+        if extra is None or extra.id not in PIECE_LETTERS:
+            return None
+        table = self.tables.get(PIECE_LETTERS[extra.id])
+        if table is None:
+            return None
+        strong, weak = kings[extra.color], kings[1 - extra.color]
+        # With the extra piece on the black side, the board is looked at upside down with the colors swapped
+        if extra.color == src.constants.WHITE:
+            index = get_index(board.player_turn == src.constants.WHITE, strong.rank * 8 + strong.file,
+                              weak.rank * 8 + weak.file, extra.rank * 8 + extra.file)
+        else:
+            index = get_index(board.player_turn == src.constants.BLACK, (7 - strong.rank) * 8 + strong.file,
+                              (7 - weak.rank) * 8 + weak.file, (7 - extra.rank) * 8 + extra.file)
+        return table[HEADER.size + index]
+
+    # This function returns the result of the position for the player to move as a (result, plies to mate) pair, where
+    # the result is WIN_RESULT, DRAW_RESULT or LOSS_RESULT. It returns None if no table covers the position
+    def probe(self, board):
+        value = self.probe_value(board)
+        return decode_value(value) if value is not None else None
+
+    # This function tells check_gameover whether the position is 'CHECKMATE', 'STALEMATE' or 'PLAYING' without
+    # generating any moves, or returns None if no table covers the position
+    def probe_terminal(self, board):
+        value = self.probe_value(board)
+        if value is None or value == INVALID:
+            return None
+        if value == LOSS:
+            return 'CHECKMATE'
+        if value == STALEMATE:
+            return 'STALEMATE'
+        return 'PLAYING'
+
+
+# Each worker process keeps one board to set positions up on, and the tables that promotions lead into
+worker_board = None
+worker_tablebase = None
+
+
+def initialize_worker(directory):
+    global worker_board, worker_tablebase
+    worker_board = ChessBoard(pieces=[])
+    worker_tablebase = Tablebase(directory)
+
+
+# This function sets a position up on the worker's board, returning false if the pieces overlap or the kings touch
+def set_up_position(board, piece_type, white_to_move, white_king, black_king, piece_square):
+    if white_king == black_king or piece_square == white_king or piece_square == black_king:
+        return False
+    if abs(white_king // 8 - black_king // 8) <= 1 and abs(white_king % 8 - black_king % 8) <= 1:
+        return False
+    if piece_type is Pawn and piece_square // 8 in (0, 7):
+        return False
+    pieces = [King(white_king // 8, white_king % 8, src.constants.WHITE),
+              King(black_king // 8, black_king % 8, src.constants.BLACK),
+              piece_type(piece_square // 8, piece_square % 8, src.constants.WHITE)]
+    for piece in pieces:
+        piece.can_castle = False
+    board.player_turn = src.constants.WHITE if white_to_move else src.constants.BLACK
+    board.en_passant_square = None
+    # Setting the pieces also works out the Zobrist key, which the move caches depend on, for the player to move
+    board.pieces = pieces
+    return True
+
+
+# This function finds the kind of every position in a range of the table and its moves. Moves that stay in the table
+# are given as the index of the position they lead to. Moves that leave it, by capturing the extra piece or promoting a
+# pawn, are given as -1 minus the stored byte of the position they lead to, which is already known. The kinds, the
+# start of each position's moves and the moves are returned as arrays
+def analyse_positions(task):
+    material, start, stop = task
+    piece_type = LETTER_TYPES[material[1]]
+    board = worker_board
+    kinds = array('B')
+    offsets = array('I')
+    successors = array('i')
+    for index in range(start, stop):
+        offsets.append(len(successors))
+        white_to_move, white_king, black_king, piece_square = split_index(index)
+        if not set_up_position(board, piece_type, white_to_move, white_king, black_king, piece_square) or \
+                board.is_in_check(1 - board.player_turn):
+            kinds.append(ILLEGAL)
+            continue
+        moves = board.get_all_legal_moves()
+        if not moves:
+            kinds.append(MATED if board.is_in_check(board.player_turn) else STALEMATED)
+            continue
+        kinds.append(NORMAL)
+        for piece, (rank, file), promotion_type in moves:
+            square = rank * 8 + file
+            if piece.color == src.constants.BLACK:
+                if square == piece_square:
+                    # The black king takes the last white piece
+                    successors.append(-1 - DRAW)
+                else:
+                    successors.append(get_index(True, white_king, square, piece_square))
+            elif piece.id == src.constants.KING:
+                successors.append(get_index(False, square, black_king, piece_square))
+            elif promotion_type is None:
+                successors.append(get_index(False, white_king, black_king, square))
+            elif promotion_type in DRAWN_PROMOTIONS:
+                successors.append(-1 - DRAW)
+            else:
+                table = worker_tablebase.tables.get(PIECE_LETTERS[PIECE_TYPE_IDS[promotion_type]])
+                if table is None:
+                    raise ValueError('{} needs the tables its pawn promotes into'.format(material))
+                successors.append(-1 - table[HEADER.size + get_index(False, white_king, black_king, square)])
+    offsets.append(len(successors))
+    return start, kinds, offsets, successors
+
+
+# This function works out the value of every position by retrograde analysis. Mated positions are losses in 0 plies.
+# Going outwards one ply at a time, a position with a move to a loss in n plies is a win in n + 1, and a position whose
+# moves all lead to wins, the slowest in n plies, is a loss in n + 1. Taking the positions in order of distance makes
+# every win as quick and every loss as slow as it can be. Whatever is left at the end is a draw
+def solve(kinds, offsets, successors):
+    values = bytearray([DRAW]) * ENTRY_COUNT
+    # The moves of each position that have not yet been shown to lose for it
+    remaining = array('H', bytes(2 * ENTRY_COUNT))
+    # Positions that cannot be lost because one of their moves leaves the table to a draw or better
+    can_lose = bytearray([1]) * ENTRY_COUNT
+    # The slowest mate the opponent can reach through a move that leaves the table, in plies
+    exit_plies = bytearray(ENTRY_COUNT)
+    # The positions found at each distance, as indices with a set top bit for wins
+    buckets = [[] for _ in range(MAX_PLIES + 2)]
+    predecessor_counts = array('I', bytes(4 * (ENTRY_COUNT + 1)))
+    for index in range(ENTRY_COUNT):
+        kind = kinds[index]
+        if kind == ILLEGAL:
+            values[index] = INVALID
+            continue
+        if kind == MATED:
+            buckets[0].append(index)
+            continue
+        if kind == STALEMATED:
+            values[index] = STALEMATE
+            continue
+        internal = 0
+        for successor in successors[offsets[index]:offsets[index + 1]]:
+            if successor >= 0:
+                internal += 1
+                predecessor_counts[successor + 1] += 1
+                continue
+            outcome = decode_value(-1 - successor)
+            if outcome[0] == LOSS_RESULT:
+                buckets[outcome[1] + 1].append(index | (1 << 31))
+            elif outcome[0] == WIN_RESULT:
+                exit_plies[index] = max(exit_plies[index], outcome[1])
+            else:
+                can_lose[index] = 0
+        remaining[index] = internal
+        if internal == 0 and can_lose[index]:
+            buckets[exit_plies[index] + 1].append(index)
+
+    # Turn the moves around, so each position lists the positions with a move into it
+    for index in range(ENTRY_COUNT):
+        predecessor_counts[index + 1] += predecessor_counts[index]
+    predecessor_offsets = array('I', predecessor_counts)
+    predecessors = array('I', bytes(4 * predecessor_counts[ENTRY_COUNT]))
+    for index in range(ENTRY_COUNT):
+        for successor in successors[offsets[index]:offsets[index + 1]]:
+            if successor >= 0:
+                predecessors[predecessor_counts[successor]] = index
+                predecessor_counts[successor] += 1
+
+    resolved = bytearray(ENTRY_COUNT)
+    for plies in range(MAX_PLIES + 1):
+        for entry in buckets[plies]:
+            index = entry & ((1 << 31) - 1)
+            if resolved[index] or values[index] != DRAW:
+                continue
+            resolved[index] = 1
+            if entry >> 31:
+                values[index] = plies
+                for predecessor in predecessors[predecessor_offsets[index]:predecessor_offsets[index + 1]]:
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0 and can_lose[predecessor] and not resolved[predecessor]:
+                        buckets[max(plies, exit_plies[predecessor]) + 1].append(predecessor)
+            else:
+                values[index] = LOSS + plies
+                for predecessor in predecessors[predecessor_offsets[index]:predecessor_offsets[index + 1]]:
+                    if not resolved[predecessor]:
+                        buckets[plies + 1].append(predecessor | (1 << 31))
+    return values
+
+
+# This function builds the table for a material set and writes it to the directory. The positions are analysed in
+# parallel across worker processes, then solved in this process
+def generate(material, directory, workers=None):
+    workers = workers if workers is not None else os.cpu_count()
+    kinds = array('B')
+    offsets = array('I')
+    successors = array('i')
+    tasks = [(material, start, min(start + CHUNK_SIZE, ENTRY_COUNT)) for start in range(0, ENTRY_COUNT, CHUNK_SIZE)]
+    with multiprocessing.Pool(workers, initializer=initialize_worker, initargs=(directory,)) as pool:
+        for start, chunk_kinds, chunk_offsets, chunk_successors in pool.imap(analyse_positions, tasks):
+            base = len(successors)
+            kinds.extend(chunk_kinds)
+            offsets.extend(offset + base for offset in chunk_offsets[:-1])
+            successors.extend(chunk_successors)
+    offsets.append(len(successors))
+    values = solve(kinds, offsets, successors)
+    path = os.path.join(directory, material + TABLE_EXTENSION)
+    with open(path, 'wb') as table_file:
+        table_file.write(HEADER.pack(MAGIC, material.encode(), ENTRY_COUNT))
+        table_file.write(values)
+    return values
+
+
+# This function lists the materials to generate in order, with the tables a pawn promotes into ahead of the pawn's
+def get_generation_order(materials):
+    order = []
+    for material in materials:
+        if material == 'KPK':
+            order.extend(dependency for dependency in ('KQK', 'KRK') if dependency not in order)
+        if material not in order:
+            order.append(material)
+    return order
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Generate endgame tablebases or look positions up in them')
+    parser.add_argument('--directory', default='tablebases', help='directory the tables are kept in')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    generate_parser = subparsers.add_parser('generate', help='build tables by retrograde analysis')
+    # Some versions of argparse check even an empty list of materials against the choices, so they are checked below
+    generate_parser.add_argument('materials', nargs='*',
+                                 help='material sets to build out of {}, all of them by default'.format(
+                                     ', '.join(MATERIALS)))
+    generate_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    generate_parser.add_argument('--force', action='store_true', help='rebuild tables that already exist')
+    probe_parser = subparsers.add_parser('probe', help='look a position up')
+    probe_parser.add_argument('fen', help='position to look up')
+    args = parser.parse_args(args)
+
+    if args.command == 'probe':
+        board = ChessBoard.from_fen(args.fen)
+        with Tablebase(args.directory) as tablebase:
+            result = tablebase.probe(board)
+        if result is None:
+            print('Not in the tablebase')
+        elif result[0] == DRAW_RESULT:
+            print('Draw')
+        else:
+            print('{} in {} plies'.format('Mate' if result[0] == WIN_RESULT else 'Mated', result[1]))
+        return 0
+
+    for material in args.materials:
+        if material not in MATERIALS:
+            parser.error('unknown material {}, choose from {}'.format(material, ', '.join(MATERIALS)))
+    os.makedirs(args.directory, exist_ok=True)
+    for material in get_generation_order(args.materials or MATERIALS):
+        path = os.path.join(args.directory, material + TABLE_EXTENSION)
+        if os.path.exists(path) and not args.force:
+            print('{}: {} already exists, use --force to rebuild it'.format(material, path))
+            continue
+        start_time = time.perf_counter()
+        values = generate(material, args.directory, args.workers)
+        wins = sum(1 for value in values if 0 < value < STALEMATE)
+        losses = sum(1 for value in values if LOSS <= value < INVALID)
+        longest = max((value for value in values if 0 < value < STALEMATE), default=0)
+        print('{}: {} wins, {} losses, {} draws, longest mate {} plies, written to {} in {:.1f}s'.format(
+            material, wins, losses, sum(1 for value in values if value in (DRAW, STALEMATE)), longest, path,
+            time.perf_counter() - start_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
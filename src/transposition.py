@@ -0,0 +1,44 @@
+# What a stored value means: the exact score, or a bound on it when the search was cut off
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+
+# A fixed-size table of search results indexed by Zobrist key. Each slot holds one entry as a tuple of
+# (key, depth, value, flag, best move, generation). When two positions land in the same slot, the entry searched to the
+# greater depth is kept, unless it was left over from an earlier search, in which case the newer entry always wins.
+class TranspositionTable:
+    def __init__(self, size=1 << 20):
+        # Round the size down to a power of two so that the slot is just the low bits of the key
+        self.size = 1 << (max(size, 1).bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    # This function returns the entry stored for a key, or None if the position is not in the table
+    def probe(self, key):
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    # This function stores a result for a key, replacing the entry already in the slot if the new one is more useful
+    def store(self, key, depth, value, flag=EXACT, best_move=None):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or depth >= entry[1] or entry[5] != self.generation:
+            self.entries[index] = (key, depth, value, flag, best_move, self.generation)
+
+    # This function marks the start of a new search, so entries from earlier searches are the first to be replaced
+    def new_search(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
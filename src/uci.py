@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import sys
+import threading
+import time
+
+import src.constants
+from src.board import ChessBoard
+from src.engine import Engine, score_to_string
+from src.notation import move_to_string, string_to_move
+from src.opening_book import OpeningBook
+from src.tablebase import Tablebase
+
+ENGINE_NAME = 'chess'
+ENGINE_AUTHOR = 'the chess authors'
+
+# How often, in seconds, the node count and speed of a running search are reported between completed iterations
+PROGRESS_INTERVAL = 1.0
+# When playing on a clock without a move count, the remaining time is shared out as if this many moves were left
+DEFAULT_MOVES_TO_GO = 30
+# Time kept back from every move for the interface to receive it, in seconds
+MOVE_OVERHEAD = 0.05
+
+
+# This function works out how many seconds to spend on a move from the parameters of a go command, or None to search
+# without a time limit
+def get_time_limit(parameters, player_turn):
+    if 'movetime' in parameters:
+        return max(parameters['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+    clock, increment = ('wtime', 'winc') if player_turn == src.constants.WHITE else ('btime', 'binc')
+    if clock not in parameters:
+        return None
+    remaining = parameters[clock] / 1000
+    moves_to_go = parameters.get('movestogo', DEFAULT_MOVES_TO_GO)
+    budget = remaining / max(moves_to_go, 1) + parameters.get(increment, 0) / 1000 * 0.8
+    # Never plan to use more than half the clock on one move
+    return max(min(budget, remaining / 2) - MOVE_OVERHEAD, 0.01)
+
+
+# This function reads the parameters of a go command into a dictionary of integers, with flags such as infinite set to
+# True
+def parse_go(words):
+    parameters = {}
+    index = 0
+    while index < len(words):
+        word = words[index]
+        if word in ('infinite', 'ponder'):
+            parameters[word] = True
+            index += 1
+        elif word == 'searchmoves':
+            # Restricting the root moves is not supported, so the moves are skipped
+            break
+        elif index + 1 < len(words):
+            try:
+                parameters[word] = int(words[index + 1])
+            except ValueError:
+                pass
+            index += 2
+        else:
+            index += 1
+    return parameters
+
+
+# Speaks the Universal Chess Interface on a pair of text streams. Commands are read on the asyncio event loop while the
+# engine searches in a worker thread, so stop and isready are answered straight away during a search. Only the
+# search thread touches the board while a search runs, and commands that change the position wait for it to finish.
+class UCI:
+    def __init__(self, output=None, use_bitboards=False, book=None, tablebase=None):
+        self.output = output if output is not None else sys.stdout
+        self.output_lock = threading.Lock()
+        self.use_bitboards = use_bitboards
+        self.engine = Engine(book=book, tablebase=tablebase)
+        self.board = self.new_board()
+        self.search_thread = None
+        self.search_start_time = None
+        # Set by stop, or by ponderhit, so an infinite or ponder search that finishes early still waits for it before
+        # giving its best move
+        self.stop_event = threading.Event()
+        # The parameters of a go ponder command until ponderhit, and the timer that stops the search once the move's
+        # time has run out after it
+        self.ponder_parameters = None
+        self.ponder_timer = None
+        self.debug = False
+
+    # This function writes one line to the interface. It is called from both the event loop and the search thread
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def is_searching(self):
+        return self.search_thread is not None and self.search_thread.is_alive()
+
+    # This function handles one line of input and returns false once the interface has asked the engine to quit
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, arguments = words[0], words[1:]
+        if command == 'uci':
+            self.send('id name {}'.format(ENGINE_NAME))
+            self.send('id author {}'.format(ENGINE_AUTHOR))
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'debug':
+            self.debug = arguments[:1] == ['on']
+        elif command == 'ucinewgame':
+            self.stop_search()
+            self.engine.table.clear()
+            self.board = self.new_board()
+        elif command == 'position':
+            self.stop_search()
+            self.set_position(arguments)
+        elif command == 'go':
+            self.stop_search()
+            self.start_search(parse_go(arguments))
+        elif command == 'stop':
+            self.stop_event.set()
+            self.engine.stop()
+        elif command == 'ponderhit':
+            self.ponder_hit()
+        elif command == 'quit':
+            self.stop_search()
+            return False
+        elif self.debug:
+            self.send('info string unknown command {}'.format(command))
+        return True
+
+    # This function returns a board for the start position or a FEN, which asks the engine's tablebase, if it has one,
+    # whether its game is over
+    def new_board(self, fen=None):
+        if fen is None:
+            board = ChessBoard(use_bitboards=self.use_bitboards)
+        else:
+            board = ChessBoard.from_fen(fen, self.use_bitboards)
+        board.tablebase = self.engine.tablebase
+        return board
+
+    # This function sets up the board from a position command: startpos or fen, then any moves played from there
+    def set_position(self, arguments):
+        if 'moves' in arguments:
+            moves = arguments[arguments.index('moves') + 1:]
+            arguments = arguments[:arguments.index('moves')]
+        else:
+            moves = []
+        try:
+            board = self.new_board(' '.join(arguments[1:]) if arguments[:1] == ['fen'] else None)
+            for name in moves:
+                board.make_move(*string_to_move(board, name))
+        except ValueError as error:
+            self.send('info string bad position: {}'.format(error))
+            return
+        self.board = board
+
+    # This function starts searching the current position in a worker thread. Any earlier stop request is cleared
+    # here rather than in the search thread, so a stop that arrives before the thread gets going still stops it
+    def start_search(self, parameters):
+        infinite = parameters.get('infinite', False) or parameters.get('ponder', False)
+        depth = parameters.get('depth')
+        node_limit = parameters.get('nodes')
+        time_limit = None if infinite else get_time_limit(parameters, self.board.player_turn)
+        self.ponder_parameters = parameters if parameters.get('ponder', False) else None
+        self.stop_event.clear()
+        self.engine.clear_stop()
+        self.search_start_time = time.perf_counter()
+        self.search_thread = threading.Thread(target=self.search, args=(depth, time_limit, node_limit, infinite),
+                                              daemon=True)
+        self.search_thread.start()
+
+    # This function runs in the search thread and sends the best move once the search is over
+    def search(self, depth, time_limit, node_limit, infinite):
+        result = self.engine.search(self.board, depth, time_limit, node_limit, self.send_info)
+        # An infinite search may only give its best move after being told to stop
+        if infinite:
+            self.stop_event.wait()
+        self.send('bestmove {}'.format(move_to_string(*result.best_move) if result.best_move is not None else '0000'))
+
+    # This function turns a ponder search into a normal one once the opponent has played the expected move. The search
+    # carries on, and is stopped when the time the go ponder command's clock gives the move has passed since the
+    # ponderhit. Without a clock it carries on until stop, like an infinite search
+    def ponder_hit(self):
+        if self.ponder_parameters is None or not self.is_searching():
+            return
+        parameters, self.ponder_parameters = self.ponder_parameters, None
+        if parameters.get('infinite', False):
+            return
+        time_limit = get_time_limit(parameters, self.board.player_turn)
+        if time_limit is not None:
+            self.ponder_timer = threading.Timer(time_limit, self.engine.stop)
+            self.ponder_timer.daemon = True
+            self.ponder_timer.start()
+        self.stop_event.set()
+
+    # This function reports a completed iteration of the search
+    def send_info(self, result):
+        self.send('info depth {} score {} nodes {} nps {} time {} pv {}'.format(
+            result.depth, score_to_string(result.score), result.nodes, result.nps, int(result.elapsed * 1000),
+            ' '.join(result.pv)))
+
+    # This function reports the node count and speed of the running search
+    def send_progress(self):
+        elapsed = time.perf_counter() - self.search_start_time
+        nodes = self.engine.nodes
+        self.send('info nodes {} nps {} time {}'.format(nodes, int(nodes / elapsed) if elapsed > 0 else 0,
+                                                         int(elapsed * 1000)))
+
+    # This function stops any running search and waits for it to give its best move
+    def stop_search(self):
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.engine.stop()
+            self.search_thread.join()
+            self.search_thread = None
+        if self.ponder_timer is not None:
+            self.ponder_timer.cancel()
+            self.ponder_timer = None
+        self.ponder_parameters = None
+
+    # This function reads commands from input until quit or the end of the input. A thread blocks on reading each line
+    # and hands it to the event loop, which stays free to report the progress of a running search
+    async def run(self, input_file=None):
+        input_file = input_file if input_file is not None else sys.stdin
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def read_input():
+            for line in input_file:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+
+        threading.Thread(target=read_input, daemon=True).start()
+        while True:
+            try:
+                line = await asyncio.wait_for(lines.get(), PROGRESS_INTERVAL)
+            except asyncio.TimeoutError:
+                if self.is_searching():
+                    self.send_progress()
+                continue
+            if line is None or not self.handle(line):
+                break
+        self.stop_search()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Play through the Universal Chess Interface on standard input and '
+                                                 'output')
+    parser.add_argument('--bitboards', action='store_true', help='generate moves with the bitboard engine')
+    parser.add_argument('--book', help='Polyglot opening book to play from before searching')
+    parser.add_argument('--tablebase', help='directory of endgame tables to score positions with few pieces')
+    args = parser.parse_args(args)
+    book = OpeningBook(args.book) if args.book is not None else None
+    tablebase = Tablebase(args.tablebase) if args.tablebase is not None else None
+    asyncio.run(UCI(use_bitboards=args.bitboards, book=book, tablebase=tablebase).run())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())